@@ -0,0 +1,187 @@
+"""On-disk cache for immutable KBase data."""
+
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any
+
+CACHE_FILE_SUFFIX = ".pkl"
+# 2 GiB
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectCache:
+    """Content-addressed on-disk cache with size-based LRU eviction.
+
+    Entries are stored as pickle files named after the SHA-256 hash of their key,
+    so only keys that identify immutable data (e.g. versioned UPAs) should be used.
+    Files are written to a temporary file and moved into place, so concurrent
+    readers never see a partial entry. The modification time of an entry is
+    updated whenever it is read, and the least recently used entries are removed
+    when the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(
+        self: "ObjectCache",
+        cache_dir: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        name: str = "object",
+    ) -> None:
+        """Initialise an instance of the class.
+
+        :param self: class instance
+        :type self: ObjectCache
+        :param cache_dir: directory to store the cache files in; created if it does not exist
+        :type cache_dir: str
+        :param max_bytes: maximum total size of the cache files, defaults to DEFAULT_MAX_BYTES
+        :type max_bytes: int
+        :param name: name of the cache, used in log messages, defaults to "object"
+        :type name: str
+        :raises ValueError: if max_bytes is not positive
+        """
+        if max_bytes <= 0:
+            err_msg = f"Invalid cache size {max_bytes}: must be greater than 0"
+            raise ValueError(err_msg)
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self: "ObjectCache", key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}{CACHE_FILE_SUFFIX}")
+
+    def get(self: "ObjectCache", key: str) -> object | None:
+        """Retrieve an entry from the cache.
+
+        :param self: class instance
+        :type self: ObjectCache
+        :param key: cache key
+        :type key: str
+        :return: the cached value, or None if it is not in the cache
+        :rtype: object | None
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                # the entries are only written by `put`, in the app's own cache_dir
+                value = pickle.load(fh)  # noqa: S301
+        except FileNotFoundError:
+            value = None
+        except (OSError, EOFError, pickle.UnpicklingError):
+            logger.warning("Removing unreadable %s cache entry for %s", self.name, key)
+            self._remove(path)
+            value = None
+
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            logger.debug("%s cache miss: %s", self.name, key)
+            return None
+
+        # mark the entry as recently used
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        with self._lock:
+            self.hits += 1
+        logger.debug("%s cache hit: %s", self.name, key)
+        return value
+
+    def put(
+        self: "ObjectCache", key: str, value: object, *, evict: bool = True
+    ) -> None:
+        """Add an entry to the cache, evicting old entries if the cache is full.
+
+        :param self: class instance
+        :type self: ObjectCache
+        :param key: cache key
+        :type key: str
+        :param value: value to cache; must be picklable
+        :type value: object
+        :param evict: whether to evict old entries after adding this one; set to
+            False when adding several entries and call `evict` afterwards, defaults to True
+        :type evict: bool
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        if evict:
+            self.evict()
+
+    def evict(self: "ObjectCache") -> None:
+        """Remove the least recently used entries until the cache fits within max_bytes.
+
+        :param self: class instance
+        :type self: ObjectCache
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            logger.info("%s cache: evicted %s", self.name, os.path.basename(path))
+
+    def stats(self: "ObjectCache") -> dict[str, int]:
+        """Return the number of cache hits and misses.
+
+        :param self: class instance
+        :type self: ObjectCache
+        :return: dict with keys "hits" and "misses"
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def make_object_cache(
+    config: dict[str, Any], name: str = "object"
+) -> ObjectCache | None:
+    """Create a cache from the app config.
+
+    The cache is only enabled if `config["object-cache-dir"]` is set; it should
+    point at persistent storage, as the scratch directory is removed after each
+    job. Setting `object-cache-max-bytes` to 0 also disables caching.
+
+    :param config: app config
+    :type config: dict[str, Any]
+    :param name: name of the cache; used as the name of the subdirectory, defaults to "object"
+    :type name: str
+    :return: the cache, or None if caching is disabled
+    :rtype: ObjectCache | None
+    """
+    base_dir = config.get("object-cache-dir")
+    max_bytes = config.get("object-cache-max-bytes")
+    max_bytes = DEFAULT_MAX_BYTES if max_bytes in (None, "") else int(max_bytes)
+    if not base_dir or max_bytes <= 0:
+        return None
+    return ObjectCache(os.path.join(base_dir, name), max_bytes, name)
@@ -1,6 +1,7 @@
 """Constants used throughout the codebase."""
 
 ALL = "all"
+COLS = "columns"
 DATA = "data"
 DL = "dict_list"
 DISPLAY = "display"
@@ -10,15 +11,27 @@ INFO = "infostruct"
 INTERSECT = "intersection"
 JOIN_LIST = "join_list"
 KEYS = "keys"
+LONG = "long"
 REF = "ref"
 REFS = "refs"
 REQD_FIELDS = "required_fields"
 T1 = "t1"
 T2 = "t2"
+WIDE = "wide"
 XTRA = "extras"
 
+HTTP_CONNECT_RETRIES = 3
+# maximum number of connections kept open to each host
+HTTP_POOL_SIZE = 10
+HTTP_RETRY_BACKOFF = 0.5
 MAX_CONNECTIONS_PER_NODE = 2
 MAX_REFS = 3
+# maximum number of samples in a single SampleService request
+SAMPLE_BATCH_SIZE = 500
+# number of times to retry a failed SampleService request
+SAMPLE_REQUEST_RETRIES = 3
+# timeout for KBase service requests, in seconds
+REQUEST_TIMEOUT = 300
 
 BASE_ERROR_MESSAGE = "Combinatrix encountered the following errors"
 PARAM_ERROR_MESSAGE = f"{BASE_ERROR_MESSAGE} in the input parameters:\n"
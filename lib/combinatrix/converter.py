@@ -1,18 +1,34 @@
 """Convert data from various input formats to delimiter-separated data."""
 
 import json
+import logging
 from copy import deepcopy
 from typing import Any
 
-from combinatrix.constants import DATA, DL, FN, KEYS
+import numpy as np
+import pandas as pd
+
+from combinatrix.constants import COLS, DATA, DL, FN, KEYS, LONG, WIDE
 from combinatrix.util import get_data_type, get_upa
 
+logger = logging.getLogger(__name__)
+
 
-def convert_data(fetched_data: dict[str, Any]) -> dict[str, Any]:
+def convert_data(
+    fetched_data: dict[str, Any],
+    *,
+    columnar: bool = False,
+    converter_options: dict[str, dict[str, Any]] | None = None,
+) -> dict[str, Any]:
     """Convert data into a format that can be used in `combine_data`.
 
     :param fetched_data: data from the workspace, indexed by ref
     :type fetched_data: dict[str, Any]
+    :param columnar: use the columnar converters where available, defaults to False
+    :type columnar: bool
+    :param converter_options: extra keyword args for the converters, indexed by
+        converter name (e.g. "Matrix"), defaults to None
+    :type converter_options: dict[str, dict[str, Any]] | None
     :raises RuntimeError: if there are errors in converting the data
     :return: fetched_data with converted data integrated into it
     :rtype: dict[str, Any]
@@ -22,7 +38,11 @@ def convert_data(fetched_data: dict[str, Any]) -> dict[str, Any]:
         try:
             fetched_data[ref] = {
                 **fetched_data[ref],
-                **convert_ws_object(fetched_data[ref]),
+                **convert_ws_object(
+                    fetched_data[ref],
+                    columnar=columnar,
+                    converter_options=converter_options,
+                ),
             }
         except (ValueError, RuntimeError) as e:
             errors.append(e.args[0])
@@ -35,18 +55,28 @@ def convert_data(fetched_data: dict[str, Any]) -> dict[str, Any]:
     return fetched_data
 
 
-def convert_ws_object(object_data: dict[str, Any]) -> dict[str, Any]:
+def convert_ws_object(
+    object_data: dict[str, Any],
+    *,
+    columnar: bool = False,
+    converter_options: dict[str, dict[str, Any]] | None = None,
+) -> dict[str, Any]:
     """Convert workspace data into a tabular form for further processing.
 
     :param object_data: the workspace data for an object
     :type object_data: dict[str, dict[str, Any]]
+    :param columnar: use the columnar converters where available, defaults to False
+    :type columnar: bool
+    :param converter_options: extra keyword args for the converters, indexed by
+        converter name (e.g. "Matrix"), defaults to None
+    :type converter_options: dict[str, dict[str, Any]] | None
     :raises ValueError: if there is any issue in finding an appropriate converter
     :return: amended object_data structure with info in tabular form
     :rtype: dict[str, dict[str, Any]]
     """
     converters = {
-        "SampleSet": convert_samples,
-        "Matrix": convert_matrix,
+        "SampleSet": convert_samples_columnar if columnar else convert_samples,
+        "Matrix": convert_matrix_columnar if columnar else convert_matrix,
     }
 
     object_data_type = get_data_type(object_data)
@@ -57,14 +87,17 @@ def convert_ws_object(object_data: dict[str, Any]) -> dict[str, Any]:
 
     conv = matching_converters[0]
     # run the converter
-    return converters[conv](object_data)
+    return converters[conv](object_data, **(converter_options or {}).get(conv, {}))
 
 
 def convert_samples(object_data: dict[str, Any]) -> dict[str, Any]:
     """Parse sample data and flatten it out for combinatrixing.
 
-    :param sample_list: the `sample_data` value
-    :type sample_list: list[dict[str, Any]]
+    The `sample_data` value may be any iterable of samples, e.g. the generator
+    returned by `DataFetcher.iter_samples`; it is only iterated over once.
+
+    :param object_data: SampleSet object, with the samples in `data.sample_data`
+    :type object_data: dict[str, Any]
     :return: dict containing the fieldnames and a list of samples data dicts
     :rtype: dict[str, Any]
     """
@@ -119,6 +152,10 @@ def convert_samples(object_data: dict[str, Any]) -> dict[str, Any]:
         parsed_samples.append(sample_data)
         keys["all"].update(sample_data.keys())
 
+    if not parsed_samples:
+        err_msg = f"{get_upa(object_data)}: no 'data.sample_data' field found"
+        raise ValueError(err_msg)
+
     return {
         KEYS: {
             "controlled": keys["controlled"],
@@ -129,14 +166,123 @@ def convert_samples(object_data: dict[str, Any]) -> dict[str, Any]:
     }
 
 
-def convert_matrix(object_data: dict[str, Any]) -> dict[str, Any]:
-    """Convert matrix data (as a dataframe-type rows/cols/values dump) into a list of lists.
+def _sample_node(sample: dict[str, Any], upa: str) -> dict[str, Any]:
+    """Find the node in a sample's node tree with the same ID as the sample name."""
+    sample_name = sample["name"]
+    node = None
+    n_nodes = 0
+    for nt in sample["node_tree"]:
+        if nt["id"] == sample_name:
+            node = nt
+            n_nodes += 1
+    if n_nodes != 1:
+        err_msg = f"{upa}: incorrect number of sample node trees for sample {sample['id']}, {sample['name']}"
+        raise ValueError(err_msg)
+    return node
 
-    :param object_data: source, a dictionary with keys 'row_ids', 'col_ids', and 'values'
+
+def _meta_value(node_value: dict[str, Any]) -> object:
+    """Get the value of a metadata field, with its units if it has any."""
+    node_keys = node_value.keys()
+    if node_keys == {"value"}:
+        return node_value["value"]
+    if node_keys == {"value", "units"}:
+        return f"{node_value['value']} {node_value['units']}"
+    logger.warning("unrecognised configuration: keys: %s", ", ".join(node_value.keys()))
+    return json.dumps(node_value, indent=0)
+
+
+def _sample_row(
+    sample: dict[str, Any],
+    upa: str,
+    fields: list[str] | None,
+    keys: dict[str, set[str]],
+) -> dict[str, Any]:
+    """Flatten a sample into a row, adding its metadata field names to `keys`."""
+    snt = _sample_node(sample, upa)
+    if fields is None:
+        row = {key: value for key, value in sample.items() if key != "node_tree"}
+        row["type"] = snt["type"]
+    else:
+        row = {
+            key: sample[key] for key in fields if key in sample and key != "node_tree"
+        }
+        if "type" in fields:
+            row["type"] = snt["type"]
+    for key_type in ["user", "controlled"]:
+        meta = snt.get(f"meta_{key_type}")
+        if not meta:
+            continue
+        meta_keys = meta if fields is None else [k for k in fields if k in meta]
+        keys[key_type].update(meta_keys)
+        for key in meta_keys:
+            row[key] = _meta_value(meta[key])
+    return row
+
+
+def convert_samples_columnar(
+    object_data: dict[str, Any], *, fields: list[str] | None = None
+) -> dict[str, Any]:
+    """Flatten sample data into columns, one list of values per field.
+
+    The output has the same fields and values as `convert_samples`, with None
+    for fields that a sample does not have, but the samples are not copied: each
+    flattened row is built from the sample's top-level fields and metadata.
+
+    If `fields` is given, only those fields are converted; any that are not in
+    the samples are left out of the output.
+
+    :param object_data: SampleSet object, with the samples in `data.sample_data`
     :type object_data: dict[str, Any]
-    :raises ValueError: if any of the required keys are not found
-    :return: the dataset reorganised as a list of dicts (with an 'id' field added), a set of fieldnames.
-    :rtype: list[list[Any]]
+    :param fields: names of the fields to convert, defaults to None (all fields)
+    :type fields: list[str] | None
+    :return: dict containing the fieldnames and the data as a dict of columns
+    :rtype: dict[str, Any]
+    """
+    sample_data = object_data.get(DATA, {}).get("sample_data")
+    if not sample_data:
+        err_msg = f"{get_upa(object_data)}: no 'data.sample_data' field found"
+        raise ValueError(err_msg)
+
+    upa = get_upa(object_data)
+    keys: dict[str, set[str]] = {"user": set(), "controlled": set()}
+    columns: dict[str, list[Any]] = {}
+    n_samples = 0
+    for sample in sample_data:
+        row = _sample_row(sample, upa, fields, keys)
+
+        # columns are padded with None for fields that earlier samples lacked
+        for key, value in row.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * n_samples
+            elif len(column) < n_samples:
+                column.extend([None] * (n_samples - len(column)))
+            column.append(value)
+        n_samples += 1
+
+    if not n_samples:
+        err_msg = f"{upa}: no 'data.sample_data' field found"
+        raise ValueError(err_msg)
+
+    for column in columns.values():
+        column.extend([None] * (n_samples - len(column)))
+
+    return {
+        KEYS: keys,
+        FN: set(columns),
+        COLS: columns,
+    }
+
+
+def get_matrix_data(object_data: dict[str, Any]) -> dict[str, Any]:
+    """Retrieve and validate the rows/cols/values dump from a matrix object.
+
+    :param object_data: matrix object, with the matrix under 'data.data'
+    :type object_data: dict[str, Any]
+    :raises ValueError: if 'data.data' or any of the required keys are not found
+    :return: the contents of 'data.data'
+    :rtype: dict[str, Any]
     """
     matrix_data = object_data.get(DATA, {}).get(DATA)
     if not matrix_data:
@@ -144,7 +290,9 @@ def convert_matrix(object_data: dict[str, Any]) -> dict[str, Any]:
         raise ValueError(err_msg)
     # ensure we have the correct keys
     missing_keys = [
-        k for k in ["col_ids", "row_ids", "values"] if not matrix_data.get(k)
+        k
+        for k in ["col_ids", "row_ids", "values"]
+        if matrix_data.get(k) is None or len(matrix_data[k]) == 0
     ]
     if missing_keys:
         err_msg = (
@@ -152,6 +300,19 @@ def convert_matrix(object_data: dict[str, Any]) -> dict[str, Any]:
             + ", ".join(missing_keys)
         )
         raise ValueError(err_msg)
+    return matrix_data
+
+
+def convert_matrix(object_data: dict[str, Any]) -> dict[str, Any]:
+    """Convert matrix data (as a dataframe-type rows/cols/values dump) into a list of lists.
+
+    :param object_data: source, a dictionary with keys 'row_ids', 'col_ids', and 'values'
+    :type object_data: dict[str, Any]
+    :raises ValueError: if any of the required keys are not found
+    :return: the dataset reorganised as a list of dicts (with an 'id' field added), a set of fieldnames.
+    :rtype: list[list[Any]]
+    """
+    matrix_data = get_matrix_data(object_data)
 
     matrix_as_dicts = []
     # Iterate through the data and create dictionaries
@@ -172,3 +333,148 @@ def convert_matrix(object_data: dict[str, Any]) -> dict[str, Any]:
         FN: {"id", "column_id", "row_id", "value"},
         DL: matrix_as_dicts,
     }
+
+
+def get_matrix_values(object_data: dict[str, Any]) -> np.ndarray:
+    """Retrieve the matrix values as a two-dimensional numeric array.
+
+    Null values in the matrix are converted to NaN.
+
+    :param object_data: matrix object, with the matrix under 'data.data'
+    :type object_data: dict[str, Any]
+    :raises ValueError: if the values do not form a (rows x cols) numeric matrix
+    :return: array of shape (len(row_ids), len(col_ids))
+    :rtype: np.ndarray
+    """
+    matrix_data = get_matrix_data(object_data)
+    values = np.asarray(matrix_data["values"])
+    if values.dtype.kind not in "biuf":
+        try:
+            values = values.astype(np.float64)
+        except (TypeError, ValueError) as e:
+            err_msg = f"{get_upa(object_data)}: 'data.data.values' must be numeric"
+            raise ValueError(err_msg) from e
+
+    expected_shape = (len(matrix_data["row_ids"]), len(matrix_data["col_ids"]))
+    if values.shape != expected_shape:
+        err_msg = (
+            f"{get_upa(object_data)}: 'data.data.values' has shape {values.shape}; "
+            f"expected {expected_shape}"
+        )
+        raise ValueError(err_msg)
+    return values
+
+
+def _to_categories(object_data: dict[str, Any], key: str) -> pd.Index:
+    """Convert a list of matrix IDs into a unique index for use as categories."""
+    ids = pd.Index(get_matrix_data(object_data)[key])
+    if not ids.is_unique:
+        err_msg = f"{get_upa(object_data)}: 'data.data.{key}' contains duplicate IDs"
+        raise ValueError(err_msg)
+    return ids
+
+
+def convert_matrix_columnar(
+    object_data: dict[str, Any],
+    *,
+    layout: str = LONG,
+    include_id: bool = False,
+    drop_zeros: bool = False,
+) -> dict[str, Any]:
+    """Convert matrix data into columns without building per-cell objects.
+
+    In the "long" layout, the output has the same rows, in the same order, as
+    `convert_matrix`, but is held as one array per field: `column_id` and `row_id`
+    are categoricals (one integer code per cell) and `value` is the flattened
+    numeric matrix.
+
+    With `drop_zeros`, cells with a value of zero are left out of the long layout,
+    which then holds the matrix in coordinate (COO) form: its size scales with the
+    number of non-zero cells. The categories of `column_id` and `row_id` still
+    list every matrix column and row, so the shape of the matrix is kept.
+
+    In the "wide" layout, the matrix keeps its shape: there is a `row_id` column
+    followed by one numeric column per matrix column, named by its column ID.
+
+    :param object_data: source, a dictionary with keys 'row_ids', 'col_ids', and 'values'
+    :type object_data: dict[str, Any]
+    :param layout: either "long" or "wide", defaults to "long"
+    :type layout: str
+    :param include_id: whether to generate the synthetic 'id' field in the long
+        layout, defaults to False
+    :type include_id: bool
+    :param drop_zeros: whether to leave out cells with a value of zero in the long
+        layout, defaults to False
+    :type drop_zeros: bool
+    :raises ValueError: if any of the required keys are not found or the values are invalid
+    :return: dict containing the fieldnames and the data as a dict of columns
+    :rtype: dict[str, Any]
+    """
+    if layout not in (LONG, WIDE):
+        err_msg = f"Invalid matrix layout '{layout}': must be '{LONG}' or '{WIDE}'"
+        raise ValueError(err_msg)
+
+    values = get_matrix_values(object_data)
+    col_ids = _to_categories(object_data, "col_ids")
+    row_ids = _to_categories(object_data, "row_ids")
+    n_rows, n_cols = values.shape
+
+    if layout == WIDE:
+        if "row_id" in col_ids:
+            err_msg = f"{get_upa(object_data)}: 'row_id' cannot be used as a column ID"
+            raise ValueError(err_msg)
+        # column-major, so that each column is a contiguous view
+        values = np.asfortranarray(values)
+        columns = {
+            "row_id": row_ids.to_numpy(dtype=object),
+            **{col_id: values[:, i] for i, col_id in enumerate(col_ids)},
+        }
+        return {
+            FN: set(columns),
+            COLS: columns,
+        }
+
+    # iterate over columns, then rows, as in `convert_matrix`
+    flat_values = values.ravel(order="F")
+    if drop_zeros:
+        # NaN (null) cells are kept, as their value is unknown
+        cells = np.flatnonzero(flat_values != 0)
+        col_codes, row_codes = np.divmod(cells, n_rows)
+        flat_values = flat_values[cells]
+    else:
+        cells = None
+        col_codes = np.repeat(np.arange(n_cols, dtype=np.int32), n_rows)
+        row_codes = np.tile(np.arange(n_rows, dtype=np.int32), n_cols)
+    columns = {
+        "column_id": pd.Categorical.from_codes(
+            col_codes.astype(np.int32, copy=False), categories=col_ids
+        ),
+        "row_id": pd.Categorical.from_codes(
+            row_codes.astype(np.int32, copy=False), categories=row_ids
+        ),
+        "value": flat_values,
+    }
+
+    if include_id:
+        raw_values = np.asarray(
+            get_matrix_data(object_data)["values"], dtype=object
+        ).ravel(order="F")
+        if cells is not None:
+            raw_values = raw_values[cells]
+        columns["id"] = np.array(
+            [
+                f"{column_id}___{row_id}___{value}"
+                for column_id, row_id, value in zip(
+                    columns["column_id"],
+                    columns["row_id"],
+                    raw_values,
+                    strict=True,
+                )
+            ],
+            dtype=object,
+        )
+
+    return {
+        FN: set(columns),
+        COLS: columns,
+    }
@@ -1,15 +1,39 @@
 """Fetch data from various locations."""
 
 import json
+import logging
+import re
+import threading
+import time
 import uuid
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from typing import Any
 
 import requests
-from installed_clients.WorkspaceClient import Workspace
+from installed_clients.baseclient import ServerError
 
-from combinatrix.constants import DATA
+from combinatrix.cache import make_object_cache
+from combinatrix.constants import (
+    DATA,
+    MAX_CONNECTIONS_PER_NODE,
+    REQUEST_TIMEOUT,
+    SAMPLE_BATCH_SIZE,
+    SAMPLE_REQUEST_RETRIES,
+)
+from combinatrix.json_stream import parse_get_objects2
+from combinatrix.session import SessionClient, get_session, raise_for_response
 from combinatrix.util import get_data_type, get_upa
 
+# a fully-specified UPA, i.e. one that refers to an immutable object version
+VERSIONED_UPA_REGEX = re.compile(r"\d+/\d+/\d+")
+
+# delay before the first retry of a failed request, in seconds; doubled for each retry
+RETRY_BACKOFF = 1.0
+
+logger = logging.getLogger(__name__)
+
 
 class DataFetcher:
     """Class for fetching data from various places."""
@@ -30,12 +54,35 @@ class DataFetcher:
 
         self.workspace_url = f"{kbase_endpoint}/ws"
         self.sample_service_url = f"{kbase_endpoint}/sampleservice"
-        self.ws_client = Workspace(self.workspace_url, token=self.token)
+        self.session = get_session(config)
+        self.ws_client = SessionClient(
+            self.workspace_url, self.session, token=self.token
+        )
+        self.object_cache = make_object_cache(config)
+        self.sample_cache = make_object_cache(config, "sample")
+        # maximum number of concurrent requests to the KBase services
+        self.max_connections = int(
+            config.get("max-connections-per-node") or MAX_CONNECTIONS_PER_NODE
+        )
+        if self.max_connections < 1:
+            err_msg = "'config.max-connections-per-node' must be at least 1"
+            raise ValueError(err_msg)
+        self._connections = threading.BoundedSemaphore(self.max_connections)
+
+        self.sample_batch_size = int(
+            config.get("sample-batch-size") or SAMPLE_BATCH_SIZE
+        )
+        if self.sample_batch_size < 1:
+            err_msg = "'config.sample-batch-size' must be at least 1"
+            raise ValueError(err_msg)
+        self.sample_request_retries = int(
+            config.get("sample-request-retries") or SAMPLE_REQUEST_RETRIES
+        )
+        self.retry_backoff = RETRY_BACKOFF
 
     def _sample_service_query(
         self: "DataFetcher", method: str, params: dict[str, Any]
     ) -> list[dict[str, Any]] | dict[str, Any]:
-
         headers = {"Authorization": self.token, "Content-Type": "application/json"}
         payload = {
             "method": f"SampleService.{method}",
@@ -43,43 +90,157 @@ class DataFetcher:
             "params": [params],
             "version": "1.1",
         }
-        resp = requests.post(
-            url=self.sample_service_url, headers=headers, data=json.dumps(payload)
-        )
-        resp_json = resp.json()
+        with self._connections:
+            resp = self.session.post(
+                url=self.sample_service_url,
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=REQUEST_TIMEOUT,
+            )
+            resp_json = resp.json()
         if resp_json.get("error"):
             err_msg = f"Error from SampleService - {resp_json['error']}"
             raise RuntimeError(err_msg)
         return resp_json["result"][0]
 
+    def _fetch_sample_batch(
+        self: "DataFetcher", samples: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        # network errors, timeouts, and unparseable responses are retried;
+        # errors reported by the SampleService itself are not
+        attempt = 0
+        while True:
+            try:
+                return self._sample_service_query("get_samples", {"samples": samples})
+            except requests.RequestException as e:  # noqa: PERF203 - the loop retries
+                if attempt >= self.sample_request_retries:
+                    raise
+                delay = self.retry_backoff * 2**attempt
+                logger.warning(
+                    "SampleService request for %d samples failed (%s); retrying in %.1f s",
+                    len(samples),
+                    e,
+                    delay,
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def _submit_samples(
+        self: "DataFetcher",
+        pool: ThreadPoolExecutor,
+        sample_list: list[dict[str, Any]],
+    ) -> Iterator[dict[str, Any]]:
+        # look up the samples in the sample cache and submit the requests for the
+        # missing ones to `pool` straight away; the returned iterator yields the
+        # samples in order, waiting for each batch as it is reached
+        samples = [
+            {"id": sample["id"], "version": sample["version"]} for sample in sample_list
+        ]
+        keys = [f"{sample['id']}/{sample['version']}" for sample in samples]
+        results = (
+            [self.sample_cache.get(key) for key in keys]
+            if self.sample_cache
+            else [None] * len(samples)
+        )
+        missing = [ix for ix, result in enumerate(results) if result is None]
+        if self.sample_cache:
+            logger.info(
+                "sample cache: %d of %d samples served from cache",
+                len(results) - len(missing),
+                len(results),
+            )
+
+        batches = [
+            missing[start : start + self.sample_batch_size]
+            for start in range(0, len(missing), self.sample_batch_size)
+        ]
+        futures = [
+            pool.submit(self._fetch_sample_batch, [samples[ix] for ix in batch])
+            for batch in batches
+        ]
+        return self._collect_samples(keys, results, batches, futures)
+
+    def _collect_samples(
+        self: "DataFetcher",
+        keys: list[str],
+        results: list[dict[str, Any] | None],
+        batches: list[list[int]],
+        futures: list[Future],
+    ) -> Iterator[dict[str, Any]]:
+        position = 0
+        for bx, batch in enumerate(batches):
+            # results are in the same order as the input
+            for ix, sample_data in zip(batch, futures[bx].result(), strict=True):
+                results[ix] = sample_data
+                if self.sample_cache:
+                    self.sample_cache.put(keys[ix], sample_data, evict=False)
+            # release the response
+            futures[bx] = None
+            # yield everything up to the end of this batch
+            while position <= batch[-1]:
+                yield results[position]
+                results[position] = None
+                position += 1
+
+        if self.sample_cache and batches:
+            self.sample_cache.evict()
+        while position < len(results):
+            yield results[position]
+            results[position] = None
+            position += 1
+
+    def iter_samples(
+        self: "DataFetcher", sample_list: list[dict[str, Any]]
+    ) -> Iterator[dict[str, Any]]:
+        """Retrieve sample data from the sample service, yielding samples as they arrive.
+
+        Sample versions are immutable, so samples are read from the sample cache
+        if present; only the missing samples are requested from the Sample Service.
+        These are split into batches of at most `sample_batch_size` samples, which
+        are requested concurrently (up to `max_connections` at a time); failed
+        batches are retried up to `sample_request_retries` times. Samples are
+        yielded in the same order as sample_list as soon as the batch containing
+        them (and all preceding batches) has been received, so the whole set of
+        responses need not be held in memory by the caller.
+
+        :param self: class instance
+        :type self: DataFetcher
+        :param sample_list: list of dicts containing sample IDs and version
+        :type sample_list: list[dict[str, Any]]
+        :raises RuntimeError: if there are any issues with fetching from the Sample Service
+        :yield: data from the Sample Service, in the same order as sample_list
+        :rtype: Iterator[dict[str, Any]]
+        """
+        with ThreadPoolExecutor(
+            self.max_connections, thread_name_prefix="sampleservice"
+        ) as pool:
+            yield from self._submit_samples(pool, sample_list)
+
     def fetch_samples(
         self: "DataFetcher", sample_list: list[dict[str, Any]]
     ) -> list[dict[str, Any]]:
         """Retrieve sample data from the sample service.
 
+        See `iter_samples` for details of caching and batching.
+
         :param self: class instance
         :type self: DataFetcher
         :param sample_list: list of dicts containing sample IDs and version
         :type sample_list: list[dict[str, Any]]
         :raises RuntimeError: if there are any issues with fetching from the Sample Service
-        :return: list containing data from the Sample Service
+        :return: list containing data from the Sample Service, in the same order as sample_list
         :rtype: list[dict[str, Any]]
         """
-        return self._sample_service_query(
-            "get_samples",
-            {
-                "samples": [
-                    {"id": sample["id"], "version": sample["version"]}
-                    for sample in sample_list
-                ],
-            },
-        )
+        return list(self.iter_samples(sample_list))
 
     def fetch_objects_by_ref(
         self: "DataFetcher", ref_list: list[str]
     ) -> dict[str, Any]:
         """Retrieve a list of objects.
 
+        The objects are fetched from the workspace in a single request; see
+        `fetch_object_groups` for details.
+
         :param self: class instance
         :type self: DataFetcher
         :param ref_list: list of KBase UPAs to fetch
@@ -88,17 +249,174 @@ class DataFetcher:
         :return: KBase objects indexed by UPA
         :rtype: dict[str, Any]
         """
+        return self.fetch_object_groups([ref_list])
+
+    def fetch_object_groups(
+        self: "DataFetcher", ref_groups: list[list[str]], *, stream: bool = False
+    ) -> dict[str, Any]:
+        """Retrieve several groups of objects concurrently.
+
+        Objects with a versioned UPA are immutable, so they are read from the object
+        cache if present; anything else is fetched from the workspace (and cached).
+
+        Each group of objects is fetched from the workspace in a single request.
+        The workspace requests for each group, and the Sample Service requests for
+        the samples in any SampleSets, share one thread pool, with no more than
+        `max_connections` requests to the KBase services at a time. Sample lookups for a
+        SampleSet start as soon as the workspace request containing it returns (or
+        straight away for a cached SampleSet).
+
+        The samples of each SampleSet are stored in its `data.sample_data` list; use
+        `open_object_groups` to iterate over them as they arrive instead. Only the
+        SampleSet object itself is stored in the object cache; its samples are stored
+        in the sample cache.
+
+        :param self: class instance
+        :type self: DataFetcher
+        :param ref_groups: groups of KBase UPAs to fetch
+        :type ref_groups: list[list[str]]
+        :param stream: whether to parse the workspace responses as they download,
+            decoding any matrix values straight into NumPy arrays; see
+            `combinatrix.json_stream`. Defaults to False.
+        :type stream: bool
+        :raises ValueError: if any of the results are not found
+        :return: KBase objects indexed by UPA
+        :rtype: dict[str, Any]
+        """
+        with self.open_object_groups(ref_groups, stream=stream) as output:
+            for item in output.values():
+                if "sample_data" in item[DATA]:
+                    item[DATA]["sample_data"] = list(item[DATA]["sample_data"])
+        return output
+
+    @contextmanager
+    def open_object_groups(
+        self: "DataFetcher", ref_groups: list[list[str]], *, stream: bool = False
+    ) -> Iterator[dict[str, Any]]:
+        """Retrieve several groups of objects concurrently, streaming in the samples.
+
+        As `fetch_object_groups`, except that the `sample_data` of each SampleSet is
+        an iterator over its samples, as returned by `iter_samples`: the sample
+        requests carry on in the background, and the samples are handed over in
+        order as their batches arrive, so the conversion of the samples overlaps with
+        their download and the parsed responses are released as they are consumed.
+        Each iterator can only be iterated over once, and only inside the `with`
+        block; on leaving it, any outstanding sample requests are cancelled, and
+        those already running are waited for.
+
+        :param self: class instance
+        :type self: DataFetcher
+        :param ref_groups: groups of KBase UPAs to fetch
+        :type ref_groups: list[list[str]]
+        :param stream: whether to parse the workspace responses as they download;
+            see `fetch_object_groups`. Defaults to False.
+        :type stream: bool
+        :raises ValueError: if any of the results are not found
+        :yield: KBase objects indexed by UPA
+        :rtype: Iterator[dict[str, Any]]
+        """
+        output = {}
+        to_fetch = []
+        for ref_list in ref_groups:
+            group = [ref for ref in ref_list if not self._read_cache(ref, output)]
+            if group:
+                to_fetch.append(group)
+
+        fetched = {}
+        # the workspace and the Sample Service are on the same node, so all
+        # requests share the one pool
+        pool = ThreadPoolExecutor(self.max_connections, thread_name_prefix="fetcher")
+        try:
+            ws_futures = [
+                pool.submit(self._fetch_workspace_objects, group, stream=stream)
+                for group in to_fetch
+            ]
+            for upa, item in output.items():
+                self._add_sample_data(pool, upa, item)
+            for ws_future in as_completed(ws_futures):
+                for item in ws_future.result():
+                    # store in a dict indexed by UPA
+                    upa = get_upa(item)
+                    fetched[upa] = item  # {INFO: item[INFO], DATA: item[DATA]}
+                    if self.object_cache:
+                        self.object_cache.put(upa, item, evict=False)
+                    self._add_sample_data(pool, upa, item)
+
+            if self.object_cache:
+                self.object_cache.evict()
+                logger.info(
+                    "object cache: %(hits)d hits, %(misses)d misses",
+                    self.object_cache.stats(),
+                )
+            output.update(fetched)
+            yield output
+        finally:
+            # nothing is left running once the samples have been read (or on error)
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _read_cache(self: "DataFetcher", ref: str, output: dict[str, Any]) -> bool:
+        # add the object to `output` if it is in the object cache
+        if not self.object_cache or not VERSIONED_UPA_REGEX.fullmatch(ref):
+            return False
+        cached = self.object_cache.get(ref)
+        if cached is None:
+            return False
+        output[ref] = cached
+        return True
+
+    def _add_sample_data(
+        self: "DataFetcher", pool: ThreadPoolExecutor, upa: str, item: dict[str, Any]
+    ) -> None:
+        # populate any SampleSet with an iterator over its samples
+        if "SampleSet" in get_data_type(item):
+            logger.info("retrieve samples for %s", upa)
+            item[DATA]["sample_data"] = self._submit_samples(
+                pool, item[DATA]["samples"]
+            )
+
+    def _get_objects2_streamed(
+        self: "DataFetcher", params: dict[str, Any]
+    ) -> dict[str, Any] | None:
+        # equivalent to Workspace.get_objects2, but parses the response as it arrives
+        payload = {
+            "method": "Workspace.get_objects2",
+            "params": [params],
+            "version": "1.1",
+            "id": str(uuid.uuid4()),
+        }
+        with self.session.post(
+            self.workspace_url,
+            headers={"Authorization": self.token, "Content-Type": "application/json"},
+            data=json.dumps(payload),
+            timeout=REQUEST_TIMEOUT,
+            stream=True,
+        ) as resp:
+            raise_for_response(resp)
+            resp.raw.decode_content = True
+            parsed = parse_get_objects2(resp.raw)
+
+        if "result" not in parsed:
+            raise ServerError("Unknown", 0, "An unknown server error occurred")
+        return parsed["result"][0] if parsed["result"] else None
+
+    def _fetch_workspace_objects(
+        self: "DataFetcher", ref_list: list[str], *, stream: bool = False
+    ) -> list[dict[str, Any]]:
         # fetch the data sources from the workspace
         # results are in the same order as the input
         sorted_ref_list = sorted(ref_list)
-        ws_output = self.ws_client.get_objects2(
-            {
-                "objects": [{"ref": ref} for ref in sorted_ref_list],
-                "ignoreErrors": 1,
-                "infostruct": 1,
-                "skip_external_system_updates": 1,
-            }
-        )
+        params = {
+            "objects": [{"ref": ref} for ref in sorted_ref_list],
+            "ignoreErrors": 1,
+            "infostruct": 1,
+            "skip_external_system_updates": 1,
+        }
+        with self._connections:
+            ws_output = (
+                self._get_objects2_streamed(params)
+                if stream
+                else self.ws_client.call_method("Workspace.get_objects2", [params])
+            )
 
         if not ws_output or DATA not in ws_output:
             err_msg = "The workspace query returned no results"
@@ -115,13 +433,4 @@ class DataFetcher:
             err_msg = f"The following KBase objects could not be retrieved: {', '.join(not_found)}"
             raise ValueError(err_msg)
 
-        output = {}
-        for item in results:
-            # check for any samplesets that need to be populated
-            if "SampleSet" in get_data_type(item):
-                print(f"retrieve samples for {get_upa(item)}")
-                item[DATA]["sample_data"] = self.fetch_samples(item[DATA]["samples"])
-            # store in a dict indexed by UPA
-            output[get_upa(item)] = item  # {INFO: item[INFO], DATA: item[DATA]}
-
-        return output
+        return results
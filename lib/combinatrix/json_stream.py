@@ -0,0 +1,132 @@
+"""Incremental decoding of Workspace.get_objects2 responses.
+
+Responses are parsed event by event with ijson, so the raw JSON never has to be held
+in memory. Matrix values (`data.data.values` in KBaseMatrices objects) are written
+row by row into a NumPy float array rather than being built up as nested lists of
+Python numbers; everything else is decoded as usual.
+"""
+
+from typing import IO, Any
+
+import ijson
+import numpy as np
+from ijson.common import ObjectBuilder
+
+# ijson prefixes of the objects in a get_objects2 response and their matrix data
+OBJECT_PREFIX = "result.item.data.item"
+MATRIX_PREFIX = f"{OBJECT_PREFIX}.data.data"
+VALUES_PREFIX = f"{MATRIX_PREFIX}.values"
+ROW_PREFIX = f"{VALUES_PREFIX}.item"
+CELL_PREFIX = f"{ROW_PREFIX}.item"
+ID_PREFIXES = {f"{MATRIX_PREFIX}.{key}.item": key for key in ["row_ids", "col_ids"]}
+
+
+class MatrixValuesBuilder:
+    """Collect the rows of a matrix into a NumPy array.
+
+    If the matrix dimensions are known in advance, the array is preallocated and
+    filled in place. If they are not known, or the rows do not match them, the rows
+    are collected and combined at the end; rows of differing lengths are returned as
+    nested lists (as the plain JSON decoder would) for the converter to report on.
+    """
+
+    def __init__(self: "MatrixValuesBuilder", n_rows: int, n_cols: int) -> None:
+        """Initialise an instance of the class.
+
+        :param self: class instance
+        :type self: MatrixValuesBuilder
+        :param n_rows: expected number of rows (0 if not known)
+        :type n_rows: int
+        :param n_cols: expected number of columns (0 if not known)
+        :type n_cols: int
+        """
+        self.n_cols = n_cols
+        self.array = np.empty((n_rows, n_cols)) if n_rows and n_cols else None
+        self.rows: list[Any] = []
+        self.n_filled = 0
+        self.row: list[Any] = []
+
+    def add_row(self: "MatrixValuesBuilder") -> None:
+        """Add the current row to the matrix.
+
+        :param self: class instance
+        :type self: MatrixValuesBuilder
+        """
+        row = self.row
+        self.row = []
+        if (
+            self.array is not None
+            and self.n_filled < self.array.shape[0]
+            and len(row) == self.n_cols
+        ):
+            self.array[self.n_filled] = [np.nan if v is None else v for v in row]
+            self.n_filled += 1
+            return
+        if self.array is not None:
+            # the matrix is not the expected shape: collect the rows instead
+            self.rows = self.array[: self.n_filled].tolist()
+            self.array = None
+        self.rows.append(row)
+
+    def build(self: "MatrixValuesBuilder") -> np.ndarray | list[Any]:
+        """Return the matrix values.
+
+        :param self: class instance
+        :type self: MatrixValuesBuilder
+        :return: the values, as a 2D float array if possible
+        :rtype: np.ndarray | list[Any]
+        """
+        if self.array is not None:
+            if self.n_filled == self.array.shape[0]:
+                return self.array
+            self.rows = self.array[: self.n_filled].tolist()
+        if self.rows and len({len(row) for row in self.rows}) == 1:
+            return np.array(
+                [[np.nan if v is None else v for v in row] for row in self.rows],
+                dtype=np.float64,
+            )
+        return self.rows
+
+
+def parse_get_objects2(stream: IO[bytes]) -> dict[str, Any]:
+    """Parse a Workspace.get_objects2 JSON-RPC response from a stream.
+
+    :param stream: file-like object containing the response body
+    :type stream: IO[bytes]
+    :raises ValueError: if the matrix values are not numbers
+    :return: the parsed response; matrix values are NumPy arrays
+    :rtype: dict[str, Any]
+    """
+    builder = ObjectBuilder()
+    values_builder = None
+    id_counts = {"row_ids": 0, "col_ids": 0}
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if values_builder is not None:
+            if prefix == CELL_PREFIX and event in ("number", "null"):
+                values_builder.row.append(value)
+            elif prefix == ROW_PREFIX and event == "end_array":
+                values_builder.add_row()
+            elif prefix == VALUES_PREFIX and event == "end_array":
+                # scalar events add their value to the object as-is
+                builder.event("number", values_builder.build())
+                values_builder = None
+            elif prefix != ROW_PREFIX or event != "start_array":
+                err_msg = (
+                    "'data.data.values' must be a two-dimensional array of numbers"
+                )
+                raise ValueError(err_msg)
+            continue
+
+        if prefix == VALUES_PREFIX and event == "start_array":
+            values_builder = MatrixValuesBuilder(
+                id_counts["row_ids"], id_counts["col_ids"]
+            )
+            continue
+        if prefix in ID_PREFIXES:
+            id_counts[ID_PREFIXES[prefix]] += 1
+        elif prefix == OBJECT_PREFIX and event == "start_map":
+            id_counts = {"row_ids": 0, "col_ids": 0}
+        builder.event(event, value)
+
+    return builder.value
@@ -0,0 +1,256 @@
+"""Shared HTTP session for requests to KBase services."""
+
+import json
+import logging
+import random
+import threading
+from typing import Any
+from urllib.parse import urlparse
+
+import requests
+from installed_clients.baseclient import BaseClient, ServerError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from combinatrix.constants import (
+    HTTP_CONNECT_RETRIES,
+    HTTP_POOL_SIZE,
+    HTTP_RETRY_BACKOFF,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetrics:
+    """Thread-safe record of the latency of HTTP requests, by service URL."""
+
+    def __init__(self: "RequestMetrics") -> None:
+        """Initialise an instance of the class."""
+        self._lock = threading.Lock()
+        self._latencies: dict[str, list[float]] = {}
+
+    def record(self: "RequestMetrics", url: str, seconds: float) -> None:
+        """Record the latency of a request.
+
+        :param self: class instance
+        :type self: RequestMetrics
+        :param url: request URL; the query string and fragment are ignored
+        :type url: str
+        :param seconds: time taken to receive the response headers
+        :type seconds: float
+        """
+        parsed = urlparse(url)
+        service = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        with self._lock:
+            self._latencies.setdefault(service, []).append(seconds)
+
+    def summary(self: "RequestMetrics") -> dict[str, dict[str, float]]:
+        """Summarise the request latencies for each service.
+
+        :param self: class instance
+        :type self: RequestMetrics
+        :return: number of calls, and total, mean and maximum latency in seconds, indexed by URL
+        :rtype: dict[str, dict[str, float]]
+        """
+        with self._lock:
+            return {
+                service: {
+                    "calls": len(latencies),
+                    "total": sum(latencies),
+                    "mean": sum(latencies) / len(latencies),
+                    "max": max(latencies),
+                }
+                for service, latencies in self._latencies.items()
+            }
+
+    def log_summary(self: "RequestMetrics") -> None:
+        """Log the request latencies for each service.
+
+        :param self: class instance
+        :type self: RequestMetrics
+        """
+        for service, stats in self.summary().items():
+            logger.info(
+                "%s: %d calls, total %.3f s, mean %.3f s, max %.3f s",
+                service,
+                stats["calls"],
+                stats["total"],
+                stats["mean"],
+                stats["max"],
+            )
+
+    def reset(self: "RequestMetrics") -> None:
+        """Clear all recorded latencies.
+
+        :param self: class instance
+        :type self: RequestMetrics
+        """
+        with self._lock:
+            self._latencies.clear()
+
+
+# latencies of all requests made using sessions from `get_session`; the sessions
+# are shared between jobs, so this is reset at the start of each job
+metrics = RequestMetrics()
+
+_sessions: dict[tuple[int, int, float], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _record_latency(response: requests.Response, **_kwargs: object) -> None:
+    metrics.record(response.request.url, response.elapsed.total_seconds())
+
+
+def make_session(
+    pool_size: int = HTTP_POOL_SIZE,
+    connect_retries: int = HTTP_CONNECT_RETRIES,
+    retry_backoff: float = HTTP_RETRY_BACKOFF,
+) -> requests.Session:
+    """Create a session that keeps connections alive between requests.
+
+    Only connection errors are retried: the request has not reached the server,
+    so retrying is safe even for non-idempotent JSON-RPC calls.
+
+    :param pool_size: maximum number of connections to keep open to each host,
+        defaults to HTTP_POOL_SIZE
+    :type pool_size: int
+    :param connect_retries: number of times to retry a request that could not
+        connect, defaults to HTTP_CONNECT_RETRIES
+    :type connect_retries: int
+    :param retry_backoff: backoff factor for the delay between retries, in seconds,
+        defaults to HTTP_RETRY_BACKOFF
+    :type retry_backoff: float
+    :return: the session
+    :rtype: requests.Session
+    """
+    retry = Retry(
+        total=connect_retries,
+        connect=connect_retries,
+        read=0,
+        redirect=0,
+        status=0,
+        other=0,
+        allowed_methods=None,
+        backoff_factor=retry_backoff,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(_record_latency)
+    return session
+
+
+def get_session(config: dict[str, Any] | None = None) -> requests.Session:
+    """Get the shared session for the settings in the config.
+
+    Sessions are created on first use and shared by all clients, and threads,
+    using the same settings.
+
+    :param config: app config; uses the `http-pool-size`, `http-connect-retries`,
+        and `http-retry-backoff` settings if present, defaults to None
+    :type config: dict[str, Any] | None
+    :return: the session
+    :rtype: requests.Session
+    """
+    config = config or {}
+    settings = (
+        int(config.get("http-pool-size") or HTTP_POOL_SIZE),
+        int(config.get("http-connect-retries") or HTTP_CONNECT_RETRIES),
+        float(config.get("http-retry-backoff") or HTTP_RETRY_BACKOFF),
+    )
+    with _sessions_lock:
+        if settings not in _sessions:
+            _sessions[settings] = make_session(*settings)
+        return _sessions[settings]
+
+
+def raise_for_response(response: requests.Response) -> None:
+    """Raise an error if a KBase JSON-RPC call failed.
+
+    :param response: response to the call
+    :type response: requests.Response
+    :raises ServerError: if the service returned an error
+    :raises requests.HTTPError: for any other unsuccessful response
+    """
+    if response.status_code == requests.codes.internal_server_error:
+        if response.headers.get("content-type") == "application/json":
+            error = response.json().get("error")
+            if error:
+                raise ServerError(**error)
+        raise ServerError("Unknown", 0, response.text)
+    response.raise_for_status()
+
+
+def _encode(obj: object) -> list[Any]:
+    # encode sets as lists, as the SDK clients do
+    if isinstance(obj, set | frozenset):
+        return list(obj)
+    err_msg = f"Object of type {type(obj).__name__} is not JSON serializable"
+    raise TypeError(err_msg)
+
+
+class SessionClient(BaseClient):
+    """KBase SDK client that makes its calls using a requests.Session.
+
+    The generated service clients, e.g. Workspace or KBaseReport, are thin wrappers
+    around `BaseClient.call_method` and `BaseClient.run_job`; calling these on a
+    SessionClient makes the same JSON-RPC calls, but keeps the connections open
+    between calls.
+    """
+
+    def __init__(
+        self: "SessionClient", url: str, session: requests.Session, **kwargs: object
+    ) -> None:
+        """Initialise an instance of the class.
+
+        :param self: class instance
+        :type self: SessionClient
+        :param url: service URL
+        :type url: str
+        :param session: the session to make calls with
+        :type session: requests.Session
+        :param kwargs: any other BaseClient arguments, e.g. `token`
+        :type kwargs: object
+        """
+        super().__init__(url, **kwargs)
+        self.session = session
+
+    def _call(
+        self: "SessionClient",
+        url: str,
+        method: str,
+        params: list[Any],
+        context: dict[str, Any] | None = None,
+    ) -> dict[str, Any] | list[Any] | None:
+        # as BaseClient._call, but using the session
+        arg_hash = {
+            "method": method,
+            "params": params,
+            "version": "1.1",
+            "id": str(random.random())[2:],  # noqa: S311
+        }
+        if context:
+            if not isinstance(context, dict):
+                err_msg = "context is not type dict as required."
+                raise ValueError(err_msg)
+            arg_hash["context"] = context
+
+        response = self.session.post(
+            url,
+            data=json.dumps(arg_hash, default=_encode),
+            headers=self._headers,
+            timeout=self.timeout,
+            verify=not self.trust_all_ssl_certificates,
+        )
+        response.encoding = "utf-8"
+        raise_for_response(response)
+        result = response.json().get("result")
+        if result is None:
+            raise ServerError("Unknown", 0, "An unknown server error occurred")
+        if not result:
+            return None
+        return result[0] if len(result) == 1 else result
@@ -3,7 +3,11 @@
 import logging
 import os
 
-from kb_qsip.utils.qsip_util import QsipUtil
+from kb_qsip.utils import warm_start
+from kb_qsip.utils.app_params import check_params
+
+# kb_qsip.utils.qsip_util starts R and loads qSIP2 when it is imported, so it is
+# imported when the first job is run rather than when the server starts
 
 # END_HEADER
 
@@ -40,6 +44,11 @@ class kb_qsip:
         logging.basicConfig(
             format="%(created)s %(levelname)s: %(message)s", level=logging.INFO
         )
+
+        # initialise R now and run each job in a forked copy of this process
+        self.warm_start = warm_start.is_enabled(config)
+        if self.warm_start:
+            warm_start.warm_up()
         # END_CONSTRUCTOR
         pass
 
@@ -53,8 +62,14 @@ class kb_qsip:
         # ctx is the context object
         # return variables are: output
         # BEGIN run_kb_qsip
-        qsip_runner = QsipUtil(self.config, ctx)
-        output = qsip_runner.run(params)
+        check_params(params)
+
+        from kb_qsip.utils.qsip_util import run_qsip
+
+        if self.warm_start:
+            output = warm_start.run_in_worker(run_qsip, self.config, ctx, params)
+        else:
+            output = run_qsip(self.config, ctx, params)
         # END run_kb_qsip
 
         # At some point might do deeper type checking...
@@ -0,0 +1,371 @@
+"""Parsing and validation of the parameters from the app UI.
+
+This module only uses the standard library, so that parameters can be checked
+before R and pandas are loaded.
+"""
+
+from collections import Counter
+from typing import Any, NamedTuple
+
+# column added to the EAF summary in batch mode
+CONFIDENCE_COLUMN = "confidence"
+# resample success ratio used if none is given, as in the app UI
+DEFAULT_RESAMPLE_SUCCESS = 0.8
+
+# params naming the fields of the source and sample data that the run reads
+SAMPLE_FIELD_PARAMS = [
+    "M_isotope",
+    "M_isotopolog",
+    "S_source_mat_id",
+    "S_gradient_position",
+    "S_gradient_pos_density",
+    "S_gradient_pos_amt",
+    "S_gradient_pos_rel_amt",
+    "groups",
+]
+# fields that are always read: the source and sample IDs, and the label column
+# checked by qsip2::remove_isotopolog_label_check
+FIXED_SAMPLE_FIELDS = ["name", "isotopolog_label"]
+
+# thresholds of the feature filter, as in qsip2::run_feature_filter
+DEFAULT_FILTER_THRESHOLDS = {
+    "min_unlabeled_sources": 1,
+    "min_labeled_sources": 1,
+    "min_unlabeled_fractions": 1,
+    "min_labeled_fractions": 1,
+}
+# the unlabeled isotope for each labeled isotope supported by qSIP2
+ISOTOPE_PAIRS = {"13C": "12C", "15N": "14N", "18O": "16O"}
+DEFAULT_LABELED_ISOTOPE = "18O"
+
+# file formats for the EAF summary
+SUMMARY_FORMATS = ["tsv", "tsv.gz", "parquet", "feather"]
+DEFAULT_SUMMARY_FORMATS = ["tsv"]
+
+# defaults for the paged EAF plots
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_MAX_PAGES = 10
+
+
+class PageOptions(NamedTuple):
+    """Options for drawing the EAF plot as a top-N plot plus numbered pages.
+
+    `top_n` features (only those whose EAF is significantly above zero if
+    `significant_only`) are drawn in the main plot; the rest are split into pages
+    of `page_size` features, of which the first `max_pages` are rendered as PNGs.
+    """
+
+    top_n: int
+    page_size: int
+    max_pages: int
+    significant_only: bool
+
+
+def is_batch(params: dict[str, Any]) -> bool:
+    """Check whether the app is being run for a list of confidence levels.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :return: True if `params["confidence"]` is a list
+    :rtype: bool
+    """
+    return isinstance(params.get("confidence"), list | tuple)
+
+
+def _as_list(value: object) -> list[object]:
+    return list(value) if isinstance(value, list | tuple) else [value]
+
+
+def get_confidence_levels(params: dict[str, Any]) -> list[tuple[float, float]]:
+    """Get the confidence levels and resample success ratios to report.
+
+    `confidence` may be a single value or a list. `resample_success` may be a single
+    value, which is used for every confidence level, or a list with one value per
+    confidence level; DEFAULT_RESAMPLE_SUCCESS is used where it is not set.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if the values are missing, not numbers, out of range, or
+        the two lists are different lengths
+    :return: (confidence, resample_success) pairs
+    :rtype: list[tuple[float, float]]
+    """
+    confidence = _as_list(params.get("confidence"))
+    if not confidence:
+        err_msg = "At least one confidence level is required"
+        raise ValueError(err_msg)
+    resample_success = _as_list(params.get("resample_success"))
+    if len(resample_success) == 1:
+        resample_success = resample_success * len(confidence)
+    if len(resample_success) != len(confidence):
+        err_msg = (
+            "resample_success must be a single value or have one value per confidence"
+            f" level: got {len(resample_success)} values for {len(confidence)} levels"
+        )
+        raise ValueError(err_msg)
+
+    levels = []
+    for conf, success in zip(confidence, resample_success, strict=True):
+        level = (
+            _fraction("confidence", conf, inclusive=False),
+            (
+                DEFAULT_RESAMPLE_SUCCESS
+                if success in (None, "")
+                else _fraction("resample_success", success)
+            ),
+        )
+        if level not in levels:
+            levels.append(level)
+    return levels
+
+
+def get_confidence(params: dict[str, Any]) -> float | list[float]:
+    """Get the confidence level, or the list of levels in batch mode.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :return: confidence level(s)
+    :rtype: float | list[float]
+    """
+    levels = list(dict.fromkeys(conf for conf, _ in get_confidence_levels(params)))
+    return levels if is_batch(params) else levels[0]
+
+
+def _fraction(name: str, value: object, *, inclusive: bool = True) -> float:
+    """Convert a value into a float between 0 and 1."""
+    try:
+        fraction = float(value)
+    except (TypeError, ValueError):
+        fraction = None
+    if fraction is None or not (0 <= fraction <= 1 if inclusive else 0 < fraction < 1):
+        bounds = "between 0 and 1" if inclusive else "greater than 0 and less than 1"
+        err_msg = f"Invalid {name} '{value}': must be a number {bounds}"
+        raise ValueError(err_msg)
+    return fraction
+
+
+def get_resamples(params: dict[str, Any]) -> int:
+    """Get the number of times to resample the data of each feature.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if `resamples` is not an integer greater than 0
+    :return: number of resamples
+    :rtype: int
+    """
+    return _positive_int("resamples", params.get("resamples"))
+
+
+def get_page_options(params: dict[str, Any]) -> PageOptions | None:
+    """Get the options for the paged EAF plots.
+
+    Paging is enabled by setting `eaf_plot_top_n`; `eaf_plot_page_size`,
+    `eaf_plot_max_pages` and `eaf_plot_significant_only` are optional.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if any of the values is not a positive integer
+    :return: the page options, or None if paging is not enabled
+    :rtype: PageOptions | None
+    """
+    if params.get("eaf_plot_top_n") in (None, "", 0, "0"):
+        return None
+    return PageOptions(
+        top_n=_positive_int("eaf_plot_top_n", params["eaf_plot_top_n"]),
+        page_size=_positive_int(
+            "eaf_plot_page_size", params.get("eaf_plot_page_size", DEFAULT_PAGE_SIZE)
+        ),
+        max_pages=_positive_int(
+            "eaf_plot_max_pages", params.get("eaf_plot_max_pages", DEFAULT_MAX_PAGES)
+        ),
+        significant_only=_is_true(params.get("eaf_plot_significant_only")),
+    )
+
+
+def _positive_int(name: str, value: object) -> int:
+    """Convert a value into an integer greater than 0."""
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        number = None
+    if number is None or number <= 0:
+        err_msg = f"Invalid {name} '{value}': must be an integer greater than 0"
+        raise ValueError(err_msg)
+    return number
+
+
+def get_summary_formats(params: dict[str, Any]) -> list[str]:
+    """Get the file formats to write the EAF summary in.
+
+    `eaf_summary_formats` may be a list or a comma-separated string of formats.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if a format is not one of SUMMARY_FORMATS
+    :return: the formats, in the order given; DEFAULT_SUMMARY_FORMATS if not set
+    :rtype: list[str]
+    """
+    value = params.get("eaf_summary_formats")
+    formats = value.split(",") if isinstance(value, str) else _as_list(value)
+    formats = [str(fmt).strip().lower() for fmt in formats if fmt is not None]
+    formats = [fmt for fmt in formats if fmt]
+    for fmt in formats:
+        if fmt not in SUMMARY_FORMATS:
+            err_msg = (
+                f"Invalid eaf_summary_formats '{fmt}': must be one of"
+                f" {', '.join(SUMMARY_FORMATS)}"
+            )
+            raise ValueError(err_msg)
+    return list(dict.fromkeys(formats)) or DEFAULT_SUMMARY_FORMATS
+
+
+def writes_resamples(params: dict[str, Any]) -> bool:
+    """Check whether the per-resample EAF values should be saved.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :return: True if `eaf_resamples_output` is set
+    :rtype: bool
+    """
+    return _is_true(params.get("eaf_resamples_output"))
+
+
+def _is_true(value: object) -> bool:
+    """Check whether a flag from the app UI is set."""
+    return str(value).strip().lower() in ("1", "true")
+
+
+def get_sample_fields(params: dict[str, Any]) -> list[str]:
+    """Get the fields of the source and sample data that a run reads.
+
+    Only these fields need to be converted and copied into R.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :return: field names, without duplicates
+    :rtype: list[str]
+    """
+    fields = [
+        *FIXED_SAMPLE_FIELDS,
+        *(
+            str(params[name]).strip()
+            for name in SAMPLE_FIELD_PARAMS
+            if params.get(name)
+        ),
+    ]
+    return list(dict.fromkeys(field for field in fields if field))
+
+
+def get_filter_thresholds(params: dict[str, Any]) -> dict[str, int]:
+    """Get the thresholds of the feature filter.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if a threshold is not an integer greater than 0
+    :return: each threshold in DEFAULT_FILTER_THRESHOLDS, with its default if not set
+    :rtype: dict[str, int]
+    """
+    return {
+        name: (
+            default
+            if params.get(name) in (None, "")
+            else _positive_int(name, params[name])
+        )
+        for name, default in DEFAULT_FILTER_THRESHOLDS.items()
+    }
+
+
+def get_isotopes(params: dict[str, Any]) -> tuple[str, str]:
+    """Get the isotopes of the unlabeled and labeled sources.
+
+    The unlabeled isotope is the one paired with the labeled isotope in ISOTOPE_PAIRS.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if the labeled isotope is not one of ISOTOPE_PAIRS
+    :return: the unlabeled and labeled isotopes; the labeled isotope defaults to
+        DEFAULT_LABELED_ISOTOPE
+    :rtype: tuple[str, str]
+    """
+    labeled = str(params.get("labeled_isotope") or DEFAULT_LABELED_ISOTOPE).strip()
+    if labeled not in ISOTOPE_PAIRS:
+        err_msg = (
+            f"Invalid labeled_isotope '{labeled}': must be one of"
+            f" {', '.join(ISOTOPE_PAIRS)}"
+        )
+        raise ValueError(err_msg)
+    return ISOTOPE_PAIRS[labeled], labeled
+
+
+def check_filter_feasible(
+    params: dict[str, Any], source_isotopes: dict[str, str], sample_sources: list[str]
+) -> None:
+    """Check that the feature filter can keep features, given the sources and samples.
+
+    Each isotope must be found in the source data, and for each isotope, there must
+    be at least the minimum number of sources with at least the minimum number of
+    fractions. Otherwise every feature would be filtered out.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :param source_isotopes: isotope of each source, keyed by source ID
+    :type source_isotopes: dict[str, str]
+    :param sample_sources: source ID of each sample (fraction)
+    :type sample_sources: list[str]
+    :raises ValueError: if an isotope is not found in the source data, or too few
+        sources have enough fractions
+    """
+    thresholds = get_filter_thresholds(params)
+    n_fractions = Counter(sample_sources)
+    for label, isotope in zip(
+        ("unlabeled", "labeled"), get_isotopes(params), strict=True
+    ):
+        sources = [src for src, iso in source_isotopes.items() if iso == isotope]
+        if not sources:
+            found = ", ".join(sorted(set(source_isotopes.values())))
+            err_msg = (
+                f"No sources with the {label} isotope '{isotope}' in the source data;"
+                f" found: {found}"
+            )
+            raise ValueError(err_msg)
+
+        min_sources = thresholds[f"min_{label}_sources"]
+        min_fractions = thresholds[f"min_{label}_fractions"]
+        n_usable = sum(n_fractions[src] >= min_fractions for src in sources)
+        if n_usable < min_sources:
+            err_msg = (
+                f"min_{label}_sources is {min_sources}, but only {n_usable} of the"
+                f" {len(sources)} {label} ({isotope}) sources have at least"
+                f" {min_fractions} fractions (min_{label}_fractions)"
+            )
+            raise ValueError(err_msg)
+
+
+def prefilters_features(params: dict[str, Any]) -> bool:
+    """Check whether the features are filtered before the data is copied into R.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :return: True if `prefilter_features` is set to a true value
+    :rtype: bool
+    """
+    return _is_true(params.get("prefilter_features"))
+
+
+def check_params(params: dict[str, Any]) -> None:
+    """Check the parameters that do not depend on the input data.
+
+    This is run before R is started, so that a job with invalid parameters fails
+    straight away. Whether the feature filter can keep any features is checked by
+    `check_filter_feasible` once the source and sample data have been fetched.
+
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :raises ValueError: if any of the parameters is invalid
+    """
+    get_confidence_levels(params)
+    get_resamples(params)
+    get_isotopes(params)
+    get_filter_thresholds(params)
+    get_page_options(params)
+    get_summary_formats(params)
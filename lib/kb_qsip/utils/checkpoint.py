@@ -0,0 +1,454 @@
+"""Checkpoints of the output of each stage of the qSIP pipeline.
+
+The output of each stage is saved under a key: a hash of the stage name, the
+canonical values of exactly the parameters the stage reads, and the key of the
+stage that feeds it (the first stage starts from a hash of the input data).
+Changing the inputs or a parameter therefore gives new keys to the stage that
+reads it and to every stage after it, while the outputs saved under the old keys
+are kept. Stages that only check their input and pass it on unchanged do not
+feed the later stages, so their parameters are not part of the later keys.
+
+If checkpoint-dir is configured, outputs of memoized stages are reused whenever
+their key matches, so a run that only changes e.g. the confidence level reuses the
+resampled qsip object from an earlier run. In resume mode, the output of any saved
+stage can be reused, so a run that failed while drawing the plots does not have to
+repeat the resampling. Outputs are only reused if every input is a versioned UPA,
+as an unversioned reference may point at a newer version of the object.
+The least recently used outputs are removed when the checkpoints grow too large.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import uuid
+from collections.abc import Callable
+from typing import Any, NamedTuple
+
+from combinatrix.fetcher import VERSIONED_UPA_REGEX
+
+TMP_SUFFIX = ".tmp"
+# 2 GiB
+DEFAULT_MAX_BYTES = 2 * 1024**3
+# references to the input data of a run
+INPUT_REF_PARAMS = ["source_data", "sample_data", "feature_data"]
+# parameters that identify the input data of a run
+INPUT_PARAMS = [*INPUT_REF_PARAMS, "debug"]
+# errors from saving or loading a checkpoint: file system errors, R errors (raised
+# by rpy2 as RuntimeError), and invalid or truncated data
+CHECKPOINT_ERRORS = (
+    OSError,
+    EOFError,
+    RuntimeError,
+    TypeError,
+    ValueError,
+    KeyError,
+    pickle.UnpicklingError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointFormat(NamedTuple):
+    """Functions to save and load a stage output; `save` writes to the given path."""
+
+    suffix: str
+    save: Callable[[Any, str], None]
+    load: Callable[[str], Any]
+
+
+class Stage(NamedTuple):
+    """A stage of the pipeline.
+
+    `run` is called with the output of the previous stage. `params` lists the
+    parameters the stage reads. Stages with no `checkpoint_format` are not saved;
+    the saved output of `memoize` stages is reused outside resume mode too, if the
+    checkpoints were created with `memoize` set. A `passthrough` stage returns its
+    input unchanged (e.g. it only checks it), so the later stages are keyed on the
+    stage before it.
+    """
+
+    name: str
+    run: Callable[[Any], Any]
+    params: list[str]
+    checkpoint_format: CheckpointFormat | None = None
+    memoize: bool = False
+    passthrough: bool = False
+
+
+def _save_rds(value: object, path: str) -> None:
+    from rpy2 import robjects
+
+    robjects.r["saveRDS"](value, file=path)
+
+
+def _load_rds(path: str) -> object:
+    from rpy2 import robjects
+
+    return robjects.r["readRDS"](path)
+
+
+def _save_parquet_frames(frames: dict[str, Any], path: str) -> None:
+    """Save a dict of DataFrames or column dicts as a directory of Parquet files."""
+    import pandas as pd
+
+    os.mkdir(path)
+    index = []
+    for i, (name, frame) in enumerate(frames.items()):
+        file_name = f"{i}.parquet"
+        columnar = isinstance(frame, dict)
+        table = pd.DataFrame(frame) if columnar else frame
+        table.to_parquet(os.path.join(path, file_name), index=False)
+        index.append({"name": name, "file": file_name, "columnar": columnar})
+    with open(os.path.join(path, "index.json"), "w") as fh:
+        json.dump(index, fh)
+
+
+def _load_parquet_frames(path: str) -> dict[str, Any]:
+    import pandas as pd
+
+    with open(os.path.join(path, "index.json")) as fh:
+        index = json.load(fh)
+    frames = {}
+    for entry in index:
+        table = pd.read_parquet(os.path.join(path, entry["file"]))
+        frames[entry["name"]] = dict(table.items()) if entry["columnar"] else table
+    return frames
+
+
+# R objects, saved with saveRDS
+RDS = CheckpointFormat(".rds", _save_rds, _load_rds)
+# dicts of pandas DataFrames or of column dicts, saved as Parquet files
+PARQUET_FRAMES = CheckpointFormat(
+    ".parquet", _save_parquet_frames, _load_parquet_frames
+)
+
+
+def canonical_value(value: object) -> object:
+    """Convert a parameter value into a canonical form for hashing.
+
+    Parameters from the UI may arrive as strings or as numbers, so numeric strings
+    and integers are converted to floats; other strings are stripped.
+
+    :param value: parameter value
+    :type value: object
+    :return: canonical value
+    :rtype: object
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int | float):
+        return float(value)
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def params_hash(params: dict[str, Any], names: list[str]) -> str:
+    """Hash the canonical values of the named parameters.
+
+    :param params: parameters
+    :type params: dict[str, Any]
+    :param names: names of the parameters to include
+    :type names: list[str]
+    :return: hex digest
+    :rtype: str
+    """
+    return _hash({name: canonical_value(params.get(name)) for name in names})
+
+
+def _hash(data: object) -> str:
+    encoded = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class Checkpoints:
+    """Run the stages of a pipeline, saving and reusing their output."""
+
+    def __init__(  # noqa: PLR0913
+        self: "Checkpoints",
+        checkpoint_dir: str,
+        params: dict[str, Any],
+        *,
+        resume: bool = False,
+        memoize: bool = False,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        """Initialise an instance of the class.
+
+        :param self: class instance
+        :type self: Checkpoints
+        :param checkpoint_dir: directory to save the checkpoints in; created if it does not exist
+        :type checkpoint_dir: str
+        :param params: parameters for the run
+        :type params: dict[str, Any]
+        :param resume: whether to reuse the saved output of any stage, defaults to False
+        :type resume: bool
+        :param memoize: whether to reuse the saved output of `memoize` stages outside
+            resume mode; only enable this for a directory that is kept between jobs,
+            defaults to False
+        :type memoize: bool
+        :param max_bytes: maximum total size of the checkpoints, defaults to DEFAULT_MAX_BYTES
+        :type max_bytes: int
+        :raises ValueError: if max_bytes is not positive
+        """
+        if max_bytes <= 0:
+            err_msg = f"Invalid checkpoint size {max_bytes}: must be greater than 0"
+            raise ValueError(err_msg)
+        self.checkpoint_dir = os.path.abspath(checkpoint_dir)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.params = params
+        self.resume = resume
+        self.memoize = memoize
+        self.max_bytes = max_bytes
+        # the saved output of the last stage of the last `run`, if there is one
+        self.output_path: str | None = None
+
+    @classmethod
+    def from_config(
+        cls: type["Checkpoints"], config: dict[str, Any], params: dict[str, Any]
+    ) -> "Checkpoints | None":
+        """Create the checkpoints for a run.
+
+        Checkpoints are only useful if they outlive the job, so they are only
+        enabled if `config["checkpoint-dir"]` is set, and should point at
+        persistent storage rather than the per-job scratch directory. Setting
+        `checkpoint-max-bytes` to 0 also disables them. Resume mode is enabled by
+        the `resume` parameter; memoized stages are reused outside resume mode.
+        Saved outputs are only reused if the inputs are versioned UPAs.
+
+        :param config: app config
+        :type config: dict[str, Any]
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: the checkpoints, or None if they are disabled
+        :rtype: Checkpoints | None
+        """
+        resume = str(params.get("resume", "")).strip().lower() in ("1", "true")
+        base_dir = config.get("checkpoint-dir")
+        max_bytes = config.get("checkpoint-max-bytes")
+        max_bytes = DEFAULT_MAX_BYTES if max_bytes in (None, "") else int(max_bytes)
+        if not base_dir or max_bytes <= 0:
+            if resume:
+                logger.warning(
+                    "Checkpoints are disabled, so the run cannot be resumed; "
+                    "set checkpoint-dir to enable them"
+                )
+            return None
+        reuse = has_versioned_inputs(params)
+        if not reuse:
+            logger.warning(
+                "The inputs are not all versioned UPAs, so no saved stage outputs "
+                "are reused"
+            )
+        return cls(
+            base_dir,
+            params,
+            resume=resume and reuse,
+            memoize=reuse,
+            max_bytes=max_bytes,
+        )
+
+    def stage_keys(self: "Checkpoints", stages: list[Stage]) -> list[str]:
+        """Calculate the key of each stage.
+
+        :param self: class instance
+        :type self: Checkpoints
+        :param stages: stages of the pipeline
+        :type stages: list[Stage]
+        :return: key for each stage
+        :rtype: list[str]
+        """
+        keys = []
+        previous = params_hash(self.params, INPUT_PARAMS)
+        for stage in stages:
+            key = _hash(
+                {
+                    "stage": stage.name,
+                    "params": params_hash(self.params, stage.params),
+                    "previous": previous,
+                }
+            )
+            keys.append(key)
+            if not stage.passthrough:
+                previous = key
+        return keys
+
+    def _path(self: "Checkpoints", stage: Stage, key: str) -> str:
+        return os.path.join(
+            self.checkpoint_dir, stage.name, f"{key}{stage.checkpoint_format.suffix}"
+        )
+
+    def load(self: "Checkpoints", stage: Stage, key: str) -> tuple[bool, Any]:
+        """Load the saved output of a stage, if there is one with the given key.
+
+        :param self: class instance
+        :type self: Checkpoints
+        :param stage: the stage
+        :type stage: Stage
+        :param key: the key of the stage
+        :type key: str
+        :return: whether the output was loaded, and its value
+        :rtype: tuple[bool, Any]
+        """
+        if stage.checkpoint_format is None:
+            return False, None
+        path = self._path(stage, key)
+        if not os.path.exists(path):
+            return False, None
+        try:
+            value = stage.checkpoint_format.load(path)
+        except CHECKPOINT_ERRORS:
+            logger.warning(
+                "Removing unreadable %s checkpoint", stage.name, exc_info=True
+            )
+            _remove(path)
+            return False, None
+        # mark the checkpoint as recently used
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return True, value
+
+    def save(self: "Checkpoints", stage: Stage, key: str, value: object) -> None:
+        """Save the output of a stage.
+
+        Failures are logged rather than raised, as the run can continue without
+        the checkpoint.
+
+        :param self: class instance
+        :type self: Checkpoints
+        :param stage: the stage
+        :type stage: Stage
+        :param key: the key of the stage
+        :type key: str
+        :param value: the output of the stage
+        :type value: object
+        """
+        if stage.checkpoint_format is None:
+            return
+        path = self._path(stage, key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary path so that incomplete output is never loaded
+        tmp_path = f"{path}.{uuid.uuid4().hex}{TMP_SUFFIX}"
+        try:
+            stage.checkpoint_format.save(value, tmp_path)
+            os.replace(tmp_path, path)
+        except CHECKPOINT_ERRORS:
+            logger.warning(
+                "Could not save the %s checkpoint", stage.name, exc_info=True
+            )
+        finally:
+            _remove(tmp_path)
+
+    def evict(self: "Checkpoints") -> None:
+        """Remove the least recently used checkpoints until they fit within max_bytes.
+
+        :param self: class instance
+        :type self: Checkpoints
+        """
+        entries = []
+        for stage_dir in os.scandir(self.checkpoint_dir):
+            if not stage_dir.is_dir():
+                continue
+            for entry in os.scandir(stage_dir.path):
+                if entry.name.endswith(TMP_SUFFIX):
+                    continue
+                try:
+                    entries.append(
+                        (entry.stat().st_mtime, _size(entry.path), entry.path)
+                    )
+                except FileNotFoundError:
+                    continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+            logger.info(
+                "Removed checkpoint %s", os.path.relpath(path, self.checkpoint_dir)
+            )
+
+    def run(self: "Checkpoints", stages: list[Stage], value: object = None) -> object:
+        """Run the stages of a pipeline in order, saving the output of each one.
+
+        The run starts after the last stage whose saved output can be reused: any
+        saved stage in resume mode, or memoized stages if `memoize` is set. The path
+        to the saved output of the last stage, if any, is then in `output_path`.
+
+        :param self: class instance
+        :type self: Checkpoints
+        :param stages: stages of the pipeline
+        :type stages: list[Stage]
+        :param value: input to the first stage, defaults to None
+        :type value: object
+        :return: output of the last stage
+        :rtype: object
+        """
+        keys = self.stage_keys(stages)
+        self.output_path = None
+        start = 0
+        for i in reversed(range(len(stages))):
+            if not (self.resume or (self.memoize and stages[i].memoize)):
+                continue
+            loaded, loaded_value = self.load(stages[i], keys[i])
+            if loaded:
+                logger.info("Reusing the saved output of %s", stages[i].name)
+                start, value = i + 1, loaded_value
+                break
+
+        for stage, key in zip(stages[start:], keys[start:], strict=True):
+            value = stage.run(value)
+            self.save(stage, key, value)
+        self.evict()
+
+        if stages and stages[-1].checkpoint_format is not None:
+            path = self._path(stages[-1], keys[-1])
+            self.output_path = path if os.path.exists(path) else None
+        return value
+
+
+def has_versioned_inputs(params: dict[str, Any]) -> bool:
+    """Check whether the input data of a run is identified by versioned UPAs.
+
+    The example data used in debug mode never changes.
+
+    :param params: parameters for the run
+    :type params: dict[str, Any]
+    :return: True if every input reference is a versioned UPA, or in debug mode
+    :rtype: bool
+    """
+    if params.get("debug"):
+        return True
+    return all(
+        VERSIONED_UPA_REGEX.fullmatch(str(params.get(name, "")).strip())
+        for name in INPUT_REF_PARAMS
+    )
+
+
+def _size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.stat(path).st_size
+    return sum(
+        os.stat(os.path.join(root, name)).st_size
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
@@ -0,0 +1,143 @@
+"""Write the EAF summary and the per-resample EAF values to files.
+
+The summary can be written as a tab-separated text file, a gzip-compressed one,
+or with its column types kept as Parquet or Feather. The EAF value of every
+feature in every resample can also be saved as Parquet, so that the distribution
+can be analysed without running the resampling again.
+"""
+
+import os
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from kb_qsip.utils.app_params import CONFIDENCE_COLUMN
+
+RESAMPLES_FILE_NAME = "EAF_resamples.parquet"
+# columns of the EAF summary holding counts of resamples
+COUNT_COLUMNS = ["labeled_resamples", "unlabeled_resamples"]
+
+
+def typed_summary(eaf_summary: DataFrame) -> DataFrame:
+    """Give the columns of an EAF summary consistent types for columnar formats.
+
+    Feature IDs are strings and resample counts are (nullable) integers, whether
+    the summary came from R, where counts may be doubles, or from NumPy.
+
+    :param eaf_summary: EAF summary
+    :type eaf_summary: DataFrame
+    :return: the summary with converted columns
+    :rtype: DataFrame
+    """
+    dtypes: dict[str, Any] = {"feature_id": "string"}
+    dtypes.update({col: "Int64" for col in COUNT_COLUMNS})
+    if CONFIDENCE_COLUMN in eaf_summary.columns:
+        dtypes[CONFIDENCE_COLUMN] = "float64"
+    return eaf_summary.astype(
+        {col: dtype for col, dtype in dtypes.items() if col in eaf_summary.columns}
+    )
+
+
+def _write_tsv(eaf_summary: DataFrame, path: str) -> None:
+    eaf_summary.to_csv(path, sep="\t", index=False)
+
+
+def _write_parquet(eaf_summary: DataFrame, path: str) -> None:
+    typed_summary(eaf_summary).to_parquet(path, index=False)
+
+
+def _write_feather(eaf_summary: DataFrame, path: str) -> None:
+    typed_summary(eaf_summary).reset_index(drop=True).to_feather(path)
+
+
+# file name, writer, and report description for each summary format
+SUMMARY_WRITERS: dict[str, tuple[str, Callable[[DataFrame, str], None], str]] = {
+    "tsv": ("EAF_summary.txt", _write_tsv, "Text summary of EAF values"),
+    "tsv.gz": (
+        "EAF_summary.txt.gz",
+        _write_tsv,
+        "Text summary of EAF values, gzip-compressed",
+    ),
+    "parquet": ("EAF_summary.parquet", _write_parquet, "EAF values in Parquet format"),
+    "feather": ("EAF_summary.feather", _write_feather, "EAF values in Feather format"),
+}
+
+
+def write_summary(
+    eaf_summary: DataFrame, output_directory: str, formats: list[str]
+) -> list[dict[str, str]]:
+    """Write the EAF summary in each of the given formats.
+
+    :param eaf_summary: EAF summary
+    :type eaf_summary: DataFrame
+    :param output_directory: directory to save the files in
+    :type output_directory: str
+    :param formats: formats to write, from `app_params.get_summary_formats`
+    :type formats: list[str]
+    :return: file_links entry for each file, to attach it to the report
+    :rtype: list[dict[str, str]]
+    """
+    reports = []
+    for fmt in formats:
+        file_name, write, description = SUMMARY_WRITERS[fmt]
+        path = os.path.join(output_directory, file_name)
+        # pandas compresses the output according to the file extension
+        write(eaf_summary, path)
+        reports.append({"path": path, "name": file_name, "description": description})
+    return reports
+
+
+def resamples_table(
+    feature_ids: np.ndarray, observed_eaf: np.ndarray, resampled_eaf: np.ndarray
+) -> DataFrame:
+    """Make a long table of the EAF value of each feature in each resample.
+
+    The columns match those of the EAF values stored by
+    qsip2::run_EAF_calculations. Feature IDs are stored as a categorical, so the
+    table is not much larger than the array of EAF values.
+
+    :param feature_ids: feature IDs
+    :type feature_ids: np.ndarray
+    :param observed_eaf: observed EAF of each feature
+    :type observed_eaf: np.ndarray
+    :param resampled_eaf: resampled EAF values, shape (features, resamples)
+    :type resampled_eaf: np.ndarray
+    :return: table with one row per feature and resample
+    :rtype: DataFrame
+    """
+    n_features, n_resamples = resampled_eaf.shape
+    codes = np.repeat(np.arange(n_features), n_resamples)
+    return DataFrame(
+        {
+            "feature_id": pd.Categorical.from_codes(
+                codes, categories=pd.Index(feature_ids, dtype="string")
+            ),
+            "observed_EAF": np.repeat(observed_eaf, n_resamples),
+            "resample": np.tile(
+                np.arange(1, n_resamples + 1, dtype=np.int32), n_features
+            ),
+            "EAF": resampled_eaf.reshape(-1),
+        }
+    )
+
+
+def write_resamples(resampled: DataFrame, output_directory: str) -> dict[str, str]:
+    """Write the per-resample EAF values as Parquet.
+
+    :param resampled: EAF value of each feature in each resample
+    :type resampled: DataFrame
+    :param output_directory: directory to save the file in
+    :type output_directory: str
+    :return: file_links entry for the file, to attach it to the report
+    :rtype: dict[str, str]
+    """
+    path = os.path.join(output_directory, RESAMPLES_FILE_NAME)
+    resampled.to_parquet(path, index=False)
+    return {
+        "path": path,
+        "name": RESAMPLES_FILE_NAME,
+        "description": "EAF value of each feature in each resample, in Parquet format",
+    }
@@ -0,0 +1,330 @@
+"""Split the EAF summary into pages for plotting and for the interactive viewer.
+
+With tens of thousands of features, a single plot of every feature is slow to
+render and unreadable. Instead, the top features by EAF are drawn in the main
+plot, and the rest are split into numbered pages. Only the first few pages are
+rendered as PNGs; every page is also saved as a small JSON file, which the HTML
+viewer loads when the page is opened. The viewer, the page data and the rendered
+pages are kept in a directory of their own, which is the report's HTML link.
+"""
+
+import json
+import math
+import os
+from typing import Any, NamedTuple
+
+from pandas import DataFrame, concat
+
+from kb_qsip.utils.app_params import CONFIDENCE_COLUMN, PageOptions, get_resamples
+
+VIEWER_DIR_NAME = "eaf_viewer"
+VIEWER_FILE_NAME = "EAF_viewer.html"
+TOP_FILE_NAME = "EAF_plot_top.png"
+PAGE_DIR_NAME = "eaf_pages"
+# columns of the EAF summary saved for the viewer
+PAGE_COLUMNS = ["feature_id", "observed_EAF", "mean_resampled_EAF", "lower", "upper"]
+
+
+class EafPages(NamedTuple):
+    """The features of the main EAF plot and of each page, in rank order."""
+
+    top: DataFrame
+    pages: list[DataFrame]
+    options: PageOptions
+
+
+def rank_features(eaf_summary: DataFrame, params: dict[str, Any]) -> DataFrame:
+    """Rank the features of an EAF summary by observed EAF, highest first.
+
+    In batch mode, the features are ranked at the first confidence level. As in
+    qsip2::plot_EAF_values, features with too few successful resamples for the
+    `resample_success` ratio are left out; if there is one ratio per confidence
+    level, the ratio for the first level is used.
+
+    :param eaf_summary: EAF summary
+    :type eaf_summary: DataFrame
+    :param params: param dictionary from app input
+    :type params: dict[str, Any]
+    :return: the summary rows, in rank order; features with no EAF come last
+    :rtype: DataFrame
+    """
+    if CONFIDENCE_COLUMN in eaf_summary.columns:
+        first_level = eaf_summary[CONFIDENCE_COLUMN].iloc[0]
+        eaf_summary = eaf_summary[eaf_summary[CONFIDENCE_COLUMN] == first_level]
+        eaf_summary = eaf_summary.drop(columns=CONFIDENCE_COLUMN)
+
+    resample_success = params.get("resample_success")
+    if isinstance(resample_success, list | tuple):
+        resample_success = resample_success[0] if resample_success else None
+    if resample_success not in (None, ""):
+        min_resamples = float(resample_success) * get_resamples(params)
+        successful = eaf_summary[["labeled_resamples", "unlabeled_resamples"]].min(
+            axis=1
+        )
+        eaf_summary = eaf_summary[successful >= min_resamples]
+
+    return eaf_summary.sort_values(
+        "observed_EAF", ascending=False, na_position="last", kind="stable"
+    ).reset_index(drop=True)
+
+
+def paginate(
+    eaf_summary: DataFrame, params: dict[str, Any], options: PageOptions
+) -> EafPages:
+    """Split the features into the main plot and numbered pages.
+
+    The main plot has the `top_n` highest-ranked features, or the highest-ranked
+    features whose EAF is significantly above zero (lower bound > 0) if
+    `significant_only`. Every other feature goes on a page, in rank order.
+
+    :param eaf_summary: EAF summary
+    :type eaf_summary: DataFrame
+    :param params: param dictionary from app input
+    :type params: dict[str, Any]
+    :param options: page options
+    :type options: PageOptions
+    :return: features of the main plot and of each page
+    :rtype: EafPages
+    """
+    ranked = rank_features(eaf_summary, params)
+    candidates = ranked[ranked["lower"] > 0] if options.significant_only else ranked
+    top = candidates.head(options.top_n)
+    rest = ranked.drop(index=top.index)
+    pages = [
+        rest.iloc[start : start + options.page_size]
+        for start in range(0, len(rest), options.page_size)
+    ]
+    return EafPages(top.reset_index(drop=True), pages, options)
+
+
+def viewer_directory(output_directory: str) -> str:
+    """Directory of the viewer, the page data and the rendered pages.
+
+    :param output_directory: directory of the report files
+    :type output_directory: str
+    :return: path of the viewer directory
+    :rtype: str
+    """
+    return os.path.join(output_directory, VIEWER_DIR_NAME)
+
+
+def page_file_name(page: int) -> str:
+    """Name of the PNG file for a page.
+
+    :param page: page number, from 1; page 0 is the main plot
+    :type page: int
+    :return: file name
+    :rtype: str
+    """
+    if page == 0:
+        return TOP_FILE_NAME
+    return f"EAF_plot_page_{page:04d}.png"
+
+
+def is_rendered(eaf_pages: EafPages, page: int) -> bool:
+    """Check whether a page is rendered as a PNG.
+
+    :param eaf_pages: features of the main plot and of each page
+    :type eaf_pages: EafPages
+    :param page: page number, from 1; page 0 is the main plot
+    :type page: int
+    :return: True for the main plot and the first `max_pages` pages, unless empty
+    :rtype: bool
+    """
+    features = eaf_pages.top if page == 0 else eaf_pages.pages[page - 1]
+    return page <= eaf_pages.options.max_pages and len(features) > 0
+
+
+def write_viewer(eaf_pages: EafPages, output_directory: str) -> dict[str, str]:
+    """Write the page data and the HTML viewer.
+
+    The files are saved in the viewer directory (see `viewer_directory`), next to
+    the rendered pages. Each page is saved as `eaf_pages/page_NNNN.json`, with an
+    index listing the pages and the range of the EAF values so that every page is
+    drawn on the same scale. The viewer only fetches a page when it is opened.
+
+    :param eaf_pages: features of the main plot and of each page
+    :type eaf_pages: EafPages
+    :param output_directory: directory of the report files
+    :type output_directory: str
+    :return: report entry for the viewer, with the viewer directory as its path
+    :rtype: dict[str, str]
+    """
+    viewer_dir = viewer_directory(output_directory)
+    page_dir = os.path.join(viewer_dir, PAGE_DIR_NAME)
+    os.makedirs(page_dir, exist_ok=True)
+
+    all_pages = [eaf_pages.top, *eaf_pages.pages]
+    index = []
+    first_rank = 1
+    for i, page in enumerate(all_pages):
+        file_name = f"page_{i:04d}.json"
+        page[PAGE_COLUMNS].to_json(
+            os.path.join(page_dir, file_name), orient="records", double_precision=6
+        )
+        index.append(
+            {
+                "title": "Top features" if i == 0 else f"Page {i}",
+                "file": f"{PAGE_DIR_NAME}/{file_name}",
+                "image": page_file_name(i) if is_rendered(eaf_pages, i) else None,
+                "first_rank": None if i == 0 else first_rank,
+                "n_features": len(page),
+            }
+        )
+        if i > 0:
+            first_rank += len(page)
+
+    # infinite bounds are left out of the range
+    features = concat(all_pages)[["lower", "upper"]].replace(
+        [math.inf, -math.inf], math.nan
+    )
+    bounds = [
+        _finite_or_none(features["lower"].min()),
+        _finite_or_none(features["upper"].max()),
+    ]
+    with open(os.path.join(page_dir, "index.json"), "w") as fh:
+        json.dump({"pages": index, "bounds": bounds}, fh)
+
+    with open(os.path.join(viewer_dir, VIEWER_FILE_NAME), "w") as fh:
+        fh.write(VIEWER_HTML)
+
+    return {
+        "path": viewer_dir,
+        "name": VIEWER_FILE_NAME,
+        "description": "Interactive EAF plot of every feature, one page at a time",
+    }
+
+
+def _finite_or_none(value: float) -> float | None:
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>EAF values</title>
+<style>
+  body { font-family: sans-serif; margin: 1em; }
+  nav { margin-bottom: 1em; }
+  #status { margin-left: 1em; color: #555; }
+  svg text { font-size: 11px; }
+  .range { stroke: #4477aa; stroke-width: 2; }
+  .point { fill: #222; }
+  .zero { stroke: #999; stroke-dasharray: 4 3; }
+</style>
+</head>
+<body>
+<h1>EAF values</h1>
+<nav>
+  <button id="prev">&larr;</button>
+  <select id="page"></select>
+  <button id="next">&rarr;</button>
+  <a id="image" hidden>PNG</a>
+  <span id="status"></span>
+</nav>
+<svg id="plot" width="900"></svg>
+<script>
+(function () {
+  "use strict";
+  var ROW = 14, LABEL = 260, MARGIN = 30, WIDTH = 900;
+  var cache = {};
+  var index = null;
+  var select = document.getElementById("page");
+  var status = document.getElementById("status");
+  var svg = document.getElementById("plot");
+  var image = document.getElementById("image");
+
+  function element(name, attrs, text) {
+    var el = document.createElementNS("http://www.w3.org/2000/svg", name);
+    Object.keys(attrs).forEach(function (key) { el.setAttribute(key, attrs[key]); });
+    if (text !== undefined) { el.textContent = text; }
+    return el;
+  }
+
+  function loadPage(i) {
+    if (!cache[i]) {
+      cache[i] = fetch(index.pages[i].file).then(function (response) {
+        if (!response.ok) { throw new Error(response.statusText); }
+        return response.json();
+      });
+    }
+    return cache[i];
+  }
+
+  function draw(rows) {
+    var lo = index.bounds[0] === null ? -1 : Math.min(index.bounds[0], 0);
+    var hi = index.bounds[1] === null ? 1 : Math.max(index.bounds[1], 0);
+    var x = function (v) {
+      return LABEL + (v - lo) / (hi - lo || 1) * (WIDTH - LABEL - MARGIN);
+    };
+    var height = rows.length * ROW + 2 * MARGIN;
+    svg.setAttribute("height", height);
+    while (svg.firstChild) { svg.removeChild(svg.firstChild); }
+    svg.appendChild(element("line", {
+      class: "zero", x1: x(0), x2: x(0), y1: MARGIN / 2, y2: height - MARGIN
+    }));
+    rows.forEach(function (row, i) {
+      var y = MARGIN + i * ROW + ROW / 2;
+      var label = element("text", {x: LABEL - 8, y: y + 4, "text-anchor": "end"},
+                          row.feature_id);
+      label.appendChild(element("title", {}, row.feature_id + ": EAF " + row.observed_EAF
+                                + " (" + row.lower + " to " + row.upper + ")"));
+      svg.appendChild(label);
+      if (row.lower !== null && row.upper !== null) {
+        svg.appendChild(element("line", {class: "range", x1: x(row.lower),
+                                         x2: x(row.upper), y1: y, y2: y}));
+      }
+      if (row.observed_EAF !== null) {
+        svg.appendChild(element("circle", {class: "point", cx: x(row.observed_EAF),
+                                           cy: y, r: 3}));
+      }
+    });
+    [lo, 0, hi].forEach(function (v) {
+      svg.appendChild(element("text", {x: x(v), y: height - MARGIN / 2,
+                                       "text-anchor": "middle"}, v.toFixed(2)));
+    });
+  }
+
+  function show(i) {
+    i = Math.max(0, Math.min(index.pages.length - 1, i));
+    select.value = i;
+    image.hidden = !index.pages[i].image;
+    image.href = index.pages[i].image || "";
+    status.textContent = "Loading...";
+    loadPage(i).then(function (rows) {
+      if (Number(select.value) !== i) { return; }
+      var page = index.pages[i];
+      status.textContent = page.n_features + " features" + (page.first_rank === null ? ""
+        : ", ranks " + page.first_rank + "-" + (page.first_rank + page.n_features - 1));
+      draw(rows);
+    }).catch(function (error) {
+      status.textContent = "Could not load " + index.pages[i].file + ": " + error.message;
+    });
+  }
+
+  fetch("eaf_pages/index.json").then(function (response) {
+    return response.json();
+  }).then(function (data) {
+    index = data;
+    index.pages.forEach(function (page, i) {
+      var option = document.createElement("option");
+      option.value = i;
+      option.textContent = page.title;
+      select.appendChild(option);
+    });
+    select.addEventListener("change", function () { show(Number(select.value)); });
+    document.getElementById("prev").addEventListener("click", function () {
+      show(Number(select.value) - 1);
+    });
+    document.getElementById("next").addEventListener("click", function () {
+      show(Number(select.value) + 1);
+    });
+    show(0);
+  });
+}());
+</script>
+</body>
+</html>
+"""
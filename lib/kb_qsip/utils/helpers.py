@@ -1,11 +1,35 @@
 """General helper functions for kb_qsip."""
 
 import logging
+import multiprocessing
 import os
+import tempfile
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any
 
+from combinatrix.constants import LONG, WIDE
 from combinatrix.converter import convert_data
 from combinatrix.fetcher import DataFetcher
+from kb_qsip.utils import numpy_backend
+from kb_qsip.utils.app_params import (
+    get_confidence,
+    get_confidence_levels,
+    get_filter_thresholds,
+    get_isotopes,
+    get_resamples,
+    get_sample_fields,
+    is_batch,
+)
+from kb_qsip.utils.eaf_pages import (
+    VIEWER_DIR_NAME,
+    EafPages,
+    is_rendered,
+    page_file_name,
+)
+from kb_qsip.utils.r_convert import pandas_to_r_dataframe
+import numpy as np
 from pandas import DataFrame
 import rpy2.robjects as robjects
 from rpy2.robjects.methods import RS4
@@ -20,6 +44,117 @@ dplyr = importr('dplyr')
 
 PARAM_NAMES = ["source", "sample", "feature"]
 
+RESAMPLING_SEED = 14
+
+# the plot workers each start R and load qSIP2, and read the qsip object from an
+# RDS file; a qsip object with no saved copy that is smaller than this is drawn
+# in this process, as writing the copy and starting the workers costs more than
+# the workers save
+PLOT_POOL_MIN_BYTES = 16 * 1024**2
+
+# get or set the resamples of a qsip_data object, which may be S4 or S7
+r_get_resamples = robjects.r(
+    """
+    function(qsip_data_object) {
+        if (isS4(qsip_data_object)) qsip_data_object@resamples
+        else S7::prop(qsip_data_object, "resamples")
+    }
+    """
+)
+r_set_resamples = robjects.r(
+    """
+    function(qsip_data_object, resamples) {
+        if (isS4(qsip_data_object)) qsip_data_object@resamples <- resamples
+        else S7::prop(qsip_data_object, "resamples") <- resamples
+        qsip_data_object
+    }
+    """
+)
+# get the EAF values of each feature in each resample, stored by
+# qsip2::run_EAF_calculations
+get_EAF_values = robjects.r(  # noqa: N816
+    """
+    function(qsip_data_object) {
+        if (isS4(qsip_data_object)) qsip_data_object@EAF
+        else S7::prop(qsip_data_object, "EAF")
+    }
+    """
+)
+# merge the resamples of chunks run separately; the `resamples` slot of a
+# qsip_data object is a list with `u` and `l`, lists with one data frame of
+# resampled WADs per resample, numbered by their `resample` column, as well as
+# `n`, the number of resamples, and the `seed`
+merge_resamples = robjects.r(
+    """
+    function(chunks, chunk_sizes, resamples, with_seed) {
+        offsets <- cumsum(c(0, chunk_sizes))[seq_along(chunks)]
+        merged <- chunks[[1]]
+        for (type in c("u", "l")) {
+            merged[[type]] <- unlist(
+                Map(
+                    function(chunk, offset) {
+                        if (is.data.frame(chunk[[type]]) || !is.list(chunk[[type]])) {
+                            stop("Unexpected structure of the '", type, "' resamples")
+                        }
+                        lapply(chunk[[type]], function(df) {
+                            df$resample <- df$resample + offset
+                            df
+                        })
+                    },
+                    chunks,
+                    offsets
+                ),
+                recursive = FALSE
+            )
+            if (length(merged[[type]]) != resamples) {
+                stop("Expected ", resamples, " '", type, "' resamples, got ",
+                     length(merged[[type]]))
+            }
+        }
+        merged$n <- resamples
+        merged$seed <- with_seed
+        merged
+    }
+    """
+)
+
+# plot the EAF values of a set of features from an EAF summary, keeping the
+# order of the rows from top to bottom
+plot_EAF_features = robjects.r(  # noqa: N816
+    """
+    function(eaf_summary, title) {
+        eaf_summary$feature_id <- factor(eaf_summary$feature_id,
+                                         levels = rev(eaf_summary$feature_id))
+        ggplot2::ggplot(eaf_summary, ggplot2::aes(x = observed_EAF, y = feature_id)) +
+            ggplot2::geom_vline(xintercept = 0, linetype = "dashed", colour = "grey50") +
+            ggplot2::geom_pointrange(ggplot2::aes(xmin = lower, xmax = upper),
+                                     size = 0.2, colour = "#4477aa") +
+            ggplot2::labs(title = title, x = "EAF", y = NULL) +
+            ggplot2::theme_bw()
+    }
+    """
+)
+# rebuild a wide feature table from the non-zero cells of a matrix; row_id and
+# column_id are factors with every feature and sample as a level, so features
+# and samples with no non-zero cells are kept
+sparse_to_wide = robjects.r(
+    """
+    function(cells) {
+        m <- matrix(
+            0,
+            nrow = nlevels(cells$row_id),
+            ncol = nlevels(cells$column_id),
+            dimnames = list(NULL, levels(cells$column_id))
+        )
+        m[cbind(as.integer(cells$row_id), as.integer(cells$column_id))] <- cells$value
+        data.frame(row_id = levels(cells$row_id), m, check.names = FALSE)
+    }
+    """
+)
+
+# height of the EAF page plots, per feature, in mm
+EAF_PAGE_ROW_HEIGHT = 4
+
 
 def retrieve_convert_objects(
     params: dict[str, Any], qsip_config: dict[str, Any], token: str
@@ -49,8 +184,36 @@ def retrieve_convert_objects(
         err_msg = f"Only found {len(to_fetch)} unique KBase objects to fetch. Check your parameters and rerun the app."
         raise ValueError(err_msg)
 
-    fetched_data = fetcher.fetch_objects_by_ref(list(to_fetch))
-    return convert_data(fetched_data)
+    if params.get("pivot_features_in_r"):
+        # original path, kept for parity testing: long-format matrix data that is
+        # pivoted by qsip2.pivot_kbase_amplicon_matrix, which expects the 'id' field
+        matrix_options = {"layout": LONG, "include_id": True}
+    elif params.get("sparse_features"):
+        # only the non-zero cells are converted and sent to R
+        matrix_options = {"layout": LONG, "drop_zeros": True}
+    else:
+        matrix_options = {"layout": WIDE}
+
+    # the SampleSets and the (much larger) feature matrix are fetched in separate
+    # requests, so that the sample lookups can run while the matrix downloads;
+    # the matrix values are decoded straight into a NumPy array, and the samples
+    # are converted as they arrive
+    with fetcher.open_object_groups(
+        [
+            [params["source_data"], params["sample_data"]],
+            [params["feature_data"]],
+        ],
+        stream=True,
+    ) as fetched_data:
+        # only the sample and source fields that the run reads are converted
+        return convert_data(
+            fetched_data,
+            columnar=True,
+            converter_options={
+                "Matrix": matrix_options,
+                "SampleSet": {"fields": get_sample_fields(params)},
+            },
+        )
 
 
 def retrieve_object_dataframes_from_qsip2_data(
@@ -72,7 +235,7 @@ def make_source_object(source_df: DataFrame | RS4, params: dict[str, Any]) -> RS
 
     # validation checks are all run inside qSIP2 R package
 
-    source_df = dplyr.select(source_df, rl('-save_date'))
+    source_df = dplyr.select(source_df, rl('-dplyr::any_of("save_date")'))
 
     # de-MISIPify if necessary
     source_df = qsip2.remove_isotopolog_label_check(source_df)
@@ -86,19 +249,21 @@ def make_source_object(source_df: DataFrame | RS4, params: dict[str, Any]) -> RS
 
 def make_sample_object(sample_df: DataFrame | RS4, params: dict[str, Any]) -> RS4:
 
-    sample_df = dplyr.select(sample_df, rl('-save_date'))
+    sample_df = dplyr.select(sample_df, rl('-dplyr::any_of("save_date")'))
 
+    rel_amt = params["S_gradient_pos_rel_amt"]
     if params["calculate_gradient_pos_rel_amt"] == 1:
 
         # If relative amounts are not already calculated, then do this now
         sample_df = qsip2.add_gradient_pos_rel_amt(
             sample_df,
             source_mat_id=params["S_source_mat_id"],
-            amt=params["S_gradient_pos_rel_amt"],
+            amt=rel_amt,
         )
 
-        # set the params to the newly generated column
-        params["S_gradient_pos_rel_amt"] = "gradient_pos_rel_amt"
+        # use the newly generated column, leaving the params unchanged as they
+        # key the checkpoints
+        rel_amt = "gradient_pos_rel_amt"
 
     # validation checks are all run inside qSIP2 R package
     return qsip2.qsip_sample_data(
@@ -108,24 +273,31 @@ def make_sample_object(sample_df: DataFrame | RS4, params: dict[str, Any]) -> RS
         gradient_position=params["S_gradient_position"],
         gradient_pos_density=params["S_gradient_pos_density"],
         gradient_pos_amt=params["S_gradient_pos_amt"], 
-        gradient_pos_rel_amt=params["S_gradient_pos_rel_amt"],
+        gradient_pos_rel_amt=rel_amt,
     )
 
 
 # feature data
-def make_feature_object(feature_df: DataFrame | RS4, params: dict[str, Any]) -> RS4:
-
-    # print(baseR.dim(feature_df))
-    # print(baseR.colnames(feature_df))
-    
-    feature_df = qsip2.pivot_kbase_amplicon_matrix(feature_df)
+def make_feature_object(
+    feature_df: DataFrame | RS4,
+    params: dict[str, Any],
+    feature_type: str | None = None,
+) -> RS4:
 
-    # print(baseR.dim(feature_df))
-    # print(baseR.colnames(feature_df))
+    # long-format matrix data (one row per cell) has to be pivoted first;
+    # wide data, with one column per sample, can be used as-is
+    columns = baseR.colnames(feature_df)
+    if "column_id" in columns:
+        if "id" in columns:
+            feature_df = qsip2.pivot_kbase_amplicon_matrix(feature_df)
+        else:
+            # non-zero cells only, from `sparse_features`
+            feature_df = sparse_to_wide(feature_df)
 
     # validation checks are all run inside qSIP2 R package
+    # the type is "relative" for pre-filtered data, whatever the input type
     return qsip2.qsip_feature_data(
-        feature_df, feature_id="row_id", type=params["F_type"]
+        feature_df, feature_id="row_id", type=feature_type or params["F_type"]
     )
 
 
@@ -133,6 +305,7 @@ def make_feature_object(feature_df: DataFrame | RS4, params: dict[str, Any]) ->
 def make_qsip_object(
     dataframes: dict[str, DataFrame | RS4],
     params: dict[str, Any],
+    feature_type: str | None = None,
 ) -> RS4:
 
     source_data = make_source_object(dataframes[params["source_data"]], params) 
@@ -141,7 +314,9 @@ def make_qsip_object(
     sample_data = make_sample_object(dataframes[params["sample_data"]], params)
     # logging.info(sample_data)
 
-    feature_data = make_feature_object(dataframes[params["feature_data"]], params)
+    feature_data = make_feature_object(
+        dataframes[params["feature_data"]], params, feature_type
+    )
     # logging.info(feature_data)
 
     # validation checks are all run inside qSIP2 R package
@@ -149,23 +324,118 @@ def make_qsip_object(
 
 
 def run_feature_filter(qsip_object: RS4, params: dict[str, Any]) -> RS4:
+    # the same thresholds and isotopes as numpy_backend.prefilter_features
+    unlabeled_isotope, labeled_isotope = get_isotopes(params)
     qsip_object = qsip2.run_feature_filter(qsip_object,
-                   unlabeled_source_mat_ids = qsip2.get_all_by_isotope(qsip_object, rl("'16O'")),
-                   labeled_source_mat_ids = qsip2.get_all_by_isotope(qsip_object, rl("'18O'")),
-                   min_unlabeled_sources = 1,
-                   min_labeled_sources = 1,
-                   min_unlabeled_fractions = 1,
-                   min_labeled_fractions = 1)
-    
+                   unlabeled_source_mat_ids = qsip2.get_all_by_isotope(qsip_object, robjects.StrVector([unlabeled_isotope])),
+                   labeled_source_mat_ids = qsip2.get_all_by_isotope(qsip_object, robjects.StrVector([labeled_isotope])),
+                   **get_filter_thresholds(params))
+
     return qsip_object
 
+def split_resamples(resamples: int, n_chunks: int) -> list[int]:
+    """Split a number of resamples into (nearly) equally-sized chunks.
+
+    :param resamples: total number of resamples
+    :type resamples: int
+    :param n_chunks: number of chunks
+    :type n_chunks: int
+    :return: number of resamples in each chunk
+    :rtype: list[int]
+    """
+    n_chunks = max(1, min(n_chunks, resamples))
+    base, extra = divmod(resamples, n_chunks)
+    return [base + 1 if i < extra else base for i in range(n_chunks)]
+
+
+def chunk_seeds(with_seed: int, n_chunks: int) -> list[int]:
+    """Derive a deterministic, independent random seed for each resampling chunk.
+
+    :param with_seed: base seed
+    :type with_seed: int
+    :param n_chunks: number of chunks
+    :type n_chunks: int
+    :return: list of seeds, usable by R's `set.seed`
+    :rtype: list[int]
+    """
+    return [
+        int(seq.generate_state(1)[0] & 0x7FFFFFFF)
+        for seq in np.random.SeedSequence(with_seed).spawn(n_chunks)
+    ]
+
+
+def _resample_chunk(serialized_qsip_object: bytes, resamples: int, with_seed: int) -> bytes:
+    """Run qsip2::run_resampling on a serialized qsip object in a worker process.
+
+    Importing this module in the worker starts the worker's own R interpreter.
+
+    :return: the serialized `resamples` property of the resampled object
+    :rtype: bytes
+    """
+    qsip_object = baseR.unserialize(robjects.vectors.ByteVector(serialized_qsip_object))
+    qsip_object = qsip2.run_resampling(qsip_object,
+                                       resamples = resamples,
+                                       with_seed = with_seed,
+                                       allow_failures = True,
+                                       progress = False)
+    return bytes(baseR.serialize(r_get_resamples(qsip_object), robjects.NULL))
+
+
+def run_parallel_resampling(
+    qsip_object: RS4, resamples: int, n_workers: int, with_seed: int = RESAMPLING_SEED
+) -> RS4:
+    """Run resampling in chunks across a pool of worker processes.
+
+    Each chunk uses a seed derived from `with_seed` and its position, so results
+    are identical for a given number of workers.
+
+    :param qsip_object: filtered qsip object
+    :type qsip_object: RS4
+    :param resamples: total number of resamples
+    :type resamples: int
+    :param n_workers: number of worker processes
+    :type n_workers: int
+    :param with_seed: base random seed, defaults to RESAMPLING_SEED
+    :type with_seed: int
+    :return: qsip object with the merged resamples
+    :rtype: RS4
+    """
+    chunk_sizes = split_resamples(resamples, n_workers)
+    seeds = chunk_seeds(with_seed, len(chunk_sizes))
+    serialized = bytes(baseR.serialize(qsip_object, robjects.NULL))
+
+    with ProcessPoolExecutor(
+        max_workers=len(chunk_sizes), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        chunk_results = list(
+            executor.map(
+                _resample_chunk,
+                [serialized] * len(chunk_sizes),
+                chunk_sizes,
+                seeds,
+            )
+        )
+
+    chunks = robjects.vectors.ListVector.from_length(len(chunk_results))
+    for i, result in enumerate(chunk_results):
+        chunks[i] = baseR.unserialize(robjects.vectors.ByteVector(result))
+
+    merged = merge_resamples(
+        chunks, robjects.IntVector(chunk_sizes), resamples, with_seed
+    )
+    return r_set_resamples(qsip_object, merged)
+
+
 def run_resampling(qsip_object: RS4, params: dict[str, Any]) -> RS4:
 
-    # TODO verify params["resamples"] is an int
+    resamples = get_resamples(params)
+    n_workers = int(params.get("resampling_workers", 1))
+    if n_workers > 1:
+        return run_parallel_resampling(qsip_object, resamples, n_workers)
 
     qsip_object = qsip2.run_resampling(qsip_object,
-                                       resamples = int(params["resamples"]),
-                                       with_seed = 14,
+                                       resamples = resamples,
+                                       with_seed = RESAMPLING_SEED,
                                        allow_failures = True,
                                        progress = False)
     
@@ -177,23 +447,32 @@ def run_EAF_calculations(qsip_object: RS4, params: dict[str, Any]) -> RS4:
     return qsip_object
 
 def summarize_EAF_values(qsip_object: RS4, params: dict[str, Any]) -> DataFrame:
-    # TODO verify params["confidence"] is a float between 0-1
+    """Summarise the EAF values at the confidence level(s) in the params.
 
-    eaf_summary = qsip2.summarize_EAF_values(qsip_object, 
-                                             confidence = float(params["confidence"]))
-    
+    In batch mode (a list of confidence levels), the summaries for each level are
+    combined into one long table with a confidence column.
+    """
+    levels = get_confidence(params)
+    summaries = []
+    for confidence in levels if isinstance(levels, list) else [levels]:
+        eaf_summary = qsip2.summarize_EAF_values(qsip_object, confidence=confidence)
+        with (robjects.default_converter + pandas2ri.converter).context():
+            summaries.append(robjects.conversion.get_conversion().rpy2py(eaf_summary))
+
+    if not isinstance(levels, list):
+        return summaries[0]
+    return numpy_backend.add_confidence_column(summaries, levels)
+
+def EAF_resamples(qsip_object: RS4) -> DataFrame:  # noqa: N802
+    """Get the EAF value of each feature in each resample as a DataFrame.
+
+    :param qsip_object: qsip object with EAF values
+    :type qsip_object: RS4
+    :return: table with one row per feature and resample
+    :rtype: DataFrame
+    """
     with (robjects.default_converter + pandas2ri.converter).context():
-        pd_EAF_summary = robjects.conversion.get_conversion().rpy2py(eaf_summary)
-
-    return(pd_EAF_summary)
-    
-def write_EAF_summary(eaf_summary: DataFrame, output_directory: str):
-
-    eaf_summary.to_csv(os.path.join(output_directory, "EAF_summary.txt"), sep="\t", index=False)
-
-    return {'path': output_directory,
-            'name': "EAF_summary.txt",
-            'description': 'Text summary of EAF values'}
+        return robjects.conversion.get_conversion().rpy2py(get_EAF_values(qsip_object))
 
 
 def plot_source_wads(qsip_object: RS4, output_directory: str, params: dict[str, Any]):
@@ -224,7 +503,12 @@ def plot_filter_results(qsip_object: RS4, output_directory: str):
             'name':  "filter_results.png",
             'description': 'plot of filtering results'}
 
-def plot_EAF_results(qsip_object: RS4, output_directory: str, params: dict[str, Any]):
+def plot_EAF_results(
+    qsip_object: RS4,
+    output_directory: str,
+    params: dict[str, Any],
+    file_name: str = "EAF_plot.png",
+):
 
     qsip_plot = qsip2.plot_EAF_values(qsip_object,
                                       confidence = float(params["confidence"]),
@@ -232,12 +516,262 @@ def plot_EAF_results(qsip_object: RS4, output_directory: str, params: dict[str,
                                       error = "ribbon",
                                       alpha = 0.3)
 
-    robjects.r.ggsave(filename=os.path.join(output_directory, "EAF_plot.png"), 
+    robjects.r.ggsave(filename=os.path.join(output_directory, file_name), 
                     plot=qsip_plot, 
                     width=300, 
                     height=600, 
                     unit='mm')
     
     return {'path': output_directory,
-            'name':  "EAF_plot.png",
-            'description': 'EAF results plot with confidence ribbon'}
\ No newline at end of file
+            'name':  file_name,
+            'description': f'EAF results plot with {params["confidence"]} confidence ribbon'}
+
+def plot_EAF_page(  # noqa: N802
+    _qsip_object: RS4 | None,
+    output_directory: str,
+    eaf_summary: DataFrame,
+    file_name: str,
+    title: str,
+) -> dict[str, str]:
+    """Plot the EAF values of the features in part of the EAF summary.
+
+    The plot is drawn from the summary alone, so the qsip object is not used. Its
+    height grows with the number of features. `file_name` may include a
+    subdirectory of `output_directory`, which is created if necessary.
+    """
+    qsip_plot = plot_EAF_features(pandas_to_r_dataframe(eaf_summary), title)
+    path = os.path.join(output_directory, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    robjects.r.ggsave(filename=path,
+                    plot=qsip_plot,
+                    width=200,
+                    height=30 + EAF_PAGE_ROW_HEIGHT * len(eaf_summary),
+                    unit='mm',
+                    limitsize=False)
+
+    return {'path': os.path.dirname(path),
+            'name': os.path.basename(path),
+            'description': title}
+
+
+# plots for the report, by name
+PLOT_FUNCTIONS = {
+    "plot_source_wads": plot_source_wads,
+    "plot_filter_results": plot_filter_results,
+    "plot_EAF_results": plot_EAF_results,
+    "plot_EAF_page": plot_EAF_page,
+}
+# plots that are drawn without the qsip object
+SUMMARY_PLOTS = {"plot_EAF_page"}
+
+
+def eaf_page_jobs(eaf_pages: EafPages) -> list[tuple[str, dict[str, Any]]]:
+    """List the paged EAF plots to render: the main plot and the first pages.
+
+    The pages are drawn in the viewer directory, where the viewer links to them.
+
+    :param eaf_pages: features of the main plot and of each page
+    :type eaf_pages: EafPages
+    :return: name of the plot function and its keyword arguments for each plot
+    :rtype: list[tuple[str, dict[str, Any]]]
+    """
+    jobs = []
+    first_rank = 1
+    for page, features in enumerate([eaf_pages.top, *eaf_pages.pages]):
+        if page == 0:
+            title = f"Top {len(features)} features by EAF"
+        else:
+            last_rank = first_rank + len(features) - 1
+            title = f"EAF page {page}: features {first_rank}-{last_rank}"
+            first_rank += len(features)
+        if is_rendered(eaf_pages, page):
+            jobs.append(
+                (
+                    "plot_EAF_page",
+                    {
+                        "eaf_summary": features,
+                        "file_name": os.path.join(
+                            VIEWER_DIR_NAME, page_file_name(page)
+                        ),
+                        "title": title,
+                    },
+                )
+            )
+    return jobs
+
+
+def plot_jobs(
+    params: dict[str, Any], eaf_pages: EafPages | None = None
+) -> list[tuple[str, dict[str, Any]]]:
+    """List the plots to render for the report.
+
+    In paged mode, the paged EAF plots replace the EAF plot of every feature, so
+    in batch mode there is no EAF plot per confidence level: the pages are drawn
+    at the first level, while the EAF summary has every level.
+
+    :param params: param dictionary from app input
+    :type params: dict[str, Any]
+    :param eaf_pages: if given, the paged EAF plots are drawn instead of the plot
+        of every feature, defaults to None
+    :type eaf_pages: EafPages | None
+    :return: name of the plot function and its keyword arguments for each plot,
+        with one EAF plot per confidence level in batch mode
+    :rtype: list[tuple[str, dict[str, Any]]]
+    """
+    jobs = [
+        ("plot_source_wads", {"params": params}),
+        ("plot_filter_results", {}),
+    ]
+    if eaf_pages is not None:
+        return jobs + eaf_page_jobs(eaf_pages)
+    # the levels have any missing resample_success filled in with the default
+    levels = get_confidence_levels(params)
+    if not is_batch(params):
+        confidence, resample_success = levels[0]
+        return [
+            *jobs,
+            (
+                "plot_EAF_results",
+                {
+                    "params": {
+                        **params,
+                        "confidence": confidence,
+                        "resample_success": resample_success,
+                    }
+                },
+            ),
+        ]
+    return jobs + [
+        (
+            "plot_EAF_results",
+            {
+                "params": {
+                    **params,
+                    "confidence": confidence,
+                    "resample_success": resample_success,
+                },
+                "file_name": f"EAF_plot_{confidence:g}_{resample_success:g}.png",
+            },
+        )
+        for confidence, resample_success in levels
+    ]
+
+
+def render_plot(
+    qsip_object: RS4, output_directory: str, plot_name: str, kwargs: dict[str, Any]
+) -> tuple[dict[str, str], float]:
+    """Render a plot and time it.
+
+    :param qsip_object: qsip object with EAF values
+    :type qsip_object: RS4
+    :param output_directory: directory to save the plot in
+    :type output_directory: str
+    :param plot_name: name of the plot function in this module
+    :type plot_name: str
+    :param kwargs: keyword arguments for the plot function
+    :type kwargs: dict[str, Any]
+    :return: report entry for the plot, and the time taken to render it in seconds
+    :rtype: tuple[dict[str, str], float]
+    """
+    start = time.perf_counter()
+    report = PLOT_FUNCTIONS[plot_name](qsip_object, output_directory, **kwargs)
+    return report, time.perf_counter() - start
+
+
+def _render_plot_from_rds(
+    rds_path: str, output_directory: str, plot_name: str, kwargs: dict[str, Any]
+) -> tuple[dict[str, str], float]:
+    """Load a saved qsip object and render a plot from it in a worker process.
+
+    Importing this module in the worker starts the worker's own R interpreter.
+    The qsip object is not loaded for plots drawn from the EAF summary.
+    """
+    qsip_object = None if plot_name in SUMMARY_PLOTS else baseR.readRDS(rds_path)
+    return render_plot(qsip_object, output_directory, plot_name, kwargs)
+
+
+def render_plots(  # noqa: PLR0913
+    qsip_object: RS4,
+    output_directory: str,
+    params: dict[str, Any],
+    n_workers: int = 1,
+    rds_path: str | None = None,
+    while_rendering: Callable[[], None] | None = None,
+    eaf_pages: EafPages | None = None,
+) -> list[tuple[dict[str, str], float]]:
+    """Render the report plots, in a pool of worker processes if n_workers > 1.
+
+    Each worker loads the qsip object from an RDS file: `rds_path` if given (e.g.
+    the checkpoint of the EAF calculations), or otherwise a temporary copy, written
+    next to `output_directory` and removed once the plots are drawn. The copy holds
+    every resample, so it can take a while to write and read, and takes as much
+    disk space as the resamples; if the qsip object is smaller than
+    PLOT_POOL_MIN_BYTES, no copy is made and the plots are drawn in this process.
+    The file at `rds_path` must not be removed until the plots are drawn; the
+    output just saved or reused by `Checkpoints` is the most recently used, so it
+    is the last to be evicted.
+
+    :param qsip_object: qsip object with EAF values
+    :type qsip_object: RS4
+    :param output_directory: directory to save the plots in
+    :type output_directory: str
+    :param params: param dictionary from app input
+    :type params: dict[str, Any]
+    :param n_workers: number of worker processes, defaults to 1
+    :type n_workers: int
+    :param rds_path: path to a saved copy of the qsip object, defaults to None
+    :type rds_path: str | None
+    :param while_rendering: function to run in this process while the workers
+        render the plots, defaults to None
+    :type while_rendering: Callable[[], None] | None
+    :param eaf_pages: if given, the paged EAF plots are drawn instead of the plot
+        of every feature, defaults to None
+    :type eaf_pages: EafPages | None
+    :return: report entry and rendering time for each plot
+    :rtype: list[tuple[dict[str, str], float]]
+    """
+    jobs = plot_jobs(params, eaf_pages)
+    n_workers = min(n_workers, len(jobs))
+    if n_workers > 1 and rds_path is None:
+        object_size = int(robjects.r["object.size"](qsip_object)[0])
+        if object_size < PLOT_POOL_MIN_BYTES:
+            logging.info(
+                "Rendering the plots in this process: the qsip object is only %d bytes",
+                object_size,
+            )
+            n_workers = 1
+    if n_workers <= 1:
+        if while_rendering is not None:
+            while_rendering()
+        return [
+            render_plot(qsip_object, output_directory, plot_name, kwargs)
+            for plot_name, kwargs in jobs
+        ]
+
+    tmp_path = None
+    try:
+        if rds_path is None:
+            fd, tmp_path = tempfile.mkstemp(
+                suffix=".rds", dir=os.path.dirname(output_directory)
+            )
+            os.close(fd)
+            baseR.saveRDS(qsip_object, file=tmp_path)
+            rds_path = tmp_path
+
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _render_plot_from_rds, rds_path, output_directory, plot_name, kwargs
+                )
+                for plot_name, kwargs in jobs
+            ]
+            if while_rendering is not None:
+                while_rendering()
+            return [future.result() for future in futures]
+    finally:
+        # also removes a partly written copy
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
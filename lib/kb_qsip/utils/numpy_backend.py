@@ -0,0 +1,820 @@
+"""NumPy implementation of the qSIP2 WAD, resampling, and EAF calculations.
+
+All calculations are done on (features x samples) or (features x sources) arrays,
+so each step is a handful of array operations over every feature at once rather
+than a call into R per step.
+
+The calculations follow those in the qSIP2 package:
+
+- the relative abundance of each feature in a sample (fraction) is multiplied by
+  the relative amount of DNA in that fraction to give the tube relative abundance;
+- the weighted average density (WAD) of a feature in a source is the mean of the
+  fraction densities, weighted by tube relative abundance;
+- features are filtered on the number of sources and fractions they are found in;
+- the unlabeled and labeled source WADs are resampled with replacement;
+- the excess atom fraction (EAF) is calculated from the mean unlabeled and labeled
+  WADs using the equations of Hungate et al. (2015).
+"""
+
+import logging
+import warnings
+from typing import Any, NamedTuple
+
+import numpy as np
+from combinatrix.constants import COLS, DL
+from pandas import Categorical, DataFrame, concat
+
+from kb_qsip.utils.app_params import (
+    CONFIDENCE_COLUMN,
+    DEFAULT_FILTER_THRESHOLDS,
+    ISOTOPE_PAIRS,
+    check_filter_feasible,
+    get_confidence,
+    get_filter_thresholds,
+    get_isotopes,
+    get_resamples,
+)
+from kb_qsip.utils.eaf_output import resamples_table
+
+RESAMPLING_SEED = 14
+# default number of features resampled at once
+RESAMPLING_BLOCK_SIZE = 64
+
+UNLABELED = "unlabeled"
+LABELED = "labeled"
+
+# the difference between the maximum labeled molecular weight and the unlabeled
+# molecular weight of DNA is `slope * GC content + intercept`
+ISOTOPE_CONSTANTS = {
+    "13C": {
+        "natural_abundance": 0.01111233,
+        "slope": -0.4987282,
+        "intercept": 9.974564,
+    },
+    "15N": {
+        "natural_abundance": 0.003663004,
+        "slope": 0.5024851,
+        "intercept": 3.517396,
+    },
+    "18O": {"natural_abundance": 0.002000429, "slope": 0.0, "intercept": 12.07747},
+}
+
+SUMMARY_COLUMNS = [
+    "feature_id",
+    "observed_EAF",
+    "mean_resampled_EAF",
+    "lower",
+    "upper",
+    "labeled_resamples",
+    "unlabeled_resamples",
+]
+
+
+class SparseMatrix(NamedTuple):
+    """A (features x samples) matrix in coordinate (COO) form.
+
+    Only the non-zero cells are stored, as the row index, column index and value
+    of each cell.
+    """
+
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+    shape: tuple[int, int]
+
+
+def sparse_from_columns(
+    columns: dict[str, Any]
+) -> tuple[SparseMatrix, list[str], list[str]]:
+    """Make a sparse matrix from long-layout matrix columns.
+
+    :param columns: matrix data from `convert_matrix_columnar` in the long layout,
+        usually with `drop_zeros`; `row_id` and `column_id` are categoricals
+    :type columns: dict[str, Any]
+    :return: the matrix, and the feature IDs and sample IDs of its rows and columns
+    :rtype: tuple[SparseMatrix, list[str], list[str]]
+    """
+    row_ids = Categorical(columns["row_id"])
+    column_ids = Categorical(columns["column_id"])
+    matrix = SparseMatrix(
+        rows=row_ids.codes.astype(np.intp),
+        cols=column_ids.codes.astype(np.intp),
+        values=np.asarray(columns["value"], dtype=np.float64),
+        shape=(len(row_ids.categories), len(column_ids.categories)),
+    )
+    return matrix, list(row_ids.categories), list(column_ids.categories)
+
+
+def map_samples_to_sources(  # noqa: PLR0913
+    source_df: DataFrame,
+    sample_df: DataFrame,
+    sample_ids: list[str],
+    params: dict[str, Any],
+    source_id_col: str = "name",
+    sample_id_col: str = "name",
+) -> dict[str, Any]:
+    """Line up the source and sample metadata with the columns of the feature matrix.
+
+    :param source_df: source data
+    :type source_df: DataFrame
+    :param sample_df: sample data
+    :type sample_df: DataFrame
+    :param sample_ids: the sample IDs of the feature matrix columns
+    :type sample_ids: list[str]
+    :param params: app params
+    :type params: dict[str, Any]
+    :param source_id_col: name of the source ID column in the source data, defaults to "name"
+    :type source_id_col: str
+    :param sample_id_col: name of the sample ID column in the sample data, defaults to "name"
+    :type sample_id_col: str
+    :raises ValueError: if samples or sources cannot be matched up
+    :return: dict with the source IDs and isotopes, and the source index, density and
+        relative DNA amount for each sample
+    :rtype: dict[str, Any]
+    """
+    source_ids = source_df[source_id_col].astype(str).to_numpy()
+    source_index = {source_id: i for i, source_id in enumerate(source_ids)}
+
+    samples = sample_df.set_index(sample_df[sample_id_col].astype(str))
+    missing_samples = [s for s in sample_ids if s not in samples.index]
+    if missing_samples:
+        err_msg = f"Feature data samples not found in the sample data: {', '.join(missing_samples)}"
+        raise ValueError(err_msg)
+
+    sample_sources = samples[params["S_source_mat_id"]].astype(str)
+    rel_amt = samples[params["S_gradient_pos_rel_amt"]].astype(np.float64)
+    if params["calculate_gradient_pos_rel_amt"] == 1:
+        # as in qsip2::add_gradient_pos_rel_amt, the column holds the amounts, which
+        # are made relative to the total amount in all fractions of the source
+        rel_amt = rel_amt / rel_amt.groupby(sample_sources).transform("sum")
+
+    # line everything up with the matrix columns
+    sample_ids = list(sample_ids)
+    sample_sources = sample_sources.loc[sample_ids]
+    missing_sources = sorted(set(sample_sources) - set(source_index))
+    if missing_sources:
+        err_msg = f"Sample data sources not found in the source data: {', '.join(missing_sources)}"
+        raise ValueError(err_msg)
+
+    return {
+        "source_ids": source_ids,
+        "source_isotopes": source_isotopes(source_df, params),
+        "sample_source": sample_sources.map(source_index).to_numpy(dtype=np.intp),
+        "density": samples.loc[sample_ids, params["S_gradient_pos_density"]].to_numpy(
+            dtype=np.float64
+        ),
+        "rel_amt": rel_amt.loc[sample_ids].to_numpy(),
+    }
+
+
+def source_isotopes(source_df: DataFrame, params: dict[str, Any]) -> np.ndarray:
+    """Get the isotope of each source.
+
+    As in qsip2::remove_isotopolog_label_check, sources whose `isotopolog_label`
+    is "natural abundance" have the unlabeled isotope paired with the labeled one
+    in the isotope column.
+
+    :param source_df: source data
+    :type source_df: DataFrame
+    :param params: app params
+    :type params: dict[str, Any]
+    :raises ValueError: if the isotope column is not in the source data
+    :return: isotope of each source
+    :rtype: np.ndarray
+    """
+    if params["M_isotope"] not in source_df.columns:
+        err_msg = f"Isotope column '{params['M_isotope']}' not found in the source data"
+        raise ValueError(err_msg)
+    isotopes = source_df[params["M_isotope"]].astype(str)
+    if "isotopolog_label" in source_df.columns:
+        natural = source_df["isotopolog_label"].astype(str) == "natural abundance"
+        isotopes = isotopes.mask(natural, isotopes.map(ISOTOPE_PAIRS).fillna(isotopes))
+    return isotopes.to_numpy()
+
+
+def check_filter_params(
+    source_df: DataFrame,
+    sample_df: DataFrame,
+    params: dict[str, Any],
+    source_id_col: str = "name",
+) -> None:
+    """Check the isotopes and filter thresholds against the source and sample data.
+
+    See `app_params.check_filter_feasible`. This only reads two columns of each
+    table, so invalid params are found before the data is copied into R.
+
+    :param source_df: source data
+    :type source_df: DataFrame
+    :param sample_df: sample data
+    :type sample_df: DataFrame
+    :param params: app params
+    :type params: dict[str, Any]
+    :param source_id_col: name of the source ID column, defaults to "name"
+    :type source_id_col: str
+    :raises ValueError: if the params cannot be used with the data
+    """
+    if params["S_source_mat_id"] not in sample_df.columns:
+        err_msg = f"Source ID column '{params['S_source_mat_id']}' not found in the sample data"
+        raise ValueError(err_msg)
+    check_filter_feasible(
+        params,
+        dict(
+            zip(
+                source_df[source_id_col].astype(str),
+                source_isotopes(source_df, params),
+                strict=True,
+            )
+        ),
+        list(sample_df[params["S_source_mat_id"]].astype(str)),
+    )
+
+
+def calculate_wads(  # noqa: PLR0913
+    values: np.ndarray | SparseMatrix,
+    sample_source: np.ndarray,
+    density: np.ndarray,
+    rel_amt: np.ndarray,
+    n_sources: int,
+    feature_type: str = "counts",
+) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate the weighted average density of every feature in every source.
+
+    For a sparse matrix, only the non-zero cells are read, and memory use scales
+    with their number rather than with features x samples.
+
+    :param values: feature abundances, shape (features, samples)
+    :type values: np.ndarray | SparseMatrix
+    :param sample_source: index of the source of each sample
+    :type sample_source: np.ndarray
+    :param density: gradient position density of each sample
+    :type density: np.ndarray
+    :param rel_amt: relative amount of DNA in each sample
+    :type rel_amt: np.ndarray
+    :param n_sources: number of sources
+    :type n_sources: int
+    :param feature_type: feature data type; all but "relative" are normalised
+        to relative abundances, defaults to "counts"
+    :type feature_type: str
+    :return: WADs (NaN where a feature is absent from a source) and the number of
+        fractions each feature is found in per source, both of shape (features, sources)
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    if isinstance(values, SparseMatrix):
+        return _calculate_sparse_wads(
+            values, sample_source, density, rel_amt, n_sources, feature_type
+        )
+
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    if feature_type != "relative":
+        sample_totals = values.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.where(sample_totals > 0, values / sample_totals, 0.0)
+    tube_rel_abundance = values * rel_amt
+
+    # sum the samples of each source with a (samples x sources) indicator matrix
+    source_indicator = np.zeros((len(sample_source), n_sources))
+    source_indicator[np.arange(len(sample_source)), sample_source] = 1.0
+
+    abundance = tube_rel_abundance @ source_indicator
+    weighted_density = (tube_rel_abundance * density) @ source_indicator
+    n_fractions = (tube_rel_abundance > 0).astype(np.float64) @ source_indicator
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wads = np.where(abundance > 0, weighted_density / abundance, np.nan)
+    return wads, n_fractions.astype(np.int64)
+
+
+def _calculate_sparse_wads(  # noqa: PLR0913
+    matrix: SparseMatrix,
+    sample_source: np.ndarray,
+    density: np.ndarray,
+    rel_amt: np.ndarray,
+    n_sources: int,
+    feature_type: str,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate the WADs from a sparse matrix; see `calculate_wads`."""
+    n_features, n_samples = matrix.shape
+    values = np.nan_to_num(matrix.values)
+    if feature_type != "relative":
+        sample_totals = np.bincount(matrix.cols, weights=values, minlength=n_samples)
+        totals = sample_totals[matrix.cols]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.where(totals > 0, values / totals, 0.0)
+    tube_rel_abundance = values * rel_amt[matrix.cols]
+
+    # sum the cells of each (feature, source) pair
+    cell_source = matrix.rows * n_sources + sample_source[matrix.cols]
+    n_pairs = n_features * n_sources
+    abundance = np.bincount(cell_source, weights=tube_rel_abundance, minlength=n_pairs)
+    weighted_density = np.bincount(
+        cell_source,
+        weights=tube_rel_abundance * density[matrix.cols],
+        minlength=n_pairs,
+    )
+    n_fractions = np.bincount(cell_source[tube_rel_abundance > 0], minlength=n_pairs)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wads = np.where(abundance > 0, weighted_density / abundance, np.nan)
+    return (
+        wads.reshape(n_features, n_sources),
+        n_fractions.reshape(n_features, n_sources).astype(np.int64),
+    )
+
+
+def filter_features(
+    wads: np.ndarray,
+    n_fractions: np.ndarray,
+    unlabeled: np.ndarray,
+    labeled: np.ndarray,
+    thresholds: dict[str, int] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Filter features on the number of sources and fractions they are found in.
+
+    A source only counts towards a feature if the feature is found in at least
+    the minimum number of fractions of that source; the WADs of sources that do
+    not count are set to NaN.
+
+    :param wads: WADs, shape (features, sources)
+    :type wads: np.ndarray
+    :param n_fractions: number of fractions each feature is found in, shape (features, sources)
+    :type n_fractions: np.ndarray
+    :param unlabeled: boolean mask of the unlabeled sources
+    :type unlabeled: np.ndarray
+    :param labeled: boolean mask of the labeled sources
+    :type labeled: np.ndarray
+    :param thresholds: filter thresholds, defaults to DEFAULT_FILTER_THRESHOLDS
+    :type thresholds: dict[str, int] | None
+    :return: boolean mask of the features passing the filter, and the filtered WADs
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    keep, source_ok = select_features(n_fractions, unlabeled, labeled, thresholds)
+    return keep, np.where(source_ok, wads, np.nan)
+
+
+def select_features(
+    n_fractions: np.ndarray,
+    unlabeled: np.ndarray,
+    labeled: np.ndarray,
+    thresholds: dict[str, int] | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Find the features passing the filter, and the sources that count towards them.
+
+    See `filter_features`.
+
+    :param n_fractions: number of fractions each feature is found in, shape (features, sources)
+    :type n_fractions: np.ndarray
+    :param unlabeled: boolean mask of the unlabeled sources
+    :type unlabeled: np.ndarray
+    :param labeled: boolean mask of the labeled sources
+    :type labeled: np.ndarray
+    :param thresholds: filter thresholds, defaults to DEFAULT_FILTER_THRESHOLDS
+    :type thresholds: dict[str, int] | None
+    :return: boolean mask of the features passing the filter, and boolean mask of
+        the sources counting towards each feature, shape (features, sources)
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    thresholds = {**DEFAULT_FILTER_THRESHOLDS, **(thresholds or {})}
+    min_fractions = np.where(
+        labeled,
+        thresholds["min_labeled_fractions"],
+        thresholds["min_unlabeled_fractions"],
+    )
+    source_ok = (n_fractions >= min_fractions) & (unlabeled | labeled)
+    keep = (
+        source_ok[:, unlabeled].sum(axis=1) >= thresholds["min_unlabeled_sources"]
+    ) & (source_ok[:, labeled].sum(axis=1) >= thresholds["min_labeled_sources"])
+    return keep, source_ok
+
+
+def count_fractions(
+    values: np.ndarray | SparseMatrix, sample_source: np.ndarray, n_sources: int
+) -> np.ndarray:
+    """Count the fractions of each source in which each feature has a non-zero abundance.
+
+    :param values: feature abundances, shape (features, samples)
+    :type values: np.ndarray | SparseMatrix
+    :param sample_source: index of the source of each sample
+    :type sample_source: np.ndarray
+    :param n_sources: number of sources
+    :type n_sources: int
+    :return: number of fractions, shape (features, sources)
+    :rtype: np.ndarray
+    """
+    if isinstance(values, SparseMatrix):
+        n_features = values.shape[0]
+        present = np.greater(values.values, 0)
+        cell_source = (
+            values.rows[present] * n_sources + sample_source[values.cols[present]]
+        )
+        return np.bincount(cell_source, minlength=n_features * n_sources).reshape(
+            n_features, n_sources
+        )
+
+    # NaN is not counted, as NaN > 0 is False
+    present = np.asarray(values) > 0
+    n_fractions = np.zeros((present.shape[0], n_sources), dtype=np.int64)
+    for source in np.unique(sample_source):
+        n_fractions[:, source] = np.count_nonzero(
+            present[:, sample_source == source], axis=1
+        )
+    return n_fractions
+
+
+def prefilter_features(
+    feature_columns: dict[str, Any],
+    source_df: DataFrame,
+    sample_df: DataFrame,
+    params: dict[str, Any],
+) -> dict[str, Any]:
+    """Drop the features that cannot pass the feature filter before they are copied into R.
+
+    A feature counts as found in a fraction if its abundance there is above zero.
+    qsip2::run_feature_filter is never less strict than this, so every feature that
+    it would keep is kept, and it is still run on the remaining features.
+
+    As qSIP2 converts counts into relative abundances using the total of every
+    feature in a sample, the remaining abundances are returned as relative
+    abundances of the full matrix, which leaves the WADs unchanged. They must be
+    passed to qSIP2 with the feature type "relative".
+
+    :param feature_columns: feature data from `convert_matrix_columnar`, in either layout
+    :type feature_columns: dict[str, Any]
+    :param source_df: source data
+    :type source_df: DataFrame
+    :param sample_df: sample data
+    :type sample_df: DataFrame
+    :param params: app params
+    :type params: dict[str, Any]
+    :return: the feature data of the remaining features, in the same layout
+    :rtype: dict[str, Any]
+    """
+    columns = dict(feature_columns)
+    long_layout = "column_id" in columns
+    values: np.ndarray | SparseMatrix
+    if long_layout:
+        values, feature_ids, sample_ids = sparse_from_columns(columns)
+    else:
+        feature_ids = columns.pop("row_id")
+        sample_ids = list(columns)
+        values = np.column_stack(list(columns.values()))
+
+    mapping = map_samples_to_sources(source_df, sample_df, sample_ids, params)
+    unlabeled_isotope, labeled_isotope = get_isotopes(params)
+    keep, _ = select_features(
+        count_fractions(values, mapping["sample_source"], len(mapping["source_ids"])),
+        mapping["source_isotopes"] == unlabeled_isotope,
+        mapping["source_isotopes"] == labeled_isotope,
+        get_filter_thresholds(params),
+    )
+    logging.info(
+        "Feature pre-filter: kept %d of %d features", keep.sum(), len(feature_ids)
+    )
+    relative = params.get("F_type") == "relative"
+
+    if not long_layout:
+        kept_values = values[keep]
+        if not relative:
+            kept_values = _relative_abundance(kept_values, np.nansum(values, axis=0))
+        # column-major, so that each column is a contiguous view
+        kept_values = np.asfortranarray(kept_values)
+        return {
+            "row_id": np.asarray(feature_ids, dtype=object)[keep],
+            **{sample_id: kept_values[:, i] for i, sample_id in enumerate(sample_ids)},
+        }
+
+    cells = keep[values.rows]
+    # renumber the remaining features
+    row_codes = (np.cumsum(keep) - 1)[values.rows[cells]]
+    # keep the column order, and every sample as a category
+    filtered = {}
+    for name, column in columns.items():
+        if name == "row_id":
+            filtered[name] = Categorical.from_codes(
+                row_codes.astype(np.int32),
+                categories=Categorical(column).categories[keep],
+            )
+        elif name == "column_id":
+            filtered[name] = Categorical(column)[cells]
+        else:
+            filtered[name] = np.asarray(column)[cells]
+    if not relative:
+        totals = np.bincount(
+            values.cols, weights=np.nan_to_num(values.values), minlength=len(sample_ids)
+        )
+        filtered["value"] = _relative_abundance(
+            np.compress(cells, values.values), totals[values.cols[cells]]
+        )
+    return filtered
+
+
+def _relative_abundance(values: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(totals > 0, values / totals, 0.0)
+
+
+def resample_wads(
+    wads: np.ndarray,
+    resamples: int,
+    rng: np.random.Generator,
+    block_size: int = RESAMPLING_BLOCK_SIZE,
+) -> np.ndarray:
+    """Resample the source WADs of each feature with replacement, and take the mean.
+
+    For each feature, the sources with a WAD are drawn with replacement as many
+    times as there are such sources. The draws for every resample are generated
+    up front as a single (resamples x sources) array of uniform values. For the
+    features with k valid sources, scaling the first k columns by k gives a
+    (resamples x k) integer index array, so all resamples of a block of those
+    features are a single gather and mean. The draws are shared between features,
+    which does not affect the distribution of the resampled values of any one
+    feature.
+
+    :param wads: WADs of one group of sources, shape (features, sources); NaN = no WAD
+    :type wads: np.ndarray
+    :param resamples: number of resamples
+    :type resamples: int
+    :param rng: random number generator
+    :type rng: np.random.Generator
+    :param block_size: number of features to resample at once; memory use is
+        proportional to block_size x resamples x sources, defaults to RESAMPLING_BLOCK_SIZE
+    :type block_size: int
+    :raises ValueError: if block_size is not a positive integer
+    :return: mean resampled WADs, shape (features, resamples); NaN if a feature has no WADs
+    :rtype: np.ndarray
+    """
+    if block_size < 1:
+        err_msg = f"Invalid resampling block size {block_size}: must be at least 1"
+        raise ValueError(err_msg)
+
+    n_features, n_sources = wads.shape
+    # sorting moves the NaNs to the end of each row
+    sorted_wads = np.sort(wads, axis=1)
+    n_valid = np.count_nonzero(~np.isnan(wads), axis=1)
+    draws = rng.random((resamples, n_sources))
+
+    # features without any WADs stay NaN
+    means = np.full((n_features, resamples), np.nan)
+    for k in range(1, n_sources + 1):
+        features = np.flatnonzero(n_valid == k)
+        idx = (draws[:, :k] * k).astype(np.intp)
+        for start in range(0, len(features), block_size):
+            block = features[start : start + block_size]
+            # (features, resamples, k) array of drawn WADs
+            means[block] = sorted_wads[block, :k][:, idx].mean(axis=2)
+    return means
+
+
+def calculate_eaf(
+    unlabeled_wad: np.ndarray, labeled_wad: np.ndarray, isotope: str
+) -> np.ndarray:
+    """Calculate the excess atom fraction from mean unlabeled and labeled WADs.
+
+    :param unlabeled_wad: mean unlabeled WAD
+    :type unlabeled_wad: np.ndarray
+    :param labeled_wad: mean labeled WAD, same shape as unlabeled_wad
+    :type labeled_wad: np.ndarray
+    :param isotope: the labeled isotope, one of "13C", "15N", or "18O"
+    :type isotope: str
+    :raises ValueError: if the isotope is not recognised
+    :return: EAF values
+    :rtype: np.ndarray
+    """
+    if isotope not in ISOTOPE_CONSTANTS:
+        err_msg = f"Unknown isotope '{isotope}': must be one of {', '.join(ISOTOPE_CONSTANTS)}"
+        raise ValueError(err_msg)
+    constants = ISOTOPE_CONSTANTS[isotope]
+
+    gc_content = (unlabeled_wad - 1.646057) / 0.083506
+    mw_unlabeled = 0.496 * gc_content + 307.691
+    mw_labeled_max = (
+        mw_unlabeled + constants["slope"] * gc_content + constants["intercept"]
+    )
+    mw_labeled = (labeled_wad / unlabeled_wad) * mw_unlabeled
+
+    return (
+        (mw_labeled - mw_unlabeled)
+        / (mw_labeled_max - mw_unlabeled)
+        * (1 - constants["natural_abundance"])
+    )
+
+
+def summarize_eaf(
+    feature_ids: np.ndarray,
+    observed_eaf: np.ndarray,
+    resampled_eaf: np.ndarray,
+    resample_counts: dict[str, np.ndarray],
+    confidence: float | list[float],
+) -> DataFrame:
+    """Summarise the observed and resampled EAF values of each feature.
+
+    If a list of confidence levels is given, the quantiles for every level are
+    calculated in a single pass over the resampled values, and the summary is in
+    long format, with a "confidence" column and one row per feature and level.
+
+    :param feature_ids: feature IDs
+    :type feature_ids: np.ndarray
+    :param observed_eaf: observed EAF of each feature
+    :type observed_eaf: np.ndarray
+    :param resampled_eaf: resampled EAF values, shape (features, resamples)
+    :type resampled_eaf: np.ndarray
+    :param resample_counts: number of successful unlabeled and labeled resamples per feature
+    :type resample_counts: dict[str, np.ndarray]
+    :param confidence: confidence level(s) for the lower and upper bounds
+    :type confidence: float | list[float]
+    :return: summary table with the same columns as qsip2::summarize_EAF_values
+    :rtype: DataFrame
+    """
+    levels = confidence if isinstance(confidence, list) else [confidence]
+    probabilities = [
+        q for level in levels for q in [(1 - level) / 2, 1 - (1 - level) / 2]
+    ]
+    # features without any successful resamples give all-NaN rows
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        bounds = np.nanquantile(resampled_eaf, probabilities, axis=1)
+        mean_resampled = np.nanmean(resampled_eaf, axis=1)
+
+    summaries = [
+        DataFrame(
+            {
+                "feature_id": feature_ids,
+                "observed_EAF": observed_eaf,
+                "mean_resampled_EAF": mean_resampled,
+                "lower": bounds[2 * i],
+                "upper": bounds[2 * i + 1],
+                "labeled_resamples": resample_counts[LABELED],
+                "unlabeled_resamples": resample_counts[UNLABELED],
+            },
+            columns=SUMMARY_COLUMNS,
+        )
+        for i in range(len(levels))
+    ]
+    if not isinstance(confidence, list):
+        return summaries[0]
+    return add_confidence_column(summaries, levels)
+
+
+def add_confidence_column(summaries: list[DataFrame], levels: list[float]) -> DataFrame:
+    """Combine the EAF summaries for several confidence levels into one long table.
+
+    :param summaries: EAF summary for each confidence level
+    :type summaries: list[DataFrame]
+    :param levels: confidence levels
+    :type levels: list[float]
+    :return: combined summary, with the confidence level after the feature ID
+    :rtype: DataFrame
+    """
+    combined = []
+    for summary, level in zip(summaries, levels, strict=True):
+        with_level = summary.copy()
+        with_level.insert(1, CONFIDENCE_COLUMN, level)
+        combined.append(with_level)
+    return concat(combined, ignore_index=True)
+
+
+def run_eaf_pipeline(  # noqa: PLR0913
+    values: np.ndarray | SparseMatrix,
+    feature_ids: list[str] | np.ndarray,
+    sample_ids: list[str],
+    source_df: DataFrame,
+    sample_df: DataFrame,
+    params: dict[str, Any],
+    source_id_col: str = "name",
+    sample_id_col: str = "name",
+    *,
+    return_resamples: bool = False,
+) -> DataFrame | tuple[DataFrame, DataFrame]:
+    """Run the full WAD, filter, resampling and EAF calculation.
+
+    :param values: feature abundances, shape (features, samples)
+    :type values: np.ndarray | SparseMatrix
+    :param feature_ids: feature IDs (matrix rows)
+    :type feature_ids: list[str] | np.ndarray
+    :param sample_ids: sample IDs (matrix columns)
+    :type sample_ids: list[str]
+    :param source_df: source data
+    :type source_df: DataFrame
+    :param sample_df: sample data
+    :type sample_df: DataFrame
+    :param params: app params
+    :type params: dict[str, Any]
+    :param source_id_col: name of the source ID column, defaults to "name"
+    :type source_id_col: str
+    :param sample_id_col: name of the sample ID column, defaults to "name"
+    :type sample_id_col: str
+    :param return_resamples: whether to also return the EAF value of each feature
+        in each resample, defaults to False
+    :type return_resamples: bool
+    :return: EAF summary of the features passing the filter, and the per-resample
+        EAF values if return_resamples is set
+    :rtype: DataFrame | tuple[DataFrame, DataFrame]
+    """
+    unlabeled_isotope, labeled_isotope = get_isotopes(params)
+
+    mapping = map_samples_to_sources(
+        source_df, sample_df, sample_ids, params, source_id_col, sample_id_col
+    )
+    check_filter_feasible(
+        params,
+        dict(zip(mapping["source_ids"], mapping["source_isotopes"], strict=True)),
+        list(mapping["source_ids"][mapping["sample_source"]]),
+    )
+    wads, n_fractions = calculate_wads(
+        values,
+        mapping["sample_source"],
+        mapping["density"],
+        mapping["rel_amt"],
+        len(mapping["source_ids"]),
+        params.get("F_type", "counts"),
+    )
+    groups = {
+        UNLABELED: mapping["source_isotopes"] == unlabeled_isotope,
+        LABELED: mapping["source_isotopes"] == labeled_isotope,
+    }
+    keep, wads = filter_features(
+        wads,
+        n_fractions,
+        groups[UNLABELED],
+        groups[LABELED],
+        get_filter_thresholds(params),
+    )
+    wads = wads[keep]
+
+    rng = np.random.default_rng(RESAMPLING_SEED)
+    observed = {}
+    resampled = {}
+    for group in [UNLABELED, LABELED]:
+        group_wads = wads[:, groups[group]]
+        with np.errstate(invalid="ignore"):
+            observed[group] = np.nanmean(group_wads, axis=1)
+        resampled[group] = resample_wads(
+            group_wads,
+            get_resamples(params),
+            rng,
+            int(params.get("resampling_block_size", RESAMPLING_BLOCK_SIZE)),
+        )
+
+    kept_ids = np.asarray(feature_ids)[keep]
+    observed_eaf = calculate_eaf(
+        observed[UNLABELED], observed[LABELED], labeled_isotope
+    )
+    resampled_eaf = calculate_eaf(
+        resampled[UNLABELED], resampled[LABELED], labeled_isotope
+    )
+    eaf_summary = summarize_eaf(
+        kept_ids,
+        observed_eaf,
+        resampled_eaf,
+        {
+            group: np.count_nonzero(np.isfinite(resampled[group]), axis=1)
+            for group in resampled
+        },
+        get_confidence(params),
+    )
+    if not return_resamples:
+        return eaf_summary
+    return eaf_summary, resamples_table(kept_ids, observed_eaf, resampled_eaf)
+
+
+def _to_dataframe(converted: dict[str, Any]) -> DataFrame:
+    """Make a DataFrame from converted data, in columns or as a list of dicts."""
+    return DataFrame(converted[COLS] if COLS in converted else converted[DL])
+
+
+def run_from_converted(
+    converted_data: dict[str, Any],
+    params: dict[str, Any],
+    *,
+    return_resamples: bool = False,
+) -> DataFrame | tuple[DataFrame, DataFrame]:
+    """Run the EAF calculations on data from `helpers.retrieve_convert_objects`.
+
+    :param converted_data: converted KBase objects, indexed by UPA
+    :type converted_data: dict[str, Any]
+    :param params: app params
+    :type params: dict[str, Any]
+    :param return_resamples: whether to also return the EAF value of each feature
+        in each resample, defaults to False
+    :type return_resamples: bool
+    :return: EAF summary, and the per-resample EAF values if return_resamples is set
+    :rtype: DataFrame | tuple[DataFrame, DataFrame]
+    """
+    feature_columns = dict(converted_data[params["feature_data"]][COLS])
+    values: np.ndarray | SparseMatrix
+    if "column_id" in feature_columns:
+        # long layout, e.g. with the zero cells dropped
+        values, feature_ids, sample_ids = sparse_from_columns(feature_columns)
+    else:
+        feature_ids = feature_columns.pop("row_id")
+        sample_ids = list(feature_columns)
+        values = np.column_stack(list(feature_columns.values()))
+
+    return run_eaf_pipeline(
+        values,
+        feature_ids,
+        sample_ids,
+        _to_dataframe(converted_data[params["source_data"]]),
+        _to_dataframe(converted_data[params["sample_data"]]),
+        params,
+        return_resamples=return_resamples,
+    )
@@ -1,20 +1,78 @@
 """Main kb_qsip code."""
 
 import logging
-import uuid
 import os
-
+import uuid
 from typing import Any
 
+import requests
+from combinatrix.constants import COLS, DL
+from combinatrix.session import SessionClient, get_session
+from combinatrix.session import metrics as request_metrics
 from installed_clients.KBaseReportClient import KBaseReport
-
 from pandas import DataFrame
 
-from rpy2 import robjects
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.methods import RS4
+from kb_qsip.utils import eaf_output, eaf_pages, helpers, numpy_backend, r_convert
+from kb_qsip.utils.app_params import (
+    DEFAULT_FILTER_THRESHOLDS,
+    SAMPLE_FIELD_PARAMS,
+    get_filter_thresholds,
+    get_isotopes,
+    get_page_options,
+    get_summary_formats,
+    is_batch,
+    prefilters_features,
+    writes_resamples,
+)
+from kb_qsip.utils.checkpoint import PARQUET_FRAMES, RDS, Checkpoints, Stage
+
+QSIP2_BACKEND = "qsip2"
+NUMPY_BACKEND = "numpy"
+BACKENDS = [QSIP2_BACKEND, NUMPY_BACKEND]
+# subdirectory of the output directory for the plots; an HTML link uploads its
+# whole directory, so the plots are kept apart from the larger summary files
+PLOT_DIR_NAME = "plots"
+
+# parameters read by each stage of the pipeline, used to key their checkpoints;
+# the source and sample fields that are converted depend on SAMPLE_FIELD_PARAMS
+INPUT_STAGE_PARAMS = ["pivot_features_in_r", "sparse_features", *SAMPLE_FIELD_PARAMS]
+QSIP_OBJECT_PARAMS = [
+    "M_isotope",
+    "M_isotopolog",
+    "S_source_mat_id",
+    "S_gradient_position",
+    "S_gradient_pos_density",
+    "S_gradient_pos_amt",
+    "S_gradient_pos_rel_amt",
+    "calculate_gradient_pos_rel_amt",
+    "F_type",
+]
+FILTER_PARAMS = [*DEFAULT_FILTER_THRESHOLDS, "labeled_isotope"]
+
 
-from kb_qsip.utils import helpers
+class SessionKBaseReport(KBaseReport):
+    """KBaseReport client that makes its calls using a shared requests.Session."""
+
+    def __init__(
+        self: "SessionKBaseReport",
+        url: str,
+        session: requests.Session,
+        **kwargs: object,
+    ) -> None:
+        """Initialise an instance of the class.
+
+        :param self: class instance
+        :type self: SessionKBaseReport
+        :param url: callback URL
+        :type url: str
+        :param session: the session to make calls with
+        :type session: requests.Session
+        :param kwargs: any other BaseClient arguments, e.g. `token`
+        :type kwargs: object
+        """
+        super().__init__(url, **kwargs)
+        # the generated methods all call through `_client`
+        self._client = SessionClient(url, session, **kwargs)
 
 
 class QsipUtil:
@@ -25,11 +83,14 @@ class QsipUtil:
     ) -> None:
         """Initialise the qsip app."""
         self.config = config
-        self.scratch = config['scratch']
+        self.scratch = config["scratch"]
         self.context = context
 
-        self.callback_url = config['callback_url']
-        self.kbr = KBaseReport(self.callback_url)
+        self.callback_url = config["callback_url"]
+        # a KBaseReport client, making its calls using the shared session
+        self.kbr = SessionKBaseReport(self.callback_url, get_session(config))
+        # the request latencies are logged for each job
+        request_metrics.reset()
 
         self.token: str = context.get("token", "")
         if not self.token:
@@ -52,61 +113,433 @@ class QsipUtil:
         :return: output of running the qSIP2 R package
         :rtype: ???
         """
+        backend = params.get("backend", QSIP2_BACKEND)
+        if backend not in BACKENDS:
+            err_msg = f"Invalid backend '{backend}': must be one of {', '.join(BACKENDS)}"
+            raise ValueError(err_msg)
+        # checked before any data is fetched; they are checked against the source
+        # and sample data before it is copied into R
+        get_isotopes(params)
+        get_filter_thresholds(params)
+        if backend == NUMPY_BACKEND:
+            return self.run_numpy_backend(params)
+        # checked before the pipeline is run, as the options are used at the end
+        get_page_options(params)
+        get_summary_formats(params)
+
+        stages = [
+            self.load_stage(params),
+            *self.table_stages(params),
+            *self.qsip_stages(params),
+        ]
+        checkpoints = Checkpoints.from_config(self.config, params)
+        if checkpoints is None:
+            qsip_object = None
+            for stage in stages:
+                qsip_object = stage.run(qsip_object)
+            rds_path = None
+        else:
+            # reuses the qsip object from earlier runs that only differ in the
+            # parameters used for the summary and plots
+            qsip_object = checkpoints.run(stages)
+            rds_path = checkpoints.output_path
+
+        return self.report_results(qsip_object, params, rds_path)
+
+    def load_stage(self: "QsipUtil", params: dict[str, Any]) -> Stage:
+        """Make the pipeline stage that loads the input data as tables.
+
+        :param self: class instance
+        :type self: QsipUtil
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: the stage
+        :rtype: Stage
+        """
         if "debug" in params and params["debug"]:
-            dataframes_by_ref: dict[str, RS4] = (
-                helpers.retrieve_object_dataframes_from_qsip2_data(params)
+            return Stage(
+                "load_debug_data",
+                lambda _: helpers.retrieve_object_dataframes_from_qsip2_data(params),
+                INPUT_STAGE_PARAMS,
             )
-            # convert these
-        else:
-            # retrieve the data from the workspace, indexed by their KBase UPA
-            converted_data = helpers.retrieve_convert_objects(
-                params, self.config, self.token
+        # retrieve the data from the workspace, indexed by their KBase UPA
+        return Stage(
+            "convert",
+            lambda _: self.retrieve_tables(params),
+            INPUT_STAGE_PARAMS,
+            PARQUET_FRAMES,
+        )
+
+    def table_stages(self: "QsipUtil", params: dict[str, Any]) -> list[Stage]:
+        """Make the pipeline stages that run on the tables, before they are copied into R.
+
+        The params are checked against the source and sample data (a passthrough
+        stage, so the filter params do not key the qsip object) and, if
+        `prefilter_features` is set, the features that cannot pass the filter are
+        dropped (and so left out of the filter plot).
+
+        :param self: class instance
+        :type self: QsipUtil
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: the stages; none for the debug data
+        :rtype: list[Stage]
+        """
+        if params.get("debug"):
+            return []
+        stages = [
+            Stage(
+                "check_filter_params",
+                lambda tables: self.check_tables(tables, params),
+                FILTER_PARAMS,
+                passthrough=True,
             )
-            dataframes_by_ref: dict[str, RS4] = {}
-            # these can all be converted into dataframes
-            with (robjects.default_converter + pandas2ri.converter).context():
-                for ref in converted_data:
-                    dataframes_by_ref[
-                        ref
-                    ] = robjects.conversion.get_conversion().py2rpy(
-                        DataFrame(converted_data[ref]["dict_list"])
-                    )
+        ]
+        if prefilters_features(params):
+            stages.append(
+                Stage(
+                    "prefilter_features",
+                    lambda tables: self.prefilter_tables(tables, params),
+                    [*FILTER_PARAMS, *QSIP_OBJECT_PARAMS],
+                    PARQUET_FRAMES,
+                    memoize=True,
+                )
+            )
+        return stages
+
+    def qsip_stages(self: "QsipUtil", params: dict[str, Any]) -> list[Stage]:
+        """Make the pipeline stages that build the qsip object and run qSIP2 on it.
+
+        :param self: class instance
+        :type self: QsipUtil
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: the stages
+        :rtype: list[Stage]
+        """
+        # the pre-filtered feature data is passed to qSIP2 as relative abundances
+        feature_type = (
+            "relative"
+            if prefilters_features(params) and not params.get("debug")
+            else None
+        )
+        return [
+            Stage(
+                "make_qsip_object",
+                lambda tables: helpers.make_qsip_object(
+                    self.tables_to_r_dataframes(tables), params, feature_type
+                ),
+                QSIP_OBJECT_PARAMS,
+                RDS,
+                memoize=True,
+            ),
+            Stage(
+                "run_feature_filter",
+                lambda qsip_object: helpers.run_feature_filter(qsip_object, params),
+                FILTER_PARAMS,
+                RDS,
+                memoize=True,
+            ),
+            Stage(
+                "run_resampling",
+                lambda qsip_object: helpers.run_resampling(qsip_object, params),
+                ["resamples", "resampling_workers"],
+                RDS,
+                memoize=True,
+            ),
+            Stage(
+                "run_EAF_calculations",
+                lambda qsip_object: helpers.run_EAF_calculations(qsip_object, params),
+                [],
+                RDS,
+                memoize=True,
+            ),
+        ]
+
+    def report_results(
+        self: "QsipUtil",
+        qsip_object: helpers.RS4,
+        params: dict[str, Any],
+        rds_path: str | None = None,
+    ) -> dict[str, str]:
+        """Write the EAF summary, render the plots, and make the KBase report.
 
+        :param self: class instance
+        :type self: QsipUtil
+        :param qsip_object: qsip object with EAF values
+        :type qsip_object: RS4
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :param rds_path: saved copy of the qsip object for the plot workers to
+            load, defaults to None
+        :type rds_path: str | None
+        :return: report name and ref
+        :rtype: dict[str, str]
+        """
+        page_options = get_page_options(params)
+        summary_formats = get_summary_formats(params)
 
         # make scratch_directory
         output_directory = os.path.join(self.scratch, str(uuid.uuid4()))
-        os.mkdir(output_directory)
+        plot_directory = os.path.join(output_directory, PLOT_DIR_NAME)
+        os.makedirs(plot_directory)
+
+        # file_links entries for the summary files
+        files = []
+        viewer = []
+
+        # the paged EAF plots are drawn from the summary, so it is needed first
+        eaf_summary = None
+        pages = None
+        if page_options is not None:
+            eaf_summary = helpers.summarize_EAF_values(qsip_object, params)
+            pages = eaf_pages.paginate(eaf_summary, params, page_options)
+
+        def write_summary() -> None:
+            summary = eaf_summary
+            if summary is None:
+                summary = helpers.summarize_EAF_values(qsip_object, params)
+            files.extend(
+                eaf_output.write_summary(summary, output_directory, summary_formats)
+            )
+            if writes_resamples(params):
+                files.append(
+                    eaf_output.write_resamples(
+                        helpers.EAF_resamples(qsip_object), output_directory
+                    )
+                )
+            if pages is not None:
+                viewer.append(eaf_pages.write_viewer(pages, plot_directory))
 
-        # qsip object
-        qsip_object = helpers.make_qsip_object(dataframes_by_ref, params)
+        # the summary is written while the plots are rendered
+        rendered = helpers.render_plots(
+            qsip_object,
+            plot_directory,
+            params,
+            n_workers=int(params.get("plot_workers", 1)),
+            rds_path=rds_path,
+            while_rendering=write_summary,
+            eaf_pages=pages,
+        )
 
-        # do whatever to q
-        qsip_object = helpers.run_feature_filter(qsip_object, params)
-        qsip_object = helpers.run_resampling(qsip_object, params)
-        qsip_object = helpers.run_EAF_calculations(qsip_object, params)
+        timings = [f"{report['name']}: {elapsed:.1f} s" for report, elapsed in rendered]
+        logging.info("Plot rendering times: %s", ", ".join(timings))
+        message = "\n".join(["Plot rendering times:", *timings])
 
-        eaf_summary = helpers.summarize_EAF_values(qsip_object, params)
-        
-        
-        # reports
-        reports = []
+        if pages is None:
+            return self.make_report(
+                [report for report, _ in rendered],
+                params,
+                message,
+                file_links=files,
+            )
+
+        if is_batch(params):
+            message = (
+                "The EAF pages are drawn at the first confidence level; the EAF"
+                f" summary has every level.\n{message}"
+            )
+        # the viewer directory, with the rendered pages, is the only HTML link, so
+        # that it is uploaded once; everything else is attached as a file
+        viewer_dir = eaf_pages.viewer_directory(plot_directory)
+        files.extend(
+            file_link(report) for report, _ in rendered if report["path"] != viewer_dir
+        )
+        return self.make_report(viewer, params, message, file_links=files)
+
+    def retrieve_tables(self: "QsipUtil", params: dict[str, Any]) -> dict[str, Any]:
+        """Retrieve the input data from the workspace and convert it into tables.
+
+        :param self: class instance
+        :type self: QsipUtil
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: a dict of columns or a DataFrame for each object, indexed by KBase UPA
+        :rtype: dict[str, Any]
+        """
+        converted_data = helpers.retrieve_convert_objects(
+            params, self.config, self.token
+        )
+        return {
+            ref: converted[COLS] if COLS in converted else DataFrame(converted[DL])
+            for ref, converted in converted_data.items()
+        }
+
+    @staticmethod
+    def check_tables(
+        tables: dict[str, Any], params: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Check the isotopes and filter thresholds against the source and sample data.
 
-        reports.append(helpers.write_EAF_summary(eaf_summary, output_directory))
-        reports.append(helpers.plot_source_wads(qsip_object, output_directory, params))
-        reports.append(helpers.plot_filter_results(qsip_object, output_directory))
-        reports.append(helpers.plot_EAF_results(qsip_object, output_directory, params))
-        
+        See `numpy_backend.check_filter_params`.
 
+        :param tables: a dict of columns or a DataFrame for each object, indexed by
+            KBase UPA
+        :type tables: dict[str, Any]
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: the tables, unchanged
+        :rtype: dict[str, Any]
+        """
+        numpy_backend.check_filter_params(
+            DataFrame(tables[params["source_data"]]),
+            DataFrame(tables[params["sample_data"]]),
+            params,
+        )
+        return tables
+
+    @staticmethod
+    def prefilter_tables(
+        tables: dict[str, Any], params: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Drop the features that cannot pass the feature filter.
+
+        See `numpy_backend.prefilter_features`; the remaining abundances are relative.
+        The dropped features are also missing from the `plot_filter_results` plot.
+
+        :param tables: a dict of columns or a DataFrame for each object, indexed by
+            KBase UPA
+        :type tables: dict[str, Any]
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: the tables, with the feature data of the remaining features
+        :rtype: dict[str, Any]
+        """
+        return {
+            **tables,
+            params["feature_data"]: numpy_backend.prefilter_features(
+                tables[params["feature_data"]],
+                DataFrame(tables[params["source_data"]]),
+                DataFrame(tables[params["sample_data"]]),
+                params,
+            ),
+        }
+
+    @staticmethod
+    def tables_to_r_dataframes(tables: dict[str, Any]) -> dict[str, Any]:
+        """Convert tables into R data.frames; R objects are returned as-is.
+
+        :param tables: a dict of columns, a DataFrame, or an R data.frame for each object
+        :type tables: dict[str, Any]
+        :return: an R data.frame for each object
+        :rtype: dict[str, Any]
+        """
+        dataframes: dict[str, Any] = {}
+        for ref, table in tables.items():
+            if isinstance(table, dict):
+                # columnar data is copied into R vectors in bulk
+                dataframes[ref] = r_convert.columns_to_r_dataframe(table)
+            elif isinstance(table, DataFrame):
+                dataframes[ref] = r_convert.pandas_to_r_dataframe(table)
+            else:
+                dataframes[ref] = table
+        return dataframes
+
+    def run_numpy_backend(self: "QsipUtil", params: dict[str, Any]) -> dict[str, str]:
+        """Run the qsip app using the NumPy implementation of the EAF calculations.
+
+        Only the EAF summary is produced, as the plots are drawn by qSIP2.
+
+        :param self: class instance
+        :type self: QsipUtil
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :return: report name and ref
+        :rtype: dict[str, str]
+        """
+        if params.get("debug"):
+            err_msg = "The numpy backend cannot be used with the qSIP2 debug data"
+            raise ValueError(err_msg)
+
+        summary_formats = get_summary_formats(params)
+        converted_data = helpers.retrieve_convert_objects(
+            params, self.config, self.token
+        )
+        output = numpy_backend.run_from_converted(
+            converted_data, params, return_resamples=writes_resamples(params)
+        )
+
+        output_directory = os.path.join(self.scratch, str(uuid.uuid4()))
+        os.mkdir(output_directory)
+
+        if writes_resamples(params):
+            eaf_summary, resampled = output
+            files = eaf_output.write_summary(
+                eaf_summary, output_directory, summary_formats
+            )
+            files.append(eaf_output.write_resamples(resampled, output_directory))
+        else:
+            files = eaf_output.write_summary(
+                output, output_directory, summary_formats
+            )
+        return self.make_report([], params, file_links=files)
+
+    def make_report(
+        self: "QsipUtil",
+        reports: list[dict[str, str]],
+        params: dict[str, Any],
+        message: str = "",
+        file_links: list[dict[str, str]] | None = None,
+    ) -> dict[str, str]:
+        """Create a KBase report linking to the output files.
+
+        The `path` of each html_links entry is uploaded as a whole, so each one
+        should be a directory holding only the files the page needs.
+
+        :param self: class instance
+        :type self: QsipUtil
+        :param reports: output files, as html_links entries
+        :type reports: list[dict[str, str]]
+        :param params: parameters from the app UI
+        :type params: dict[str, Any]
+        :param message: report message, defaults to ""
+        :type message: str
+        :param file_links: files to attach to the report, as file_links entries,
+            defaults to None
+        :type file_links: list[dict[str, str]] | None
+        :return: report name and ref
+        :rtype: dict[str, str]
+        """
         report_params = {
-            'message': '',
-            'html_links': reports,
-            'direct_html_link_index': 0,
-            'objects_created': [],
-            'workspace_name': params['workspace_name'],
-            'report_object_name': f'qsip_{uuid.uuid4()}'}
+            "message": message,
+            "html_links": reports,
+            "file_links": file_links or [],
+            "objects_created": [],
+            "workspace_name": params["workspace_name"],
+            "report_object_name": f"qsip_{uuid.uuid4()}"}
+        if reports:
+            report_params["direct_html_link_index"] = 0
 
         report_output = self.kbr.create_extended_report(report_params)
+        request_metrics.log_summary()
+
+        return {"report_name": report_output["name"],
+                "report_ref": report_output["ref"]}
+
+
+def file_link(report: dict[str, str]) -> dict[str, str]:
+    """Convert a report entry for a file into a file_links entry.
+
+    :param report: report entry, with the directory of the file as its path
+    :type report: dict[str, str]
+    :return: file_links entry, with the path of the file itself
+    :rtype: dict[str, str]
+    """
+    return {**report, "path": os.path.join(report["path"], report["name"])}
+
+
+def run_qsip(
+    config: dict[str, Any], context: dict[str, Any], params: dict[str, Any]
+) -> dict[str, str]:
+    """Run the app; used as the entry point for jobs run in warm start workers.
 
-        return {'report_name': report_output['name'],
-                'report_ref': report_output['ref']}
-                
+    :param config: app config
+    :type config: dict[str, Any]
+    :param context: job context
+    :type context: dict[str, Any]
+    :param params: parameters from the app UI
+    :type params: dict[str, Any]
+    :return: report name and ref
+    :rtype: dict[str, str]
+    """
+    return QsipUtil(config, context).run(params)
@@ -0,0 +1,188 @@
+"""Convert Python data structures into R objects.
+
+Numeric NumPy arrays are handed to rpy2 as contiguous buffers, which rpy2 copies
+into the new R vector in a single `memcpy`, rather than element by element as
+happens with the `pandas2ri` converter.
+"""
+
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype
+from rpy2 import rinterface, robjects
+from rpy2.robjects import pandas2ri
+
+INT32_MAX = np.iinfo(np.int32).max
+# the smallest int32 value is used as NA by R
+INT32_MIN = np.iinfo(np.int32).min + 1
+
+# a column of data, as accepted by `to_r_vector`
+Column = pd.Series | pd.Categorical | np.ndarray | Sequence[object]
+
+
+def numeric_to_r_vector(values: np.ndarray) -> robjects.vectors.Vector:
+    """Convert a numeric NumPy array into an R vector with a single bulk copy.
+
+    Integer arrays that fit into 32 bits become integer vectors; everything else
+    becomes a numeric (double) vector.
+
+    :param values: one-dimensional numeric array
+    :type values: np.ndarray
+    :return: R vector
+    :rtype: robjects.vectors.Vector
+    """
+    if values.dtype.kind == "b":
+        return robjects.BoolVector(values.tolist())
+    if values.dtype.kind in "iu" and (
+        len(values) == 0 or (values.min() >= INT32_MIN and values.max() <= INT32_MAX)
+    ):
+        return robjects.IntVector(np.ascontiguousarray(values, dtype=np.int32))
+    return robjects.FloatVector(np.ascontiguousarray(values, dtype=np.float64))
+
+
+def categorical_to_r_factor(values: pd.Categorical) -> robjects.vectors.FactorVector:
+    """Convert a pandas Categorical into an R factor without expanding the categories.
+
+    :param values: categorical data
+    :type values: pd.Categorical
+    :return: R factor
+    :rtype: robjects.vectors.FactorVector
+    """
+    # R factor codes start at 1; missing values are NA
+    codes = values.codes.astype(np.int32) + 1
+    codes[codes == 0] = rinterface.NA_Integer
+    factor = robjects.IntVector(codes)
+    factor.do_slot_assign(
+        "levels", robjects.StrVector([str(c) for c in values.categories])
+    )
+    factor.do_slot_assign("class", robjects.StrVector(["factor"]))
+    return robjects.vectors.FactorVector(factor)
+
+
+def object_to_r_vector(values: np.ndarray | list[object]) -> robjects.vectors.Vector:
+    """Convert an array of Python objects into the most appropriate R vector type.
+
+    :param values: one-dimensional array or list of Python objects; None is NA
+    :type values: np.ndarray | list[object]
+    :return: R vector
+    :rtype: robjects.vectors.Vector
+    """
+    values = np.asarray(values, dtype=object)
+    inferred_type = infer_dtype(values, skipna=True)
+    missing = pd.isna(values)
+
+    if inferred_type == "boolean":
+        return robjects.BoolVector(
+            [
+                rinterface.NA_Logical if m else bool(v)
+                for v, m in zip(values, missing, strict=True)
+            ]
+        )
+    if inferred_type == "integer" and not missing.any():
+        return numeric_to_r_vector(values.astype(np.int64))
+    if inferred_type in ("integer", "floating", "mixed-integer-float", "decimal"):
+        return robjects.FloatVector(pd.to_numeric(values).astype(np.float64))
+    return robjects.StrVector(
+        [
+            rinterface.NA_Character if m else str(v)
+            for v, m in zip(values, missing, strict=True)
+        ]
+    )
+
+
+def to_r_vector(values: Column) -> robjects.vectors.Vector:
+    """Convert a column of data into an R vector.
+
+    :param values: the column
+    :type values: Column
+    :return: R vector
+    :rtype: robjects.vectors.Vector
+    """
+    if isinstance(values, pd.Series):
+        values = (
+            values.array
+            if isinstance(values.dtype, pd.CategoricalDtype)
+            else values.to_numpy()
+        )
+    if isinstance(values, pd.Categorical):
+        return categorical_to_r_factor(values)
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return numeric_to_r_vector(values)
+    return object_to_r_vector(values)
+
+
+def columns_to_r_dataframe(columns: dict[str, Column]) -> robjects.DataFrame:
+    """Convert a dict of columns into an R data.frame.
+
+    The data.frame is assembled directly from the column vectors, so the column
+    names are kept as-is (i.e. not run through `make.names`).
+
+    :param columns: column data, indexed by column name
+    :type columns: dict[str, Column]
+    :raises ValueError: if the columns are not all the same length
+    :return: R data.frame
+    :rtype: robjects.DataFrame
+    """
+    lengths = {len(col) for col in columns.values()}
+    if len(lengths) > 1:
+        err_msg = "All columns must be the same length to create a data.frame"
+        raise ValueError(err_msg)
+    n_rows = lengths.pop() if lengths else 0
+
+    r_list = rinterface.ListSexpVector([to_r_vector(col) for col in columns.values()])
+    r_list.do_slot_assign("names", rinterface.StrSexpVector(list(columns)))
+    r_list.do_slot_assign("class", rinterface.StrSexpVector(["data.frame"]))
+    # compact form of row names 1..n_rows
+    r_list.do_slot_assign(
+        "row.names", rinterface.IntSexpVector([rinterface.NA_Integer, -n_rows])
+    )
+    return robjects.DataFrame(r_list)
+
+
+def numeric_to_r_matrix(
+    values: np.ndarray, row_ids: list[str], col_ids: list[str]
+) -> robjects.vectors.Matrix:
+    """Convert a two-dimensional numeric array into an R matrix with a single bulk copy.
+
+    :param values: array of shape (len(row_ids), len(col_ids))
+    :type values: np.ndarray
+    :param row_ids: row names
+    :type row_ids: list[str]
+    :param col_ids: column names
+    :type col_ids: list[str]
+    :return: R matrix
+    :rtype: robjects.vectors.Matrix
+    """
+    n_rows, n_cols = values.shape
+    # R matrices are stored column-major
+    r_vector = numeric_to_r_vector(values.ravel(order="F"))
+    r_vector.do_slot_assign("dim", rinterface.IntSexpVector([n_rows, n_cols]))
+    r_vector.do_slot_assign(
+        "dimnames",
+        rinterface.ListSexpVector(
+            [
+                rinterface.StrSexpVector([str(r) for r in row_ids]),
+                rinterface.StrSexpVector([str(c) for c in col_ids]),
+            ]
+        ),
+    )
+    if isinstance(r_vector, robjects.IntVector):
+        return robjects.vectors.IntMatrix(r_vector)
+    return robjects.vectors.FloatMatrix(r_vector)
+
+
+def pandas_to_r_dataframe(df: pd.DataFrame) -> robjects.DataFrame:
+    """Convert a pandas DataFrame into an R data.frame using the pandas2ri converter.
+
+    :param df: the DataFrame
+    :type df: pd.DataFrame
+    :return: R data.frame
+    :rtype: robjects.DataFrame
+    """
+    with (robjects.default_converter + pandas2ri.converter).context():
+        r_df = robjects.conversion.get_conversion().py2rpy(df)
+    # keep sample names used as column names (e.g. "16O.16C.5") intact
+    r_df.colnames = robjects.StrVector([str(c) for c in df.columns])
+    return r_df
@@ -0,0 +1,159 @@
+"""Warm start mode: initialise R once and run each job in a forked copy of the process.
+
+Starting R and loading qSIP2 and the packages it depends on takes several seconds,
+which every job pays if it runs in a fresh interpreter. In warm start mode, the
+server process initialises R at startup and each job runs in a child process forked
+from it. The child shares the loaded interpreter with the server (copy-on-write),
+so it can start computing immediately, but any changes it makes to the R or Python
+state are discarded when it exits and are never seen by later jobs.
+
+R is not thread-safe, so the server must not be running R code in another thread
+when a worker is forked.
+"""
+
+import logging
+import multiprocessing
+import pickle
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from multiprocessing.connection import Connection
+from typing import Any, ParamSpec, TypeVar
+
+WARM_START_KEY = "r-warm-start"
+# R packages loaded at startup, in addition to those loaded by kb_qsip.utils.helpers
+R_PACKAGES = ["qSIP2", "dplyr", "ggplot2"]
+
+logger = logging.getLogger(__name__)
+
+# set once R has been initialised
+_warmed_up = threading.Event()
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+class WorkerTracebackError(Exception):
+    """Traceback of an exception raised in a worker process."""
+
+    def __init__(self: "WorkerTracebackError", tb: str) -> None:
+        """Initialise an instance of the class.
+
+        :param self: class instance
+        :type self: WorkerTracebackError
+        :param tb: formatted traceback
+        :type tb: str
+        """
+        super().__init__(tb)
+        self.tb = tb
+
+    def __str__(self: "WorkerTracebackError") -> str:
+        """Return the traceback."""
+        return f"\n{self.tb}"
+
+
+def is_enabled(config: dict[str, Any]) -> bool:
+    """Check whether warm start mode is enabled in the app config.
+
+    :param config: app config
+    :type config: dict[str, Any]
+    :return: True if `config["r-warm-start"]` is set to "true"
+    :rtype: bool
+    """
+    return str(config.get(WARM_START_KEY, "")).strip().lower() == "true"
+
+
+def warm_up() -> float:
+    """Initialise R and load the R packages and Python modules used to run jobs.
+
+    Only the first call does any work.
+
+    :return: time taken, in seconds
+    :rtype: float
+    """
+    if _warmed_up.is_set():
+        return 0.0
+
+    start = time.perf_counter()
+    from rpy2.robjects.packages import importr
+
+    # importing the helpers initialises R and loads qSIP2
+    from kb_qsip.utils import helpers, qsip_util  # noqa: F401
+
+    for package in R_PACKAGES:
+        importr(package)
+    elapsed = time.perf_counter() - start
+
+    _warmed_up.set()
+    logger.info("R initialised in %.2f s", elapsed)
+    return elapsed
+
+
+def _run_worker(
+    sender: Connection,
+    func: Callable[..., Any],
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+) -> None:
+    """Run a function and send its result, or the exception it raised, to the parent."""
+    try:
+        message = ("result", func(*args, **kwargs), None)
+    # every exception is sent to the parent, which re-raises it
+    except Exception as e:  # noqa: BLE001
+        message = ("error", e, traceback.format_exc())
+
+    try:
+        sender.send(message)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # the result or the exception could not be pickled
+        status, value, tb = message
+        if status == "result":
+            error = RuntimeError(
+                f"The return value of {func.__name__} could not be sent from the worker process"
+            )
+            tb = traceback.format_exc()
+        else:
+            error = RuntimeError(f"{type(value).__name__}: {value}")
+        sender.send(("error", error, tb))
+    finally:
+        sender.close()
+
+
+def run_in_worker(func: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+    """Run a function in a child process forked from this one and return its result.
+
+    Exceptions raised by the function are re-raised in this process, with the
+    traceback from the worker attached as their cause.
+
+    :param func: function to run
+    :type func: Callable[P, R]
+    :param args: positional arguments for the function
+    :type args: P.args
+    :param kwargs: keyword arguments for the function
+    :type kwargs: P.kwargs
+    :raises RuntimeError: if the worker process exits without returning a result
+    :return: the return value of the function, which must be picklable
+    :rtype: R
+    """
+    mp_context = multiprocessing.get_context("fork")
+    receiver, sender = mp_context.Pipe(duplex=False)
+    # not a daemon process, as jobs may start worker processes of their own
+    process = mp_context.Process(target=_run_worker, args=(sender, func, args, kwargs))
+    process.start()
+    sender.close()
+    try:
+        # receive before joining so that large results cannot fill the pipe and block the worker
+        status, value, tb = receiver.recv()
+    except EOFError:
+        status = None
+    finally:
+        receiver.close()
+        process.join()
+
+    if status is None:
+        err_msg = f"Worker process exited with code {process.exitcode} without returning a result"
+        raise RuntimeError(err_msg)
+    if status == "error":
+        raise value from WorkerTracebackError(tb)
+    return value
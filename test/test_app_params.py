@@ -0,0 +1,330 @@
+"""Tests for the parsing and validation of the app parameters."""
+
+from test.conftest import PARAMS_BASE
+from typing import Any
+
+import pytest
+from kb_qsip.utils.app_params import (
+    DEFAULT_FILTER_THRESHOLDS,
+    DEFAULT_MAX_PAGES,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_RESAMPLE_SUCCESS,
+    DEFAULT_SUMMARY_FORMATS,
+    PageOptions,
+    check_filter_feasible,
+    check_params,
+    get_confidence,
+    get_confidence_levels,
+    get_filter_thresholds,
+    get_isotopes,
+    get_page_options,
+    get_resamples,
+    get_sample_fields,
+    get_summary_formats,
+    is_batch,
+    prefilters_features,
+    writes_resamples,
+)
+
+
+@pytest.mark.parametrize(
+    ("params", "expected"),
+    [
+        ({"confidence": 0.9, "resample_success": 0.8}, [(0.9, 0.8)]),
+        ({"confidence": "0.9"}, [(0.9, DEFAULT_RESAMPLE_SUCCESS)]),
+        # batch mode without resample_success
+        (
+            {"confidence": [0.8, 0.9], "resample_success": None},
+            [(0.8, DEFAULT_RESAMPLE_SUCCESS), (0.9, DEFAULT_RESAMPLE_SUCCESS)],
+        ),
+        (
+            {"confidence": [0.8, 0.9], "resample_success": [0.5, ""]},
+            [(0.8, 0.5), (0.9, DEFAULT_RESAMPLE_SUCCESS)],
+        ),
+        (
+            {"confidence": [0.8, "0.9", 0.95], "resample_success": 0.8},
+            [(0.8, 0.8), (0.9, 0.8), (0.95, 0.8)],
+        ),
+        (
+            {"confidence": [0.8, 0.9], "resample_success": [0.5, "0.7"]},
+            [(0.8, 0.5), (0.9, 0.7)],
+        ),
+        # duplicate levels are only reported once
+        ({"confidence": [0.9, 0.9], "resample_success": 0.8}, [(0.9, 0.8)]),
+    ],
+)
+def test_get_confidence_levels(
+    params: dict[str, Any], expected: list[tuple[float, float]]
+) -> None:
+    """Check the confidence levels and resample success ratios."""
+    assert get_confidence_levels(params) == expected
+
+
+@pytest.mark.parametrize(
+    ("params", "err_msg"),
+    [
+        ({}, "Invalid confidence 'None'"),
+        ({"confidence": 1}, "Invalid confidence '1'"),
+        ({"confidence": [0.9, "high"]}, "Invalid confidence 'high'"),
+        ({"confidence": 0.9, "resample_success": 1.5}, "Invalid resample_success"),
+        ({"confidence": []}, "At least one confidence level is required"),
+        (
+            {"confidence": [0.8, 0.9, 0.95], "resample_success": [0.5, 0.7]},
+            "got 2 values for 3 levels",
+        ),
+    ],
+)
+def test_get_confidence_levels_fail(params: dict[str, Any], err_msg: str) -> None:
+    """Invalid values raise an error."""
+    with pytest.raises(ValueError, match=err_msg):
+        get_confidence_levels(params)
+
+
+def test_get_confidence() -> None:
+    """A single confidence level is returned as a float; a list stays a list."""
+    assert not is_batch({"confidence": 0.9})
+    assert get_confidence({"confidence": "0.9"}) == pytest.approx(0.9)
+    assert is_batch({"confidence": [0.9]})
+    assert get_confidence({"confidence": [0.9]}) == [0.9]
+    assert get_confidence(
+        {"confidence": [0.8, 0.8], "resample_success": [0.5, 0.7]}
+    ) == [0.8]
+
+
+@pytest.mark.parametrize(
+    ("params", "expected"),
+    [
+        ({}, None),
+        ({"eaf_plot_top_n": ""}, None),
+        ({"eaf_plot_top_n": 0}, None),
+        (
+            {"eaf_plot_top_n": "50"},
+            PageOptions(
+                50, DEFAULT_PAGE_SIZE, DEFAULT_MAX_PAGES, significant_only=False
+            ),
+        ),
+        (
+            {
+                "eaf_plot_top_n": 20,
+                "eaf_plot_page_size": " 200",
+                "eaf_plot_max_pages": 3,
+                "eaf_plot_significant_only": 1,
+            },
+            PageOptions(20, 200, 3, significant_only=True),
+        ),
+    ],
+)
+def test_get_page_options(params: dict[str, Any], expected: PageOptions | None) -> None:
+    """Paging is only enabled if eaf_plot_top_n is set."""
+    assert get_page_options(params) == expected
+
+
+@pytest.mark.parametrize(
+    ("params", "err_msg"),
+    [
+        ({"eaf_plot_top_n": -5}, "Invalid eaf_plot_top_n '-5'"),
+        ({"eaf_plot_top_n": "lots"}, "Invalid eaf_plot_top_n 'lots'"),
+        (
+            {"eaf_plot_top_n": 5, "eaf_plot_page_size": 0},
+            "Invalid eaf_plot_page_size '0': must be an integer greater than 0",
+        ),
+        ({"eaf_plot_top_n": 5, "eaf_plot_max_pages": 2.5}, "eaf_plot_max_pages"),
+    ],
+)
+def test_get_page_options_fail(params: dict[str, Any], err_msg: str) -> None:
+    """Invalid values raise an error."""
+    with pytest.raises(ValueError, match=err_msg):
+        get_page_options(params)
+
+
+@pytest.mark.parametrize(("value", "expected"), [(1000, 1000), (" 250", 250)])
+def test_get_resamples(value: object, expected: int) -> None:
+    """Resamples can be given as an integer or a string."""
+    assert get_resamples({"resamples": value}) == expected
+
+
+@pytest.mark.parametrize("value", [None, 0, "1e3", 2.5])
+def test_get_resamples_fail(value: object) -> None:
+    """Resamples must be a positive integer."""
+    with pytest.raises(
+        ValueError,
+        match=f"Invalid resamples '{value}': must be an integer greater than 0",
+    ):
+        get_resamples({"resamples": value})
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (None, DEFAULT_SUMMARY_FORMATS),
+        ("", DEFAULT_SUMMARY_FORMATS),
+        ([], DEFAULT_SUMMARY_FORMATS),
+        ("parquet", ["parquet"]),
+        ("TSV, tsv.gz,parquet,tsv", ["tsv", "tsv.gz", "parquet"]),
+        (["feather", " tsv "], ["feather", "tsv"]),
+    ],
+)
+def test_get_summary_formats(value: object, expected: list[str]) -> None:
+    """Formats may be given as a list or a comma-separated string."""
+    assert get_summary_formats({"eaf_summary_formats": value}) == expected
+
+
+def test_get_summary_formats_fail() -> None:
+    """Unknown formats raise an error."""
+    with pytest.raises(
+        ValueError,
+        match="Invalid eaf_summary_formats 'csv': must be one of tsv, tsv.gz, parquet, feather",
+    ):
+        get_summary_formats({"eaf_summary_formats": "tsv,csv"})
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"), [(None, False), (0, False), ("1", True), ("True", True)]
+)
+def test_writes_resamples(value: object, *, expected: bool) -> None:
+    """The per-resample values are only written if requested."""
+    assert writes_resamples({"eaf_resamples_output": value}) is expected
+
+
+def test_get_sample_fields() -> None:
+    """The fields named by the params are read, along with the fixed fields."""
+    params = {
+        "M_isotope": "isotope",
+        "M_isotopolog": "isotopolog",
+        "S_source_mat_id": " source ",
+        "S_gradient_position": "",
+        "S_gradient_pos_density": "density",
+        "S_gradient_pos_amt": "amt",
+        "groups": "name",
+        "confidence": 0.9,
+    }
+    assert get_sample_fields(params) == [
+        "name",
+        "isotopolog_label",
+        "isotope",
+        "isotopolog",
+        "source",
+        "density",
+        "amt",
+    ]
+
+
+def test_get_filter_thresholds() -> None:
+    """Thresholds that are not set take their default values."""
+    assert get_filter_thresholds({}) == DEFAULT_FILTER_THRESHOLDS
+    assert get_filter_thresholds(
+        {
+            "min_labeled_sources": "3",
+            "min_unlabeled_fractions": 2,
+            "min_labeled_fractions": "",
+        }
+    ) == {
+        "min_unlabeled_sources": 1,
+        "min_labeled_sources": 3,
+        "min_unlabeled_fractions": 2,
+        "min_labeled_fractions": 1,
+    }
+
+
+def test_get_filter_thresholds_fail() -> None:
+    """Thresholds must be positive integers."""
+    with pytest.raises(
+        ValueError,
+        match="Invalid min_labeled_sources '0': must be an integer greater than 0",
+    ):
+        get_filter_thresholds({"min_labeled_sources": 0})
+
+
+def test_get_isotopes() -> None:
+    """The unlabeled isotope is the one paired with the labeled isotope."""
+    assert get_isotopes({}) == ("16O", "18O")
+    assert get_isotopes({"labeled_isotope": "13C"}) == ("12C", "13C")
+    assert get_isotopes({"labeled_isotope": " 15N"}) == ("14N", "15N")
+
+
+def test_get_isotopes_fail() -> None:
+    """The labeled isotope must be supported."""
+    with pytest.raises(
+        ValueError, match="Invalid labeled_isotope '16O': must be one of 13C, 15N, 18O"
+    ):
+        get_isotopes({"labeled_isotope": "16O"})
+
+
+# two 16O sources with three fractions, and two 18O sources with three and one
+SOURCE_ISOTOPES = {"S1": "16O", "S2": "16O", "S3": "18O", "S4": "18O"}
+SAMPLE_SOURCES = ["S1"] * 3 + ["S2"] * 3 + ["S3"] * 3 + ["S4"]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {},
+        {"min_unlabeled_sources": 2, "min_unlabeled_fractions": 3},
+        {"min_labeled_sources": 2},
+        {"min_labeled_fractions": 3},
+    ],
+)
+def test_check_filter_feasible(params: dict[str, Any]) -> None:
+    """Some sources of each isotope have enough fractions."""
+    check_filter_feasible(params, SOURCE_ISOTOPES, SAMPLE_SOURCES)
+
+
+@pytest.mark.parametrize(
+    ("params", "err_msg"),
+    [
+        (
+            {"labeled_isotope": "13C"},
+            "No sources with the unlabeled isotope '12C' in the source data;"
+            " found: 16O, 18O",
+        ),
+        (
+            {"min_unlabeled_sources": 3},
+            r"min_unlabeled_sources is 3, but only 2 of the 2 unlabeled \(16O\)"
+            " sources have at least 1 fractions",
+        ),
+        (
+            {"min_labeled_sources": 2, "min_labeled_fractions": 2},
+            r"min_labeled_sources is 2, but only 1 of the 2 labeled \(18O\)"
+            " sources have at least 2 fractions",
+        ),
+        (
+            {"min_unlabeled_fractions": 4},
+            "but only 0 of the 2 unlabeled",
+        ),
+    ],
+)
+def test_check_filter_feasible_fail(params: dict[str, Any], err_msg: str) -> None:
+    """Runs that would filter out every feature fail before R is used."""
+    with pytest.raises(ValueError, match=err_msg):
+        check_filter_feasible(params, SOURCE_ISOTOPES, SAMPLE_SOURCES)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"), [(None, False), ("", False), (1, True), (0, False)]
+)
+def test_prefilters_features(value: object, *, expected: bool) -> None:
+    """Features are only pre-filtered if turned on."""
+    assert prefilters_features({"prefilter_features": value}) is expected
+
+
+def test_check_params() -> None:
+    """Valid parameters pass the checks."""
+    check_params(PARAMS_BASE)
+
+
+@pytest.mark.parametrize(
+    ("params", "err_msg"),
+    [
+        ({"confidence": 1}, "Invalid confidence '1'"),
+        ({"resample_success": "most"}, "Invalid resample_success 'most'"),
+        ({"resamples": "many"}, "Invalid resamples 'many'"),
+        ({"labeled_isotope": "2H"}, "Invalid labeled_isotope '2H'"),
+        ({"min_labeled_sources": -1}, "Invalid min_labeled_sources '-1'"),
+        ({"eaf_plot_top_n": "all"}, "Invalid eaf_plot_top_n 'all'"),
+        ({"eaf_summary_formats": "xlsx"}, "Invalid eaf_summary_formats 'xlsx'"),
+    ],
+)
+def test_check_params_fail(params: dict[str, Any], err_msg: str) -> None:
+    """Each invalid parameter fails the checks."""
+    with pytest.raises(ValueError, match=err_msg):
+        check_params({**PARAMS_BASE, **params})
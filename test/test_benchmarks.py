@@ -0,0 +1,477 @@
+"""Performance benchmarks.
+
+These are slow and timing-dependent, so they are only run if the environment
+variable KB_QSIP_BENCHMARKS is set, e.g.
+
+    KB_QSIP_BENCHMARKS=1 pytest -s test/test_benchmarks.py
+"""
+
+import io
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+from combinatrix.constants import COLS, DATA, DL, INFO, WIDE
+from combinatrix.converter import (
+    convert_matrix,
+    convert_matrix_columnar,
+    convert_samples,
+    convert_samples_columnar,
+)
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("KB_QSIP_BENCHMARKS"),
+    reason="set KB_QSIP_BENCHMARKS to run the benchmarks",
+)
+
+N_FEATURES = 20000
+N_FRACTIONS = 100
+N_SAMPLES = 5000
+N_SAMPLE_FIELDS = 60
+# fraction of the WADs that are missing in the resampling benchmarks
+MISSING_WADS = 0.3
+
+
+def make_matrix(
+    n_features: int = N_FEATURES,
+    n_fractions: int = N_FRACTIONS,
+    seed: int = 14,
+    mean_count: float = 0.5,
+) -> dict[str, Any]:
+    """Generate an AmpliconMatrix-like workspace object filled with random counts.
+
+    :param n_features: number of rows (features)
+    :type n_features: int
+    :param n_fractions: number of columns (fractions)
+    :type n_fractions: int
+    :param seed: random seed
+    :type seed: int
+    :param mean_count: mean of the Poisson-distributed counts; lower values give
+        more zeros
+    :type mean_count: float
+    :return: workspace object containing the matrix
+    :rtype: dict[str, Any]
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.poisson(mean_count, size=(n_features, n_fractions))
+    return {
+        INFO: {
+            "type": "KBaseMatrices.AmpliconMatrix-1.0",
+            "wsid": 1,
+            "objid": 2,
+            "version": 3,
+        },
+        DATA: {
+            DATA: {
+                "row_ids": [f"ASV_{i}" for i in range(n_features)],
+                "col_ids": [f"fraction_{i}" for i in range(n_fractions)],
+                "values": values.tolist(),
+            }
+        },
+    }
+
+
+def report(name: str, results: dict[str, float]) -> None:
+    """Print benchmark results."""
+    print(f"\n{name}")  # noqa: T201
+    for key, value in results.items():
+        print(f"  {key}: {value:.3f}")  # noqa: T201
+
+
+def dict_list_size(dict_list: list[dict[str, Any]]) -> int:
+    """Approximate the memory used by a list of dicts and their (unshared) contents."""
+    size = sys.getsizeof(dict_list)
+    for entry in dict_list:
+        size += sys.getsizeof(entry) + sys.getsizeof(entry["id"])
+        size += sys.getsizeof(entry["value"])
+    return size
+
+
+def test_convert_matrix_columnar_benchmark() -> None:
+    """Compare the dict list and columnar matrix conversions, up to the pandas DataFrame."""
+    matrix = make_matrix()
+
+    start = time.perf_counter()
+    dict_list = convert_matrix(matrix)[DL]
+    pd.DataFrame(dict_list)
+    dict_list_time = time.perf_counter() - start
+    dict_list_bytes = dict_list_size(dict_list)
+    del dict_list
+
+    start = time.perf_counter()
+    columns = convert_matrix_columnar(matrix)[COLS]
+    columnar_bytes = pd.DataFrame(columns).memory_usage(deep=True).sum()
+    columnar_time = time.perf_counter() - start
+
+    report(
+        "convert_matrix vs convert_matrix_columnar",
+        {
+            "dict list time (s)": dict_list_time,
+            "columnar time (s)": columnar_time,
+            "speedup": dict_list_time / columnar_time,
+            "dict list size (MB)": dict_list_bytes / 1e6,
+            "columnar size (MB)": columnar_bytes / 1e6,
+            "size ratio": dict_list_bytes / columnar_bytes,
+        },
+    )
+    min_speedup, min_size_ratio = 20, 10
+    assert dict_list_time / columnar_time >= min_speedup
+    assert dict_list_bytes / columnar_bytes >= min_size_ratio
+
+
+def make_sample_set(
+    n_samples: int = N_SAMPLES, n_fields: int = N_SAMPLE_FIELDS
+) -> dict[str, Any]:
+    """Generate a SampleSet-like workspace object with metadata fields for each sample.
+
+    Half of the fields are user metadata, with units; the others are controlled.
+
+    :param n_samples: number of samples
+    :type n_samples: int
+    :param n_fields: number of metadata fields per sample
+    :type n_fields: int
+    :return: workspace object containing the samples
+    :rtype: dict[str, Any]
+    """
+    samples = []
+    for i in range(n_samples):
+        name = f"sample_{i}"
+        samples.append(
+            {
+                "id": f"id_{i}",
+                "name": name,
+                "save_date": 1705694819000,
+                "user": "someone",
+                "version": 1,
+                "node_tree": [
+                    {
+                        "id": name,
+                        "type": "BioReplicate",
+                        "parent": None,
+                        "meta_user": {
+                            f"user_field_{j}": {"value": i * j, "units": "g"}
+                            for j in range(n_fields // 2)
+                        },
+                        "meta_controlled": {
+                            f"controlled_field_{j}": {"value": f"value_{j}"}
+                            for j in range(n_fields - n_fields // 2)
+                        },
+                        "source_meta": [],
+                    }
+                ],
+            }
+        )
+    return {
+        INFO: {"type": "KBaseSets.SampleSet-2.0", "wsid": 1, "objid": 4, "version": 1},
+        DATA: {"sample_data": samples},
+    }
+
+
+def test_convert_samples_columnar_benchmark() -> None:
+    """Compare the dict list and columnar sample conversions, up to the pandas DataFrame."""
+    sample_set = make_sample_set()
+
+    start = time.perf_counter()
+    dict_list_df = pd.DataFrame(convert_samples(sample_set)[DL])
+    dict_list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columnar_df = pd.DataFrame(convert_samples_columnar(sample_set)[COLS])
+    columnar_time = time.perf_counter() - start
+
+    # the fields read by a run, as from app_params.get_sample_fields
+    fields = ["name", "user_field_0", "user_field_1", "controlled_field_0"]
+    start = time.perf_counter()
+    projected_df = pd.DataFrame(
+        convert_samples_columnar(sample_set, fields=fields)[COLS]
+    )
+    projected_time = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(columnar_df, dict_list_df)
+    pd.testing.assert_frame_equal(projected_df, columnar_df[fields])
+    report(
+        "convert_samples vs convert_samples_columnar",
+        {
+            "dict list time (s)": dict_list_time,
+            "columnar time (s)": columnar_time,
+            "speedup": dict_list_time / columnar_time,
+            "projected time (s)": projected_time,
+            "projected speedup": dict_list_time / projected_time,
+        },
+    )
+    min_speedup = 4
+    assert dict_list_time / columnar_time >= min_speedup
+    assert projected_time < columnar_time / 2
+
+
+def measure_r_conversion(method: str) -> dict[str, float]:
+    """Convert a wide matrix into an R data.frame; return the time taken and the rise in peak RSS.
+
+    Run in a fresh process so that the peak RSS measurements are independent.
+    """
+    from kb_qsip.utils import r_convert
+
+    columns = convert_matrix_columnar(make_matrix(), layout=WIDE)[COLS]
+    feature_df = pd.DataFrame(columns) if method == "pandas2ri" else None
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if method == "pandas2ri":
+        r_convert.pandas_to_r_dataframe(feature_df)
+    else:
+        r_convert.columns_to_r_dataframe(columns)
+    elapsed = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    return {"time": elapsed, "rss_mb": (peak_rss - baseline_rss) / 1024}
+
+
+def test_r_conversion_benchmark() -> None:
+    """Compare the pandas2ri and bulk-copy conversions of a wide matrix into R."""
+    pytest.importorskip("rpy2")
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for method in ["pandas2ri", "columns"]:
+        with ctx.Pool(1) as pool:
+            results[method] = pool.apply(measure_r_conversion, (method,))
+
+    report(
+        "pandas2ri vs columns_to_r_dataframe",
+        {
+            "pandas2ri time (s)": results["pandas2ri"]["time"],
+            "columns time (s)": results["columns"]["time"],
+            "speedup": results["pandas2ri"]["time"] / results["columns"]["time"],
+            "pandas2ri peak RSS increase (MB)": results["pandas2ri"]["rss_mb"],
+            "columns peak RSS increase (MB)": results["columns"]["rss_mb"],
+        },
+    )
+    assert results["columns"]["time"] < results["pandas2ri"]["time"]
+    assert results["columns"]["rss_mb"] <= results["pandas2ri"]["rss_mb"]
+
+
+def test_parallel_resampling_benchmark() -> None:
+    """Compare serial and parallel resampling of the qSIP2 example data."""
+    pytest.importorskip("rpy2")
+    from kb_qsip.utils import helpers
+    from rpy2.robjects.packages import data
+
+    qsip_object = data(helpers.qsip2).fetch("example_qsip_object")[
+        "example_qsip_object"
+    ]
+    qsip_object = helpers.run_feature_filter(qsip_object, {})
+    resamples = 1000
+    n_workers = min(8, os.cpu_count() or 1)
+
+    start = time.perf_counter()
+    helpers.run_resampling(qsip_object, {"resamples": resamples})
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = helpers.run_parallel_resampling(qsip_object, resamples, n_workers)
+    parallel_time = time.perf_counter() - start
+
+    report(
+        f"serial vs parallel resampling ({n_workers} workers)",
+        {
+            "serial time (s)": serial_time,
+            "parallel time (s)": parallel_time,
+            "speedup": serial_time / parallel_time,
+        },
+    )
+    # results are reproducible for a given number of workers
+    repeat = helpers.run_parallel_resampling(qsip_object, resamples, n_workers)
+    assert helpers.baseR.identical(
+        helpers.r_get_resamples(parallel), helpers.r_get_resamples(repeat)
+    )[0]
+
+
+def resample_wads_by_resample(
+    wads: np.ndarray, resamples: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Resample WADs one resample at a time, drawing fresh indices for every feature."""
+    n_features, n_sources = wads.shape
+    sorted_wads = np.sort(wads, axis=1)
+    n_valid = np.count_nonzero(~np.isnan(wads), axis=1)
+    draw_mask = np.arange(n_sources) < n_valid[:, None]
+
+    means = np.empty((n_features, resamples))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for r in range(resamples):
+            idx = (rng.random((n_features, n_sources)) * n_valid[:, None]).astype(
+                np.intp
+            )
+            draws = np.take_along_axis(sorted_wads, idx, axis=1)
+            means[:, r] = np.where(draw_mask, draws, 0.0).sum(axis=1) / n_valid
+    return means
+
+
+def test_resample_wads_benchmark() -> None:
+    """Compare per-resample and pre-generated index resampling of 20k features."""
+    from kb_qsip.utils.numpy_backend import resample_wads
+
+    rng = np.random.default_rng(14)
+    wads = rng.normal(1.7, 0.01, size=(N_FEATURES, 6))
+    # every feature keeps at least one WAD
+    wads[:, 1:][rng.random((N_FEATURES, 5)) < MISSING_WADS] = np.nan
+    resamples = 1000
+
+    start = time.perf_counter()
+    by_resample = resample_wads_by_resample(wads, resamples, np.random.default_rng(1))
+    by_resample_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorised = resample_wads(wads, resamples, np.random.default_rng(1))
+    vectorised_time = time.perf_counter() - start
+
+    report(
+        "per-resample vs pre-generated index resampling",
+        {
+            "per-resample time (s)": by_resample_time,
+            "pre-generated index time (s)": vectorised_time,
+            "speedup": by_resample_time / vectorised_time,
+        },
+    )
+    # both are unbiased estimates of the same means
+    np.testing.assert_allclose(
+        vectorised.mean(axis=1), by_resample.mean(axis=1), atol=1e-3
+    )
+    min_speedup = 5
+    assert by_resample_time / vectorised_time >= min_speedup
+
+
+def test_sparse_features_benchmark() -> None:
+    """Compare the dense and zero-dropping long layouts, from conversion to the WADs."""
+    from kb_qsip.utils.numpy_backend import calculate_wads, sparse_from_columns
+
+    # about 90% of the cells are zero
+    matrix = make_matrix(mean_count=0.1)
+    n_sources = 10
+    sample_source = np.repeat(np.arange(n_sources), N_FRACTIONS // n_sources)
+    density = np.linspace(1.65, 1.78, N_FRACTIONS)
+    rel_amt = np.full(N_FRACTIONS, n_sources / N_FRACTIONS)
+
+    results = {}
+    wads = {}
+    for name, options in [("dense", {}), ("sparse", {"drop_zeros": True})]:
+        start = time.perf_counter()
+        columns = convert_matrix_columnar(matrix, **options)[COLS]
+        size = pd.DataFrame(columns).memory_usage(deep=True).sum()
+        values, _, _ = sparse_from_columns(columns)
+        wads[name], _ = calculate_wads(
+            values, sample_source, density, rel_amt, n_sources
+        )
+        results[name] = (time.perf_counter() - start, size)
+
+    report(
+        "dense vs sparse long-layout feature data",
+        {
+            "dense time (s)": results["dense"][0],
+            "sparse time (s)": results["sparse"][0],
+            "speedup": results["dense"][0] / results["sparse"][0],
+            "dense size (MB)": results["dense"][1] / 1e6,
+            "sparse size (MB)": results["sparse"][1] / 1e6,
+            "size ratio": results["dense"][1] / results["sparse"][1],
+        },
+    )
+    np.testing.assert_allclose(wads["sparse"], wads["dense"])
+    min_speedup = 5
+    assert results["dense"][1] / results["sparse"][1] >= min_speedup
+    assert results["sparse"][0] < results["dense"][0]
+
+
+def test_streamed_get_objects2_benchmark() -> None:
+    """Compare peak memory use when decoding a get_objects2 response with and without streaming."""
+    from combinatrix.json_stream import parse_get_objects2
+
+    matrix = make_matrix()
+    del matrix[INFO]
+    body = json.dumps({"version": "1.1", "result": [{"data": [matrix]}]}).encode()
+    del matrix
+
+    results = {}
+    for method in ["json", "streamed"]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        if method == "json":
+            parsed = json.loads(body)
+            values = np.asarray(parsed["result"][0]["data"][0][DATA][DATA]["values"])
+        else:
+            parsed = parse_get_objects2(io.BytesIO(body))
+            values = parsed["result"][0]["data"][0][DATA][DATA]["values"]
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[method] = {"time": elapsed, "peak_mb": peak / 1e6}
+        assert values.shape == (N_FEATURES, N_FRACTIONS)
+        del parsed, values
+
+    report(
+        "json.loads vs streamed decoding of get_objects2",
+        {
+            "json time (s)": results["json"]["time"],
+            "streamed time (s)": results["streamed"]["time"],
+            "json peak memory (MB)": results["json"]["peak_mb"],
+            "streamed peak memory (MB)": results["streamed"]["peak_mb"],
+            "final matrix size (MB)": N_FEATURES * N_FRACTIONS * 8 / 1e6,
+        },
+    )
+    # the streamed peak is dominated by the final float array
+    assert results["streamed"]["peak_mb"] < results["json"]["peak_mb"]
+
+
+def first_computation() -> None:
+    """Run a small qSIP2 computation: filter the features of the qSIP2 example object."""
+    from kb_qsip.utils import helpers
+    from rpy2.robjects.packages import data
+
+    qsip_object = data(helpers.qsip2).fetch("example_qsip_object")[
+        "example_qsip_object"
+    ]
+    helpers.run_feature_filter(qsip_object, {})
+
+
+def test_warm_start_benchmark() -> None:
+    """Compare the latency to the first qSIP2 computation in a fresh interpreter and a warm worker."""
+    pytest.importorskip("rpy2")
+    from kb_qsip.utils import warm_start
+
+    # a fresh interpreter, as used for each job in async mode
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    start = time.perf_counter()
+    subprocess.run(
+        [  # noqa: S603
+            sys.executable,
+            "-c",
+            "from test_benchmarks import first_computation; first_computation()",
+        ],
+        check=True,
+        cwd=os.path.dirname(__file__),
+        env=env,
+    )
+    cold_time = time.perf_counter() - start
+
+    warm_up_time = warm_start.warm_up()
+    start = time.perf_counter()
+    warm_start.run_in_worker(first_computation)
+    warm_time = time.perf_counter() - start
+
+    report(
+        "cold start vs warm worker",
+        {
+            "cold start to first computation (s)": cold_time,
+            "warm-up at server startup (s)": warm_up_time,
+            "warm worker to first computation (s)": warm_time,
+            "speedup": cold_time / warm_time,
+        },
+    )
+    assert warm_time < cold_time
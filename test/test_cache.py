@@ -0,0 +1,133 @@
+"""Tests for the on-disk object cache."""
+
+import os
+from pathlib import Path
+from typing import Any
+
+import pytest
+from combinatrix.cache import (
+    CACHE_FILE_SUFFIX,
+    DEFAULT_MAX_BYTES,
+    ObjectCache,
+    make_object_cache,
+)
+
+KEY = "1/2/3"
+VALUE = {"infostruct": {"wsid": 1, "objid": 2, "version": 3}, "data": [1, 2, 3]}
+
+
+def cache_files(cache: ObjectCache) -> list[str]:
+    """List the cache entries in the cache directory."""
+    return [f for f in os.listdir(cache.cache_dir) if f.endswith(CACHE_FILE_SUFFIX)]
+
+
+def test_get_put(tmp_path: Path) -> None:
+    """Check that entries can be stored and retrieved, and that hits and misses are counted."""
+    cache = ObjectCache(str(tmp_path / "cache"))
+    assert cache.get(KEY) is None
+    cache.put(KEY, VALUE)
+    assert cache.get(KEY) == VALUE
+    assert cache.get("4/5/6") is None
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+    # entries are visible to other instances using the same directory
+    assert ObjectCache(str(tmp_path / "cache")).get(KEY) == VALUE
+    # no temporary files are left behind
+    assert os.listdir(cache.cache_dir) == cache_files(cache)
+
+
+def test_get_unreadable_entry(tmp_path: Path) -> None:
+    """Corrupt entries are treated as misses and removed."""
+    cache = ObjectCache(str(tmp_path))
+    cache.put(KEY, VALUE)
+    [file_name] = cache_files(cache)
+    with open(os.path.join(cache.cache_dir, file_name), "wb") as fh:
+        fh.write(b"not a pickle")
+
+    assert cache.get(KEY) is None
+    assert cache_files(cache) == []
+    assert cache.stats() == {"hits": 0, "misses": 1}
+
+
+def test_evict_lru(tmp_path: Path) -> None:
+    """The least recently used entries are removed when the cache is full."""
+    cache = ObjectCache(str(tmp_path))
+    for ix in range(3):
+        cache.put(f"key_{ix}", "x" * 1000)
+    entry_size = os.path.getsize(os.path.join(cache.cache_dir, cache_files(cache)[0]))
+
+    # make key_0 the oldest, then read it so that key_1 becomes the oldest
+    for ix in range(3):
+        path = cache._path(f"key_{ix}")  # noqa: SLF001
+        os.utime(path, (ix, ix))
+    assert cache.get("key_0") is not None
+
+    n_kept = 2
+    cache.max_bytes = entry_size * n_kept
+    cache.evict()
+    assert len(cache_files(cache)) == n_kept
+    assert cache.get("key_1") is None
+    assert cache.get("key_0") is not None
+    assert cache.get("key_2") is not None
+
+
+def test_init_fail(tmp_path: Path) -> None:
+    """The maximum cache size must be positive."""
+    with pytest.raises(
+        ValueError, match="Invalid cache size 0: must be greater than 0"
+    ):
+        ObjectCache(str(tmp_path), 0)
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param({"config": {}, "expected": None}, id="no_dir"),
+        pytest.param(
+            {
+                "config": {"scratch": "scratch", "object-cache-dir": ""},
+                "expected": None,
+            },
+            id="scratch_only",
+        ),
+        pytest.param(
+            {
+                "config": {"object-cache-dir": "shared", "object-cache-max-bytes": "0"},
+                "expected": None,
+            },
+            id="disabled",
+        ),
+        pytest.param(
+            {
+                "config": {"scratch": "scratch", "object-cache-dir": "shared"},
+                "expected": (os.path.join("shared", "object"), DEFAULT_MAX_BYTES),
+            },
+            id="default_size",
+        ),
+        pytest.param(
+            {
+                "config": {
+                    "scratch": "scratch",
+                    "object-cache-dir": "shared",
+                    "object-cache-max-bytes": "1000",
+                },
+                "expected": (os.path.join("shared", "object"), 1000),
+            },
+            id="shared_dir",
+        ),
+    ],
+)
+def test_make_object_cache(
+    param: dict[str, Any], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Check that the cache is configured from the app config."""
+    monkeypatch.chdir(tmp_path)
+    cache = make_object_cache(param["config"])
+    if param["expected"] is None:
+        assert cache is None
+        return
+
+    assert cache is not None
+    assert cache.cache_dir == str(tmp_path / param["expected"][0])
+    assert cache.max_bytes == param["expected"][1]
+    assert os.path.isdir(cache.cache_dir)
@@ -0,0 +1,346 @@
+"""Tests for the pipeline checkpoints."""
+
+import os
+import pickle
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+from kb_qsip.utils.checkpoint import (
+    DEFAULT_MAX_BYTES,
+    PARQUET_FRAMES,
+    CheckpointFormat,
+    Checkpoints,
+    Stage,
+    has_versioned_inputs,
+    params_hash,
+)
+
+
+def save_pickle(value: object, path: str) -> None:
+    """Save a value as a pickle."""
+    with open(path, "wb") as fh:
+        pickle.dump(value, fh)
+
+
+def load_pickle(path: str) -> object:
+    """Load a pickled value."""
+    with open(path, "rb") as fh:
+        return pickle.load(fh)  # noqa: S301
+
+
+PICKLE = CheckpointFormat(".pkl", save_pickle, load_pickle)
+
+PARAMS = {
+    "source_data": "1/2/3",
+    "sample_data": "1/3/1",
+    "feature_data": "1/4/2",
+    "resamples": 10,
+    "confidence": 0.9,
+}
+
+
+def make_stages(calls: list[str], *, memoize: bool = False) -> list[Stage]:
+    """Make a pipeline that records the stages that were run."""
+
+    def stage(name: str) -> Callable[[list[str] | None], list[str]]:
+        def run(value: list[str] | None) -> list[str]:
+            calls.append(name)
+            return [*(value or []), name]
+
+        return run
+
+    return [
+        Stage("load", stage("load"), ["source_data"], PICKLE),
+        Stage("not_saved", stage("not_saved"), []),
+        Stage("resample", stage("resample"), ["resamples"], PICKLE, memoize=memoize),
+        Stage("summarise", stage("summarise"), ["confidence"], PICKLE),
+    ]
+
+
+def checkpoint_files(checkpoint_dir: Path) -> dict[str, list[str]]:
+    """List the saved checkpoints for each stage."""
+    return {
+        stage: sorted(os.listdir(checkpoint_dir / stage))
+        for stage in sorted(os.listdir(checkpoint_dir))
+    }
+
+
+def test_run_saves_checkpoints(tmp_path: Path) -> None:
+    """Each checkpointed stage saves its output and key."""
+    calls: list[str] = []
+    checkpoints = Checkpoints(str(tmp_path), PARAMS)
+    output = checkpoints.run(make_stages(calls))
+    assert output == ["load", "not_saved", "resample", "summarise"]
+    assert calls == output
+    keys = checkpoints.stage_keys(make_stages([]))
+    assert checkpoint_files(tmp_path) == {
+        "load": [f"{keys[0]}.pkl"],
+        "resample": [f"{keys[2]}.pkl"],
+        "summarise": [f"{keys[3]}.pkl"],
+    }
+    assert load_pickle(str(tmp_path / "resample" / f"{keys[2]}.pkl")) == [
+        "load",
+        "not_saved",
+        "resample",
+    ]
+
+
+def test_run_without_resume(tmp_path: Path) -> None:
+    """Existing checkpoints are ignored unless resume mode is on."""
+    Checkpoints(str(tmp_path), PARAMS).run(make_stages([]))
+    calls: list[str] = []
+    Checkpoints(str(tmp_path), PARAMS).run(make_stages(calls))
+    assert calls == ["load", "not_saved", "resample", "summarise"]
+
+
+def test_run_resume(tmp_path: Path) -> None:
+    """In resume mode, the run starts after the last stage with a valid checkpoint."""
+    Checkpoints(str(tmp_path), PARAMS).run(make_stages([]))
+    calls: list[str] = []
+    output = Checkpoints(str(tmp_path), PARAMS, resume=True).run(make_stages(calls))
+    assert calls == []
+    assert output == ["load", "not_saved", "resample", "summarise"]
+
+    # a changed parameter invalidates the stage that uses it and every later stage
+    params = {**PARAMS, "resamples": 20}
+    calls = []
+    output = Checkpoints(str(tmp_path), params, resume=True).run(make_stages(calls))
+    assert calls == ["not_saved", "resample", "summarise"]
+    assert output == ["load", "not_saved", "resample", "summarise"]
+
+    params["confidence"] = 0.8
+    calls = []
+    Checkpoints(str(tmp_path), params, resume=True).run(make_stages(calls))
+    assert calls == ["summarise"]
+
+    # a parameter that no stage reads does not invalidate anything
+    calls = []
+    Checkpoints(str(tmp_path), {**params, "other": 1}, resume=True).run(
+        make_stages(calls)
+    )
+    assert calls == []
+
+    # the output for earlier parameters is kept
+    calls = []
+    Checkpoints(str(tmp_path), PARAMS, resume=True).run(make_stages(calls))
+    assert calls == []
+    assert {
+        stage: len(files) for stage, files in checkpoint_files(tmp_path).items()
+    } == {
+        "load": 1,
+        "resample": 2,
+        "summarise": 3,
+    }
+
+
+def test_run_memoize(tmp_path: Path) -> None:
+    """The output of memoized stages is reused outside resume mode."""
+    Checkpoints(str(tmp_path), PARAMS, memoize=True).run(make_stages([], memoize=True))
+    for confidence in [0.8, "0.9", 0.95]:
+        calls: list[str] = []
+        output = Checkpoints(
+            str(tmp_path), {**PARAMS, "confidence": confidence}, memoize=True
+        ).run(make_stages(calls, memoize=True))
+        assert calls == ["summarise"]
+        assert output == ["load", "not_saved", "resample", "summarise"]
+
+    calls = []
+    Checkpoints(str(tmp_path), {**PARAMS, "resamples": 20}, memoize=True).run(
+        make_stages(calls, memoize=True)
+    )
+    assert calls == ["load", "not_saved", "resample", "summarise"]
+
+    # memoized stages are only reused if the checkpoints memoize
+    calls = []
+    Checkpoints(str(tmp_path), PARAMS).run(make_stages(calls, memoize=True))
+    assert calls == ["load", "not_saved", "resample", "summarise"]
+
+
+def test_run_resume_different_input(tmp_path: Path) -> None:
+    """Checkpoints for different input data are never used."""
+    Checkpoints(str(tmp_path), PARAMS).run(make_stages([]))
+    calls: list[str] = []
+    Checkpoints(str(tmp_path), {**PARAMS, "source_data": "1/2/4"}, resume=True).run(
+        make_stages(calls)
+    )
+    assert calls == ["load", "not_saved", "resample", "summarise"]
+
+
+def test_run_resume_incomplete_checkpoint(tmp_path: Path) -> None:
+    """Checkpoints with missing or unreadable data are recomputed."""
+    checkpoints = Checkpoints(str(tmp_path), PARAMS, resume=True)
+    checkpoints.run(make_stages([]))
+    keys = checkpoints.stage_keys(make_stages([]))
+    os.remove(tmp_path / "summarise" / f"{keys[3]}.pkl")
+    (tmp_path / "resample" / f"{keys[2]}.pkl").write_bytes(b"not a pickle")
+
+    calls: list[str] = []
+    checkpoints.run(make_stages(calls))
+    assert calls == ["not_saved", "resample", "summarise"]
+
+
+def test_save_failure(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    """Failures to save a checkpoint are logged and the run continues."""
+
+    def fail(value: object, path: str) -> None:
+        with open(path, "w") as fh:
+            fh.write("partial")
+        raise TypeError(value)
+
+    stages = [Stage("unsaveable", lambda _: 1, [], CheckpointFormat(".x", fail, str))]
+    assert Checkpoints(str(tmp_path), PARAMS).run(stages) == 1
+    assert "Could not save the unsaveable checkpoint" in caplog.text
+    assert os.listdir(tmp_path / "unsaveable") == []
+
+
+def test_evict(tmp_path: Path) -> None:
+    """The least recently used checkpoints are removed when they exceed max_bytes."""
+    checkpoints = Checkpoints(str(tmp_path), PARAMS)
+    checkpoints.run(make_stages([]))
+    files = checkpoint_files(tmp_path)
+    total = sum(
+        os.path.getsize(tmp_path / stage / name)
+        for stage in files
+        for name in files[stage]
+    )
+    # make the "load" checkpoint the least recently used
+    load_path = tmp_path / "load" / files["load"][0]
+    os.utime(load_path, (0, 0))
+
+    Checkpoints(str(tmp_path), PARAMS, max_bytes=total).evict()
+    assert checkpoint_files(tmp_path) == files
+    Checkpoints(str(tmp_path), PARAMS, max_bytes=total - 1).evict()
+    assert checkpoint_files(tmp_path) == {**files, "load": []}
+
+
+def test_init_fail(tmp_path: Path) -> None:
+    """The size limit must be positive."""
+    with pytest.raises(ValueError, match="Invalid checkpoint size 0"):
+        Checkpoints(str(tmp_path), PARAMS, max_bytes=0)
+
+
+def test_params_hash() -> None:
+    """Parameter values are hashed in canonical form."""
+    assert params_hash({"a": 1000, "b": " 0.9"}, ["a", "b"]) == params_hash(
+        {"a": "1000", "b": 0.9, "c": 1}, ["a", "b"]
+    )
+    assert params_hash({"a": "x"}, ["a"]) != params_hash({"a": "y"}, ["a"])
+    assert params_hash({"a": True}, ["a"]) != params_hash({"a": 1}, ["a"])
+
+
+@pytest.mark.parametrize(
+    ("resume", "expected"), [(None, False), (0, False), (1, True), ("true", True)]
+)
+def test_from_config(tmp_path: Path, resume: object, *, expected: bool) -> None:
+    """Checkpoints are only enabled if a checkpoint directory is configured."""
+    params = {**PARAMS} if resume is None else {**PARAMS, "resume": resume}
+    assert Checkpoints.from_config({"scratch": str(tmp_path)}, params) is None
+    assert (
+        Checkpoints.from_config(
+            {"scratch": str(tmp_path), "checkpoint-dir": ""}, params
+        )
+        is None
+    )
+
+    checkpoints = Checkpoints.from_config(
+        {"scratch": str(tmp_path), "checkpoint-dir": str(tmp_path / "custom")},
+        params,
+    )
+    assert checkpoints.resume is expected
+    assert checkpoints.memoize is True
+    assert checkpoints.checkpoint_dir == str(tmp_path / "custom")
+    assert checkpoints.max_bytes == DEFAULT_MAX_BYTES
+
+    max_bytes = 1000
+    custom = Checkpoints.from_config(
+        {
+            "scratch": str(tmp_path),
+            "checkpoint-dir": str(tmp_path / "custom"),
+            "checkpoint-max-bytes": str(max_bytes),
+        },
+        params,
+    )
+    assert custom.max_bytes == max_bytes
+
+    disabled = Checkpoints.from_config(
+        {
+            "scratch": str(tmp_path),
+            "checkpoint-dir": str(tmp_path / "custom"),
+            "checkpoint-max-bytes": "0",
+        },
+        params,
+    )
+    assert disabled is None
+
+
+@pytest.mark.parametrize(
+    ("refs", "expected"),
+    [
+        ({}, True),
+        ({"feature_data": "1/4"}, False),
+        ({"sample_data": "my_samples"}, False),
+        ({"source_data": None}, False),
+        ({"source_data": "", "debug": 1}, True),
+    ],
+)
+def test_from_config_versioned(
+    tmp_path: Path, refs: dict[str, object], *, expected: bool
+) -> None:
+    """Saved outputs are only reused if every input is a versioned UPA."""
+    assert has_versioned_inputs({**PARAMS, **refs}) is expected
+    checkpoints = Checkpoints.from_config(
+        {"checkpoint-dir": str(tmp_path)}, {**PARAMS, **refs, "resume": 1}
+    )
+    assert checkpoints.memoize is expected
+    assert checkpoints.resume is expected
+
+
+def test_stage_keys_passthrough(tmp_path: Path) -> None:
+    """The parameters of a passthrough stage are not part of the later keys."""
+    stages = [
+        Stage("load", list, ["source_data"]),
+        Stage("check", list, ["min_labeled_sources"], passthrough=True),
+        Stage("filter", list, ["resamples"]),
+    ]
+    keys = Checkpoints(str(tmp_path), PARAMS).stage_keys(stages)
+    changed = Checkpoints(
+        str(tmp_path), {**PARAMS, "min_labeled_sources": 2}
+    ).stage_keys(stages)
+    assert changed[0] == keys[0]
+    assert changed[1] != keys[1]
+    assert changed[2] == keys[2]
+
+
+def test_parquet_frames(tmp_path: Path) -> None:
+    """DataFrames and column dicts are saved as Parquet files and restored."""
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    frames = {
+        "1/2/3": {"id": ["a", "b"], "value": [1.5, 2.5]},
+        "4/5/6": pd.DataFrame({"name": ["x", "y"], "count": [1, 2]}),
+    }
+    path = str(tmp_path / "convert.parquet")
+    PARQUET_FRAMES.save(frames, path)
+    loaded = PARQUET_FRAMES.load(path)
+    assert list(loaded) == ["1/2/3", "4/5/6"]
+    assert {col: list(values) for col, values in loaded["1/2/3"].items()} == frames[
+        "1/2/3"
+    ]
+    pd.testing.assert_frame_equal(loaded["4/5/6"], frames["4/5/6"])
+
+
+def test_output_path(tmp_path: Path) -> None:
+    """The path to the saved output of the last stage is set by each run."""
+    checkpoints = Checkpoints(str(tmp_path), PARAMS)
+    stages = make_stages([])
+    assert checkpoints.output_path is None
+    checkpoints.run(stages)
+    assert load_pickle(checkpoints.output_path) == [
+        "load",
+        "not_saved",
+        "resample",
+        "summarise",
+    ]
+    checkpoints.run(stages[:2])
+    assert checkpoints.output_path is None
@@ -1,13 +1,18 @@
 """Tests for the converter."""
 
+from collections.abc import Callable
 from typing import Any
 
+import numpy as np
+import pandas as pd
 import pytest
-from combinatrix.constants import DATA, DL, FN, INFO
+from combinatrix.constants import COLS, DATA, DL, FN, INFO, KEYS, LONG, WIDE
 from combinatrix.converter import (
     convert_data,
     convert_matrix,
+    convert_matrix_columnar,
     convert_samples,
+    convert_samples_columnar,
     convert_ws_object,
 )
 from combinatrix.util import get_upa
@@ -79,6 +84,130 @@ def test_convert_matrix() -> None:
     assert data_result[DL] == result[DL]
 
 
+@pytest.mark.parametrize("include_id", [True, False])
+def test_convert_matrix_columnar(include_id: bool) -> None:  # noqa: FBT001
+    """Ensure that the columnar matrix conversion matches the dict list conversion."""
+    matrix = {DATA: {DATA: EXAMPLE_MATRIX}}
+    result = convert_matrix_columnar(matrix, include_id=include_id)
+    data_result = convert_ws_object(
+        {INFO: {"type": "SuperCoolMatrix"}, DATA: {DATA: EXAMPLE_MATRIX}},
+        columnar=True,
+        converter_options={"Matrix": {"include_id": include_id}},
+    )
+    expected_fieldnames = {"column_id", "row_id", "value"}
+    if include_id:
+        expected_fieldnames.add("id")
+    assert result[FN] == expected_fieldnames
+    assert data_result[FN] == result[FN]
+
+    columns = result[COLS]
+    assert list(columns["column_id"].categories) == EXAMPLE_MATRIX["col_ids"]
+    assert list(columns["row_id"].categories) == EXAMPLE_MATRIX["row_ids"]
+    assert isinstance(columns["value"], np.ndarray)
+
+    as_dicts = [
+        {field: columns[field][i] for field in expected_fieldnames}
+        for i in range(len(columns["value"]))
+    ]
+    assert as_dicts == [
+        {k: v for k, v in row.items() if k in expected_fieldnames}
+        for row in EXPECTED_DICT_LIST
+    ]
+
+
+def test_convert_matrix_columnar_wide() -> None:
+    """Ensure that matrices can be converted to wide-format columns."""
+    matrix = {DATA: {DATA: EXAMPLE_MATRIX}}
+    result = convert_matrix_columnar(matrix, layout=WIDE)
+    assert result[FN] == {"row_id", "A", "B"}
+    columns = result[COLS]
+    assert list(columns) == ["row_id", "A", "B"]
+    assert list(columns["row_id"]) == ["X", "Y"]
+    np.testing.assert_array_equal(columns["A"], [1, 3])
+    np.testing.assert_array_equal(columns["B"], [2, 4])
+    assert all(columns[c].flags["C_CONTIGUOUS"] for c in ["A", "B"])
+
+    # the wide columns hold the same data as the long layout
+    long_columns = convert_matrix_columnar(matrix, layout=LONG)[COLS]
+    for column_id, row_id, value in zip(
+        long_columns["column_id"],
+        long_columns["row_id"],
+        long_columns["value"],
+        strict=True,
+    ):
+        row_index = list(columns["row_id"]).index(row_id)
+        assert columns[column_id][row_index] == value
+
+
+def test_convert_matrix_columnar_invalid_layout() -> None:
+    """The matrix layout must be long or wide."""
+    with pytest.raises(ValueError, match="Invalid matrix layout 'diagonal'"):
+        convert_matrix_columnar({DATA: {DATA: EXAMPLE_MATRIX}}, layout="diagonal")
+
+
+def test_convert_matrix_columnar_nulls() -> None:
+    """Null values in the matrix are converted to NaN."""
+    matrix = {DATA: {DATA: {**EXAMPLE_MATRIX, "values": [[1, None], [3, 4]]}}}
+    columns = convert_matrix_columnar(matrix)[COLS]
+    assert columns["value"].dtype == np.float64
+    np.testing.assert_array_equal(columns["value"], [1, 3, np.nan, 4])
+
+
+def test_convert_matrix_columnar_drop_zeros() -> None:
+    """Zero cells are dropped; null cells are kept, and every ID is kept as a category."""
+    matrix = {DATA: {DATA: {**EXAMPLE_MATRIX, "values": [[0, 2], [None, 0]]}, INFO: {}}}
+    columns = convert_matrix_columnar(matrix, drop_zeros=True, include_id=True)[COLS]
+    assert list(columns["column_id"]) == ["A", "B"]
+    assert list(columns["row_id"]) == ["Y", "X"]
+    np.testing.assert_array_equal(columns["value"], [np.nan, 2])
+    assert list(columns["column_id"].categories) == ["A", "B"]
+    assert list(columns["row_id"].categories) == ["X", "Y"]
+    assert list(columns["id"]) == ["A___Y___None", "B___X___2"]
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param(
+            {
+                "data": {**EXAMPLE_MATRIX, "values": [[1, 2], [3, 4], [5, 6]]},
+                "err_msg": r"'data.data.values' has shape \(3, 2\); expected \(2, 2\)",
+            },
+            id="wrong_shape",
+        ),
+        pytest.param(
+            {
+                "data": {**EXAMPLE_MATRIX, "values": [[1, "two"], [3, 4]]},
+                "err_msg": "'data.data.values' must be numeric",
+            },
+            id="non_numeric",
+        ),
+        pytest.param(
+            {
+                "data": {**EXAMPLE_MATRIX, "col_ids": ["A", "A"]},
+                "err_msg": "'data.data.col_ids' contains duplicate IDs",
+            },
+            id="duplicate_ids",
+        ),
+        pytest.param(
+            {
+                "data": {**EXAMPLE_MATRIX, "col_ids": ["A", "row_id"]},
+                "layout": WIDE,
+                "err_msg": "'row_id' cannot be used as a column ID",
+            },
+            id="row_id_column",
+        ),
+    ],
+)
+def test_convert_matrix_columnar_fail(param: dict[str, Any]) -> None:
+    """Invalid matrix values or IDs."""
+    with pytest.raises(ValueError, match="12345/89/67: " + param["err_msg"]):
+        convert_matrix_columnar(
+            {**UPA_DATA, DATA: {DATA: param["data"]}}, layout=param.get("layout", LONG)
+        )
+
+
+@pytest.mark.parametrize("converter", [convert_matrix, convert_matrix_columnar])
 @pytest.mark.parametrize(
     "param",
     [
@@ -88,10 +217,12 @@ def test_convert_matrix() -> None:
         {**UPA_DATA, DATA: {DATA: {}}},
     ],
 )
-def test_convert_matrix_fail_no_data(param: dict[str, Any]) -> None:
+def test_convert_matrix_fail_no_data(
+    param: dict[str, Any], converter: Callable[..., dict[str, Any]]
+) -> None:
     """Failure scenarios for matrix conversion."""
     with pytest.raises(ValueError, match="12345/89/67: no 'data.data' field found"):
-        convert_matrix(param)
+        converter(param)
 
 
 @pytest.mark.parametrize(
@@ -126,13 +257,16 @@ def test_convert_matrix_fail_no_data(param: dict[str, Any]) -> None:
         ),
     ],
 )
-def test_convert_matrix_fail_missing_keys(param: dict[str, Any]) -> None:
+@pytest.mark.parametrize("converter", [convert_matrix, convert_matrix_columnar])
+def test_convert_matrix_fail_missing_keys(
+    param: dict[str, Any], converter: Callable[..., dict[str, Any]]
+) -> None:
     """Invalid data.data structures."""
     with pytest.raises(
         ValueError,
         match="12345/89/67: 'data.data' is missing required keys: " + param["err_msg"],
     ):
-        convert_matrix(param["input"])
+        converter(param["input"])
 
 
 @pytest.mark.parametrize(
@@ -151,6 +285,101 @@ def test_convert_samples(request: pytest.FixtureRequest, test_file: str) -> None
     output = convert_samples(fixture_value["input"])
     assert fixture_value["output"] == output
 
+    # samples can also be streamed in, e.g. from DataFetcher.iter_samples
+    input_data = fixture_value["input"]
+    streamed_input = {
+        **input_data,
+        DATA: {
+            **input_data[DATA],
+            "sample_data": iter(input_data[DATA]["sample_data"]),
+        },
+    }
+    assert fixture_value["output"] == convert_samples(streamed_input)
+
+
+@pytest.mark.parametrize(
+    "test_file",
+    [
+        "samples_b",
+        "samples_all_controlled",
+        "samples_no_fields",
+        "samples_node_tree_multiple_under_node",
+    ],
+)
+def test_convert_samples_columnar(
+    request: pytest.FixtureRequest, test_file: str
+) -> None:
+    """The columnar sample conversion has the same data as convert_samples."""
+    fixture_value = request.getfixturevalue(test_file)
+    output = convert_samples_columnar(fixture_value["input"])
+    assert output[FN] == fixture_value["output"][FN]
+    assert output[KEYS] == fixture_value["output"][KEYS]
+    assert {len(column) for column in output[COLS].values()} == {
+        len(fixture_value["output"][DL])
+    }
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(output[COLS]),
+        pd.DataFrame(convert_samples(fixture_value["input"])[DL]).replace(
+            {np.nan: None}
+        ),
+        check_dtype=False,
+    )
+
+    # the samples are not modified
+    assert "node_tree" in fixture_value["input"][DATA]["sample_data"][0]
+
+
+def test_convert_samples_columnar_fields(samples_b: dict[str, Any]) -> None:
+    """Only the requested fields are converted."""
+    full = convert_samples_columnar(samples_b["input"])
+    fields = ["name", "isotope", "incubation_time_days", "type", "not_a_field"]
+    output = convert_samples_columnar(samples_b["input"], fields=fields)
+    assert output[COLS] == {field: full[COLS][field] for field in fields[:4]}
+    assert output[FN] == set(fields[:4])
+    assert output[KEYS] == {
+        "user": {"incubation_time_days"},
+        "controlled": {"isotope"},
+    }
+
+
+def test_convert_samples_columnar_missing_fields() -> None:
+    """Fields that a sample does not have are filled with None."""
+    samples = [
+        {"id": "1", "name": "a", "node_tree": [{"id": "a", "type": "BioReplicate"}]},
+        {
+            "id": "2",
+            "name": "b",
+            "node_tree": [
+                {"id": "c", "type": "SubSample"},
+                {
+                    "id": "b",
+                    "type": "BioReplicate",
+                    "meta_user": {"depth": {"value": 5, "units": "cm"}},
+                },
+            ],
+        },
+        {
+            "id": "3",
+            "name": "c",
+            "node_tree": [
+                {
+                    "id": "c",
+                    "type": "BioReplicate",
+                    "meta_controlled": {"odd": {"val": 1}},
+                }
+            ],
+        },
+    ]
+    output = convert_samples_columnar({**UPA_DATA, DATA: {"sample_data": samples}})
+    assert output[COLS] == {
+        "id": ["1", "2", "3"],
+        "name": ["a", "b", "c"],
+        "type": ["BioReplicate"] * 3,
+        "depth": [None, "5 cm", None],
+        "odd": [None, None, '{\n"val": 1\n}'],
+    }
+    assert output[KEYS] == {"user": {"depth"}, "controlled": {"odd"}}
+
 
 @pytest.mark.parametrize(
     "param",
@@ -159,21 +388,28 @@ def test_convert_samples(request: pytest.FixtureRequest, test_file: str) -> None
         {**UPA_DATA, DATA: {}},
         {**UPA_DATA, DATA: {"sample_data": None}},
         {**UPA_DATA, DATA: {"sample_data": []}},
+        {**UPA_DATA, DATA: {"sample_data": iter([])}},
     ],
 )
-def test_convert_sample_fail_no_data(param: dict[str, Any]) -> None:
+@pytest.mark.parametrize("converter", [convert_samples, convert_samples_columnar])
+def test_convert_sample_fail_no_data(
+    param: dict[str, Any], converter: Callable[..., dict[str, Any]]
+) -> None:
     """Failure scenarios for sample conversion."""
     with pytest.raises(
         ValueError, match="12345/89/67: no 'data.sample_data' field found"
     ):
-        convert_samples(param)
+        converter(param)
 
 
 @pytest.mark.parametrize(
     "test_file", ["samples_node_tree_0", "samples_node_tree_multiple"]
 )
+@pytest.mark.parametrize("converter", [convert_samples, convert_samples_columnar])
 def test_convert_sample_fail_no_node_trees(
-    request: pytest.FixtureRequest, test_file: str
+    request: pytest.FixtureRequest,
+    test_file: str,
+    converter: Callable[..., dict[str, Any]],
 ) -> None:
     """Incorrect number of node trees for a given sample ID."""
     fixture_value = request.getfixturevalue(test_file)
@@ -181,7 +417,7 @@ def test_convert_sample_fail_no_node_trees(
         ValueError,
         match=fixture_value["error"],
     ):
-        convert_samples(fixture_value["input"])
+        converter(fixture_value["input"])
 
 
 def test_convert_data_all_ok(
@@ -236,3 +472,12 @@ def test_convert_data_fail_no_node_trees(
     error_msg = e.value.args[0]
     assert samples_node_tree_multiple["error"] in error_msg
     assert samples_node_tree_0["error"] in error_msg
+
+
+def test_convert_data_columnar(samples_b: dict[str, Any]) -> None:
+    """Samples are converted into columns by the columnar converters."""
+    output = convert_data({"12345/1/1": samples_b["input"]}, columnar=True)
+    assert (
+        output["12345/1/1"][COLS] == convert_samples_columnar(samples_b["input"])[COLS]
+    )
+    assert DL not in output["12345/1/1"]
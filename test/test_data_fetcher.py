@@ -1,16 +1,22 @@
 """Tests for the data fetching code."""
 
 import logging
+import os
+import threading
+import time
+from pathlib import Path
 from test.conftest import AMP, INVALID_DATA_FETCHER_PARAMS, SSA, SSB, TEST_UPA, paramify
 from test.conftest import body_match_vcr as vcr
 from typing import Any
 
+import numpy as np
 import pytest
+import requests
 from combinatrix.constants import DATA, INFO
 from combinatrix.fetcher import DataFetcher
 
 # enable extra vcrpy logging for troubleshooting purposes
-#logging.basicConfig()
+# logging.basicConfig()
 # vcr_log = logging.getLogger("vcr")
 # vcr_log.setLevel(logging.DEBUG)
 
@@ -99,6 +105,7 @@ def test_fetch_objects_by_ref_with_samples(
         assert DATA in output[ref]
         if ref in param["sample_data_expected"]:
             assert output[ref][INFO]["type"] == "KBaseSets.SampleSet-2.0"
+            assert isinstance(output[ref][DATA]["sample_data"], list)
             assert (
                 str(len(output[ref][DATA]["sample_data"]))
                 == output[ref][INFO]["meta"]["num_samples"]
@@ -109,3 +116,366 @@ def test_fetch_objects_by_ref_with_samples(
             }
         else:
             assert "sample_data" not in output[ref][DATA]
+
+
+def test_fetch_objects_by_ref_cached(
+    config: dict[str, str], context: dict[str, Any], tmp_path: Path
+) -> None:
+    """Ensure that versioned objects are served from the object cache on repeat fetches."""
+    data_fetcher = DataFetcher(
+        {
+            **config,
+            "object-cache-dir": str(tmp_path),
+            "object-cache-max-bytes": "100000000",
+        },
+        context,
+    )
+    ref_list = [TEST_UPA[AMP], TEST_UPA[SSA], TEST_UPA[SSB]]
+    with vcr.use_cassette("test/data/cassettes/multi_sampleset.yaml") as cassette:
+        output = data_fetcher.fetch_objects_by_ref(ref_list)
+        assert cassette.play_count > 0
+    assert data_fetcher.object_cache.stats() == {"hits": 0, "misses": 3}
+
+    with vcr.use_cassette("test/data/cassettes/multi_sampleset.yaml") as cassette:
+        cached_output = data_fetcher.fetch_objects_by_ref(ref_list)
+        assert cassette.play_count == 0
+    assert data_fetcher.object_cache.stats() == {"hits": 3, "misses": 3}
+    assert cached_output == output
+
+
+def test_fetch_samples_cached(
+    config: dict[str, str],
+    context: dict[str, Any],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Ensure that only samples missing from the sample cache are requested."""
+    data_fetcher = DataFetcher(
+        {
+            **config,
+            "object-cache-dir": str(tmp_path),
+            "object-cache-max-bytes": "100000000",
+        },
+        context,
+    )
+    with vcr.use_cassette("test/data/cassettes/single_sampleset.yaml"):
+        sampleset = data_fetcher.fetch_objects_by_ref([TEST_UPA[SSA]])[TEST_UPA[SSA]]
+    sample_list = sampleset[DATA]["samples"]
+    sample_data = sampleset[DATA]["sample_data"]
+
+    # remove every other sample from the cache
+    removed = sample_list[::2]
+    for sample in removed:
+        os.remove(
+            data_fetcher.sample_cache._path(  # noqa: SLF001
+                f"{sample['id']}/{sample['version']}"
+            )
+        )
+
+    requested = []
+
+    def sample_service_query(
+        method: str, params: dict[str, Any]
+    ) -> list[dict[str, Any]]:
+        assert method == "get_samples"
+        requested.extend(params["samples"])
+        by_id = {sample["id"]: sample for sample in sample_data}
+        return [by_id[sample["id"]] for sample in params["samples"]]
+
+    monkeypatch.setattr(data_fetcher, "_sample_service_query", sample_service_query)
+    assert data_fetcher.fetch_samples(sample_list) == sample_data
+    assert requested == [
+        {"id": sample["id"], "version": sample["version"]} for sample in removed
+    ]
+
+    # everything is now in the cache
+    requested.clear()
+    assert data_fetcher.fetch_samples(sample_list) == sample_data
+    assert requested == []
+
+
+@pytest.mark.parametrize("max_connections", [1, 2, 3])
+def test_fetch_object_groups_concurrency(
+    max_connections: int,
+    config: dict[str, str],
+    context: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Check that workspace and sample requests run concurrently, up to the connection limit."""
+    data_fetcher = DataFetcher(
+        {**config, "max-connections-per-node": str(max_connections)}, context
+    )
+    lock = threading.Lock()
+    in_flight = {"now": 0, "max": 0}
+
+    def request() -> None:
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.05)
+        with lock:
+            in_flight["now"] -= 1
+
+    def fetch_workspace_objects(
+        ref_list: list[str], **_kwargs: object
+    ) -> list[dict[str, Any]]:
+        request()
+        return [
+            {
+                INFO: {
+                    "wsid": ref.split("/")[0],
+                    "objid": ref.split("/")[1],
+                    "version": ref.split("/")[2],
+                    "type": "KBaseSets.SampleSet-2.0",
+                },
+                DATA: {"samples": [{"id": ref, "version": 1}]},
+            }
+            for ref in ref_list
+        ]
+
+    def fetch_sample_batch(samples: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        request()
+        return samples
+
+    monkeypatch.setattr(
+        data_fetcher, "_fetch_workspace_objects", fetch_workspace_objects
+    )
+    monkeypatch.setattr(data_fetcher, "_fetch_sample_batch", fetch_sample_batch)
+
+    ref_groups = [["1/1/1", "1/2/1"], ["2/1/1"], ["3/1/1"]]
+    output = data_fetcher.fetch_object_groups(ref_groups)
+    assert set(output) == {ref for group in ref_groups for ref in group}
+    for ref, item in output.items():
+        assert item[DATA]["sample_data"] == [{"id": ref, "version": 1}]
+    assert in_flight["max"] == max_connections
+
+
+def test_open_object_groups(
+    config: dict[str, str],
+    context: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Samples are streamed in; outstanding sample requests are stopped on exit."""
+    data_fetcher = DataFetcher(
+        {**config, "max-connections-per-node": "1", "sample-batch-size": "1"},
+        context,
+    )
+    sample_ids = [f"sample_{ix}" for ix in range(5)]
+    lock = threading.Lock()
+    requests_made = {"started": 0, "running": 0}
+
+    def fetch_workspace_objects(
+        ref_list: list[str], **_kwargs: object
+    ) -> list[dict[str, Any]]:
+        return [
+            {
+                INFO: {
+                    "wsid": ref.split("/")[0],
+                    "objid": ref.split("/")[1],
+                    "version": ref.split("/")[2],
+                    "type": "KBaseSets.SampleSet-2.0",
+                },
+                DATA: {"samples": [{"id": sid, "version": 1} for sid in sample_ids]},
+            }
+            for ref in ref_list
+        ]
+
+    def fetch_sample_batch(samples: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        with lock:
+            requests_made["started"] += 1
+            requests_made["running"] += 1
+        time.sleep(0.02)
+        with lock:
+            requests_made["running"] -= 1
+        return samples
+
+    monkeypatch.setattr(
+        data_fetcher, "_fetch_workspace_objects", fetch_workspace_objects
+    )
+    monkeypatch.setattr(data_fetcher, "_fetch_sample_batch", fetch_sample_batch)
+
+    with data_fetcher.open_object_groups([["1/1/1"]]) as output:
+        sample_iter = output["1/1/1"][DATA]["sample_data"]
+        assert not isinstance(sample_iter, list)
+        assert next(sample_iter) == {"id": "sample_0", "version": 1}
+
+    # nothing is left running, and the remaining batches are not all requested
+    assert requests_made["running"] == 0
+    assert requests_made["started"] < len(sample_ids)
+
+    # the full set of samples is fetched by fetch_object_groups
+    output = data_fetcher.fetch_object_groups([["1/1/1"]])
+    assert output["1/1/1"][DATA]["sample_data"] == [
+        {"id": sid, "version": 1} for sid in sample_ids
+    ]
+
+
+def test_init_max_connections_fail(
+    config: dict[str, str], context: dict[str, Any]
+) -> None:
+    """The connection limit must be positive."""
+    with pytest.raises(
+        ValueError, match="'config.max-connections-per-node' must be at least 1"
+    ):
+        DataFetcher({**config, "max-connections-per-node": "-1"}, context)
+
+
+SAMPLE_LIST = [
+    {"id": f"sample_{ix}", "version": 1, "name": f"s{ix}"} for ix in range(10)
+]
+
+
+def make_sample_fetcher(
+    config: dict[str, str],
+    context: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+    failures: dict[str, Exception] | None = None,
+    **extra_config: str,
+) -> tuple[DataFetcher, list[list[str]]]:
+    """Create a DataFetcher with a stubbed SampleService.
+
+    :param failures: exceptions to raise, once each, for batches starting with the given sample ID
+    :return: the fetcher and a list of the sample IDs in each request made
+    """
+    data_fetcher = DataFetcher({**config, **extra_config}, context)
+    data_fetcher.retry_backoff = 0
+    failures = dict(failures or {})
+    requests_made = []
+
+    def sample_service_query(
+        method: str, params: dict[str, Any]
+    ) -> list[dict[str, Any]]:
+        assert method == "get_samples"
+        ids = [sample["id"] for sample in params["samples"]]
+        requests_made.append(ids)
+        if ids[0] in failures:
+            raise failures.pop(ids[0])
+        return [{"id": sample_id, "node_tree": []} for sample_id in ids]
+
+    monkeypatch.setattr(data_fetcher, "_sample_service_query", sample_service_query)
+    return data_fetcher, requests_made
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 10, 500])
+def test_iter_samples_batches(
+    batch_size: int,
+    config: dict[str, str],
+    context: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Check that samples are requested in batches and returned in the original order."""
+    data_fetcher, requests_made = make_sample_fetcher(
+        config,
+        context,
+        monkeypatch,
+        **{"sample-batch-size": str(batch_size), "max-connections-per-node": "3"},
+    )
+    sample_iter = data_fetcher.iter_samples(SAMPLE_LIST)
+    assert not isinstance(sample_iter, list)
+    assert [sample["id"] for sample in sample_iter] == [
+        sample["id"] for sample in SAMPLE_LIST
+    ]
+    assert sorted(requests_made) == sorted(
+        [
+            [sample["id"] for sample in SAMPLE_LIST[start : start + batch_size]]
+            for start in range(0, len(SAMPLE_LIST), batch_size)
+        ]
+    )
+
+
+def test_fetch_samples_retry(
+    config: dict[str, str], context: dict[str, Any], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Failed batches are retried individually."""
+    data_fetcher, requests_made = make_sample_fetcher(
+        config,
+        context,
+        monkeypatch,
+        failures={"sample_4": requests.ConnectionError("connection reset")},
+        **{"sample-batch-size": "4"},
+    )
+    output = data_fetcher.fetch_samples(SAMPLE_LIST)
+    assert [sample["id"] for sample in output] == [
+        sample["id"] for sample in SAMPLE_LIST
+    ]
+    # the second batch is requested twice; the others once
+    assert sorted(req[0] for req in requests_made) == [
+        "sample_0",
+        "sample_4",
+        "sample_4",
+        "sample_8",
+    ]
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param(
+            {
+                "error": requests.Timeout("read timed out"),
+                "retries": "0",
+                "n_requests": 1,
+            },
+            id="no_retries",
+        ),
+        pytest.param(
+            {
+                "error": RuntimeError("Error from SampleService - no such sample"),
+                "retries": "3",
+                "n_requests": 1,
+            },
+            id="service_error",
+        ),
+    ],
+)
+def test_fetch_samples_retry_fail(
+    param: dict[str, Any],
+    config: dict[str, str],
+    context: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Errors are raised once the retries are used up; SampleService errors are not retried."""
+    data_fetcher, requests_made = make_sample_fetcher(
+        config,
+        context,
+        monkeypatch,
+        failures={"sample_0": param["error"]},
+        **{"sample-request-retries": param["retries"]},
+    )
+    with pytest.raises(type(param["error"]), match=str(param["error"])):
+        data_fetcher.fetch_samples(SAMPLE_LIST)
+    assert len(requests_made) == param["n_requests"]
+
+
+def test_init_sample_batch_size_fail(
+    config: dict[str, str], context: dict[str, Any]
+) -> None:
+    """The sample batch size must be positive."""
+    with pytest.raises(
+        ValueError, match="'config.sample-batch-size' must be at least 1"
+    ):
+        DataFetcher({**config, "sample-batch-size": "-5"}, context)
+
+
+@pytest.mark.parametrize("cassette", ["no_sampleset", "multi_sampleset"])
+def test_fetch_object_groups_streamed(cassette: str, data_fetcher: DataFetcher) -> None:
+    """Streamed responses match the standard ones, with matrix values as NumPy arrays."""
+    ref_list = (
+        [TEST_UPA[AMP]]
+        if cassette == "no_sampleset"
+        else [TEST_UPA[AMP], TEST_UPA[SSA], TEST_UPA[SSB]]
+    )
+    with vcr.use_cassette(f"test/data/cassettes/{cassette}.yaml"):
+        expected = data_fetcher.fetch_object_groups([ref_list])
+    with vcr.use_cassette(f"test/data/cassettes/{cassette}.yaml"):
+        output = data_fetcher.fetch_object_groups([ref_list], stream=True)
+
+    values = output[TEST_UPA[AMP]][DATA][DATA]["values"]
+    assert isinstance(values, np.ndarray)
+    np.testing.assert_array_equal(
+        values, np.array(expected[TEST_UPA[AMP]][DATA][DATA]["values"], dtype=float)
+    )
+    output[TEST_UPA[AMP]][DATA][DATA]["values"] = expected[TEST_UPA[AMP]][DATA][DATA][
+        "values"
+    ]
+    assert output == expected
@@ -0,0 +1,102 @@
+"""Tests for writing the EAF summary and per-resample values."""
+
+import gzip
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from kb_qsip.utils.eaf_output import (
+    RESAMPLES_FILE_NAME,
+    resamples_table,
+    typed_summary,
+    write_resamples,
+    write_summary,
+)
+
+SUMMARY = pd.DataFrame(
+    {
+        "feature_id": ["ASV_1", "ASV_2"],
+        "observed_EAF": [0.25, np.nan],
+        "mean_resampled_EAF": [0.24, np.nan],
+        "lower": [0.2, np.nan],
+        "upper": [0.3, np.nan],
+        # counts from R are doubles
+        "labeled_resamples": [100.0, 0.0],
+        "unlabeled_resamples": [100.0, 98.0],
+    }
+)
+
+
+def test_typed_summary() -> None:
+    """Feature IDs are strings and resample counts are integers."""
+    typed = typed_summary(SUMMARY)
+    assert typed["feature_id"].dtype == "string"
+    assert typed["labeled_resamples"].dtype == "Int64"
+    assert typed["observed_EAF"].dtype == "float64"
+    assert list(typed["unlabeled_resamples"]) == [100, 98]
+
+
+def test_write_summary_text(tmp_path: Path) -> None:
+    """The summary is written as plain and gzip-compressed TSV."""
+    reports = write_summary(SUMMARY, str(tmp_path), ["tsv", "tsv.gz"])
+    assert [report["name"] for report in reports] == [
+        "EAF_summary.txt",
+        "EAF_summary.txt.gz",
+    ]
+    assert [report["path"] for report in reports] == [
+        str(tmp_path / report["name"]) for report in reports
+    ]
+
+    text = (tmp_path / "EAF_summary.txt").read_text()
+    with gzip.open(tmp_path / "EAF_summary.txt.gz", "rt") as fh:
+        assert fh.read() == text
+    assert text.splitlines()[0].split("\t") == list(SUMMARY.columns)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "EAF_summary.txt.gz", sep="\t"), SUMMARY
+    )
+
+
+@pytest.mark.parametrize(
+    ("fmt", "read"), [("parquet", pd.read_parquet), ("feather", pd.read_feather)]
+)
+def test_write_summary_columnar(
+    tmp_path: Path, fmt: str, read: Callable[[str], pd.DataFrame]
+) -> None:
+    """The column types are kept in the columnar formats."""
+    pytest.importorskip("pyarrow")
+    (report,) = write_summary(SUMMARY, str(tmp_path), [fmt])
+    assert report["name"] == f"EAF_summary.{fmt}"
+    pd.testing.assert_frame_equal(
+        read(tmp_path / report["name"]), typed_summary(SUMMARY)
+    )
+
+
+def test_resamples_table() -> None:
+    """The resampled EAF values are in long format, one row per feature and resample."""
+    resampled = np.array([[0.1, 0.2, 0.3], [np.nan, 0.5, 0.6]])
+    table = resamples_table(
+        np.array(["ASV_1", "ASV_2"]), np.array([0.2, 0.55]), resampled
+    )
+    assert list(table.columns) == ["feature_id", "observed_EAF", "resample", "EAF"]
+    assert list(table["feature_id"]) == ["ASV_1"] * 3 + ["ASV_2"] * 3
+    assert list(table["resample"]) == [1, 2, 3] * 2
+    assert list(table["observed_EAF"]) == [0.2] * 3 + [0.55] * 3
+    np.testing.assert_array_equal(table["EAF"], resampled.reshape(-1))
+
+
+def test_write_resamples(tmp_path: Path) -> None:
+    """The per-resample EAF values are written as Parquet."""
+    pytest.importorskip("pyarrow")
+    table = resamples_table(
+        np.array(["ASV_1", "ASV_2"]), np.array([0.2, 0.55]), np.ones((2, 4))
+    )
+    report = write_resamples(table, str(tmp_path))
+    assert os.listdir(tmp_path) == [RESAMPLES_FILE_NAME]
+    assert report["name"] == RESAMPLES_FILE_NAME
+    assert report["path"] == str(tmp_path / RESAMPLES_FILE_NAME)
+    loaded = pd.read_parquet(tmp_path / RESAMPLES_FILE_NAME)
+    assert list(loaded["feature_id"].astype(str)) == ["ASV_1"] * 4 + ["ASV_2"] * 4
+    assert list(loaded["resample"]) == [1, 2, 3, 4] * 2
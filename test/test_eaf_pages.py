@@ -0,0 +1,174 @@
+"""Tests for the paged EAF plots and viewer."""
+
+import json
+import math
+import os
+from pathlib import Path
+
+import pytest
+from kb_qsip.utils.app_params import PageOptions
+from kb_qsip.utils.eaf_pages import (
+    PAGE_DIR_NAME,
+    VIEWER_DIR_NAME,
+    VIEWER_FILE_NAME,
+    _finite_or_none,
+    is_rendered,
+    page_file_name,
+    paginate,
+    rank_features,
+    write_viewer,
+)
+from pandas import DataFrame
+
+PARAMS = {"resamples": 10, "resample_success": 0.5}
+
+
+def make_summary(n_features: int) -> DataFrame:
+    """Make an EAF summary; feature fN has EAF N / 100 and a CI of +/- 0.05."""
+    eaf = [i / 100 for i in range(n_features)]
+    return DataFrame(
+        {
+            "feature_id": [f"f{i}" for i in range(n_features)],
+            "observed_EAF": eaf,
+            "mean_resampled_EAF": eaf,
+            "lower": [value - 0.05 for value in eaf],
+            "upper": [value + 0.05 for value in eaf],
+            "labeled_resamples": [10] * n_features,
+            "unlabeled_resamples": [10] * n_features,
+        }
+    )
+
+
+def test_rank_features() -> None:
+    """Features are ranked by EAF; those with too few resamples are dropped."""
+    summary = make_summary(5)
+    summary.loc[1, "observed_EAF"] = math.nan
+    summary.loc[3, "unlabeled_resamples"] = 4
+    ranked = rank_features(summary, PARAMS)
+    assert list(ranked["feature_id"]) == ["f4", "f2", "f0", "f1"]
+    assert list(ranked.index) == [0, 1, 2, 3]
+
+    assert len(rank_features(summary, {})) == len(summary)
+
+
+def test_rank_features_batch() -> None:
+    """In batch mode, features are ranked at the first confidence level."""
+    summary = make_summary(3)
+    batch = DataFrame(
+        [
+            *({**row, "confidence": 0.9} for row in summary.to_dict("records")),
+            *({**row, "confidence": 0.95} for row in summary.to_dict("records")),
+        ]
+    )
+    ranked = rank_features(batch, PARAMS)
+    assert list(ranked["feature_id"]) == ["f2", "f1", "f0"]
+    assert "confidence" not in ranked.columns
+
+    # with one resample_success ratio per level, the first level's ratio is used
+    batch.loc[batch["feature_id"] == "f1", "labeled_resamples"] = 6
+    ranked = rank_features(batch, {**PARAMS, "resample_success": [0.7, 0.5]})
+    assert list(ranked["feature_id"]) == ["f2", "f0"]
+    ranked = rank_features(batch, {**PARAMS, "resample_success": [0.5, 0.7]})
+    assert list(ranked["feature_id"]) == ["f2", "f1", "f0"]
+
+
+@pytest.mark.parametrize(
+    ("significant_only", "top", "pages"),
+    [
+        (False, ["f24", "f23", "f22"], [10, 10, 2]),
+        # only f6 and up have a lower bound above 0
+        (True, ["f24", "f23", "f22"], [10, 10, 2]),
+    ],
+)
+def test_paginate(*, significant_only: bool, top: list[str], pages: list[int]) -> None:
+    """The top features go in the main plot and the rest are split into pages."""
+    options = PageOptions(3, 10, 2, significant_only=significant_only)
+    eaf_pages = paginate(make_summary(25), PARAMS, options)
+    assert list(eaf_pages.top["feature_id"]) == top
+    assert [len(page) for page in eaf_pages.pages] == pages
+    assert list(eaf_pages.pages[0]["feature_id"])[:2] == ["f21", "f20"]
+    assert list(eaf_pages.pages[-1]["feature_id"]) == ["f1", "f0"]
+    assert [is_rendered(eaf_pages, page) for page in range(4)] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+
+
+def test_paginate_significant_only() -> None:
+    """Only significant features go in the main plot if significant_only is set."""
+    summary = make_summary(10)
+    summary.loc[9, "lower"] = -0.1
+    eaf_pages = paginate(summary, PARAMS, PageOptions(5, 4, 10, significant_only=True))
+    assert list(eaf_pages.top["feature_id"]) == ["f8", "f7", "f6"]
+    assert [list(page["feature_id"]) for page in eaf_pages.pages] == [
+        ["f9", "f5", "f4", "f3"],
+        ["f2", "f1", "f0"],
+    ]
+
+    no_significant = paginate(
+        make_summary(3), PARAMS, PageOptions(5, 4, 10, significant_only=True)
+    )
+    assert no_significant.top.empty
+    assert not is_rendered(no_significant, 0)
+
+
+def test_page_file_name() -> None:
+    """The main plot and the pages have different file names."""
+    assert page_file_name(0) == "EAF_plot_top.png"
+    assert page_file_name(12) == "EAF_plot_page_0012.png"
+
+
+def test_write_viewer(tmp_path: Path) -> None:
+    """The viewer is written in its own directory, with one JSON file per page and an index."""
+    summary = make_summary(25)
+    summary.loc[0, "lower"] = math.nan
+    summary.loc[24, "upper"] = math.inf
+    eaf_pages = paginate(summary, PARAMS, PageOptions(3, 10, 1, significant_only=False))
+    report = write_viewer(eaf_pages, str(tmp_path))
+    viewer_dir = tmp_path / VIEWER_DIR_NAME
+    assert report["path"] == str(viewer_dir)
+    assert report["name"] == VIEWER_FILE_NAME
+    assert os.listdir(tmp_path) == [VIEWER_DIR_NAME]
+    assert (viewer_dir / VIEWER_FILE_NAME).read_text().startswith("<!DOCTYPE html>")
+    assert sorted(os.listdir(viewer_dir / PAGE_DIR_NAME)) == [
+        "index.json",
+        "page_0000.json",
+        "page_0001.json",
+        "page_0002.json",
+        "page_0003.json",
+    ]
+
+    index = json.loads((viewer_dir / PAGE_DIR_NAME / "index.json").read_text())
+    # the infinite upper bound is left out of the range
+    assert index["bounds"] == pytest.approx([-0.04, 0.28])
+    assert [
+        (page["title"], page["image"], page["first_rank"], page["n_features"])
+        for page in index["pages"]
+    ] == [
+        ("Top features", "EAF_plot_top.png", None, 3),
+        ("Page 1", "EAF_plot_page_0001.png", 1, 10),
+        ("Page 2", None, 11, 10),
+        ("Page 3", None, 21, 2),
+    ]
+
+    last_page = json.loads((viewer_dir / index["pages"][3]["file"]).read_text())
+    assert [row["feature_id"] for row in last_page] == ["f1", "f0"]
+    assert last_page[1]["lower"] is None
+    assert set(last_page[0]) == {
+        "feature_id",
+        "observed_EAF",
+        "mean_resampled_EAF",
+        "lower",
+        "upper",
+    }
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [(0.25, 0.25), (math.nan, None), (math.inf, None), (-math.inf, None)],
+)
+def test_finite_or_none(value: float, expected: float | None) -> None:
+    """Only finite values are kept for the viewer."""
+    assert _finite_or_none(value) == expected
@@ -1,10 +1,41 @@
 """Tests for the helper functions."""
 
-from test.conftest import paramify
+import os
+from pathlib import Path
+from test.conftest import PARAMS_BASE, paramify, read_json_file
 from typing import Any
 
+import numpy as np
 import pytest
-from kb_qsip.utils.helpers import retrieve_convert_objects
+from combinatrix.constants import COLS, LONG, WIDE
+from combinatrix.converter import convert_matrix_columnar
+from kb_qsip.utils.app_params import DEFAULT_RESAMPLE_SUCCESS, PageOptions
+from kb_qsip.utils.eaf_pages import paginate
+from kb_qsip.utils.helpers import (
+    EAF_resamples,
+    baseR,
+    chunk_seeds,
+    eaf_page_jobs,
+    make_feature_object,
+    make_sample_object,
+    merge_resamples,
+    plot_jobs,
+    qsip2,
+    r_get_resamples,
+    r_set_resamples,
+    render_plots,
+    retrieve_convert_objects,
+    run_EAF_calculations,
+    run_feature_filter,
+    run_resampling,
+    sparse_to_wide,
+    split_resamples,
+    summarize_EAF_values,
+)
+from kb_qsip.utils.r_convert import columns_to_r_dataframe
+from pandas import DataFrame
+from rpy2 import robjects
+from rpy2.robjects.packages import data
 
 
 @pytest.mark.parametrize(
@@ -84,3 +115,292 @@ def test_retrieve_object_dataframes_unique_fail(
         match=f"Only found {params['n_found']} unique KBase objects to fetch. Check your parameters and rerun the app.",
     ):
         retrieve_convert_objects(params["input"], config, "token")
+
+
+def test_make_sample_object_keeps_params() -> None:
+    """Calculating the relative amounts does not change the params."""
+    sample_df = data(qsip2).fetch("example_sample_df")["example_sample_df"]
+    rename_sample_id = robjects.r(
+        "function(df) { names(df)[names(df) == 'sample'] <- 'name'; df }"
+    )
+    params = {**PARAMS_BASE}
+    make_sample_object(rename_sample_id(sample_df), params)
+    assert params == PARAMS_BASE
+
+
+def test_make_feature_object_wide_matches_pivot() -> None:
+    """Check that wide matrix data gives the same result as the pivoted long-format data."""
+    matrix = read_json_file("matrix.json")
+    long_df = columns_to_r_dataframe(
+        convert_matrix_columnar(matrix, layout=LONG, include_id=True)[COLS]
+    )
+    wide_df = columns_to_r_dataframe(convert_matrix_columnar(matrix, layout=WIDE)[COLS])
+
+    pivoted_df = baseR.as_data_frame(qsip2.pivot_kbase_amplicon_matrix(long_df))
+    assert list(pivoted_df.colnames) == list(wide_df.colnames)
+    assert baseR.isTRUE(baseR.all_equal(pivoted_df, wide_df, check_attributes=False))[0]
+
+    params = {"F_type": "counts"}
+    for feature_df in [long_df, wide_df]:
+        feature_object = make_feature_object(feature_df, params)
+        classes = list(robjects.r["class"](feature_object))
+        assert any("qsip_feature_data" in c for c in classes)
+
+
+def test_make_feature_object_sparse() -> None:
+    """Check that the non-zero matrix cells give the same wide data as the full matrix."""
+    matrix = read_json_file("matrix.json")
+    sparse_df = columns_to_r_dataframe(
+        convert_matrix_columnar(matrix, layout=LONG, drop_zeros=True)[COLS]
+    )
+    wide_df = columns_to_r_dataframe(convert_matrix_columnar(matrix, layout=WIDE)[COLS])
+
+    rebuilt_df = sparse_to_wide(sparse_df)
+    assert list(rebuilt_df.colnames) == list(wide_df.colnames)
+    assert baseR.isTRUE(baseR.all_equal(rebuilt_df, wide_df, check_attributes=False))[0]
+
+    feature_object = make_feature_object(sparse_df, {"F_type": "counts"})
+    classes = list(robjects.r["class"](feature_object))
+    assert any("qsip_feature_data" in c for c in classes)
+
+
+@pytest.mark.parametrize(
+    "params",
+    paramify(
+        [
+            {"input": [1000, 1], "output": [1000], "id": "one_chunk"},
+            {"input": [1000, 3], "output": [334, 333, 333], "id": "uneven"},
+            {"input": [1000, 4], "output": [250, 250, 250, 250], "id": "even"},
+            {"input": [2, 4], "output": [1, 1], "id": "more_chunks_than_resamples"},
+        ]
+    ),
+)
+def test_split_resamples(params: dict[str, Any]) -> None:
+    """Check that resamples are split into chunks correctly."""
+    assert split_resamples(*params["input"]) == params["output"]
+
+
+def test_chunk_seeds() -> None:
+    """Chunk seeds are deterministic, distinct, and valid R seeds."""
+    n_chunks = 8
+    seeds = chunk_seeds(14, n_chunks)
+    assert seeds == chunk_seeds(14, n_chunks)
+    assert len(set(seeds)) == n_chunks
+    assert all(0 <= seed < 2**31 for seed in seeds)
+    assert seeds != chunk_seeds(15, n_chunks)
+
+
+def test_plot_jobs() -> None:
+    """One EAF plot is drawn per confidence level in batch mode."""
+    params = {"confidence": 0.9, "resample_success": 0.8, "groups": "time"}
+    assert [name for name, _ in plot_jobs(params)] == [
+        "plot_source_wads",
+        "plot_filter_results",
+        "plot_EAF_results",
+    ]
+
+    batch_jobs = plot_jobs({**params, "confidence": [0.8, 0.95]})
+    assert [kwargs.get("file_name") for _, kwargs in batch_jobs] == [
+        None,
+        None,
+        "EAF_plot_0.8_0.8.png",
+        "EAF_plot_0.95_0.8.png",
+    ]
+    assert [kwargs["params"]["confidence"] for _, kwargs in batch_jobs[2:]] == [
+        0.8,
+        0.95,
+    ]
+
+    # resample_success defaults to DEFAULT_RESAMPLE_SUCCESS if it is not set
+    unset_jobs = plot_jobs({"confidence": [0.8, 0.95], "groups": "time"})
+    assert [kwargs.get("file_name") for _, kwargs in unset_jobs[2:]] == [
+        f"EAF_plot_0.8_{DEFAULT_RESAMPLE_SUCCESS:g}.png",
+        f"EAF_plot_0.95_{DEFAULT_RESAMPLE_SUCCESS:g}.png",
+    ]
+    assert [kwargs["params"]["resample_success"] for _, kwargs in unset_jobs[2:]] == [
+        DEFAULT_RESAMPLE_SUCCESS
+    ] * 2
+    single_job = plot_jobs({"confidence": 0.9})[-1]
+    assert single_job[1]["params"]["resample_success"] == DEFAULT_RESAMPLE_SUCCESS
+
+
+def test_merge_resamples() -> None:
+    """Resamples run in two chunks give a complete set of resamples for qSIP2."""
+    qsip_object = data(qsip2).fetch("example_qsip_object")["example_qsip_object"]
+    resamples = 10
+    params = {"resamples": resamples, "confidence": 0.9}
+    qsip_object = run_feature_filter(qsip_object, params)
+
+    chunk_sizes = [4, 6]
+    chunks = robjects.vectors.ListVector.from_length(len(chunk_sizes))
+    for i, (size, seed) in enumerate(zip(chunk_sizes, chunk_seeds(14, 2), strict=True)):
+        chunks[i] = r_get_resamples(
+            qsip2.run_resampling(
+                qsip_object,
+                resamples=size,
+                with_seed=seed,
+                allow_failures=True,
+                progress=False,
+            )
+        )
+    merged = merge_resamples(chunks, robjects.IntVector(chunk_sizes), resamples, 14)
+    for resample_type in ["u", "l"]:
+        resample_list = merged.rx2(resample_type)
+        assert len(resample_list) == resamples
+        assert [
+            set(robjects.r["unique"](df.rx2("resample"))) for df in resample_list
+        ] == [{i} for i in range(1, resamples + 1)]
+
+    merged_summary = summarize_EAF_values(
+        run_EAF_calculations(r_set_resamples(qsip_object, merged), params), params
+    )
+    single_summary = summarize_EAF_values(
+        run_EAF_calculations(run_resampling(qsip_object, params), params), params
+    )
+    for column in ["labeled_resamples", "unlabeled_resamples"]:
+        assert (merged_summary[column] <= resamples).all()
+        assert merged_summary[column].max() == resamples
+    assert list(merged_summary["feature_id"]) == list(single_summary["feature_id"])
+    np.testing.assert_allclose(
+        merged_summary["observed_EAF"], single_summary["observed_EAF"]
+    )
+
+
+def test_eaf_resamples() -> None:
+    """The per-resample EAF values are returned as a DataFrame."""
+    qsip_object = data(qsip2).fetch("example_qsip_object")["example_qsip_object"]
+    params = {"resamples": 10}
+    qsip_object = run_resampling(run_feature_filter(qsip_object, params), params)
+    resampled = EAF_resamples(run_EAF_calculations(qsip_object, params))
+    assert isinstance(resampled, DataFrame)
+    assert {"feature_id", "resample", "EAF"} <= set(resampled.columns)
+    assert set(resampled["resample"]) == set(range(1, 11))
+
+
+def test_eaf_page_jobs() -> None:
+    """The main plot and the first pages are drawn in paged mode."""
+    summary = DataFrame(
+        {
+            "feature_id": [f"f{i}" for i in range(25)],
+            "observed_EAF": [i / 100 for i in range(25)],
+            "lower": [i / 100 - 0.05 for i in range(25)],
+            "upper": [i / 100 + 0.05 for i in range(25)],
+        }
+    )
+    eaf_pages = paginate(
+        summary,
+        {},
+        PageOptions(top_n=5, page_size=8, max_pages=2, significant_only=False),
+    )
+    jobs = plot_jobs({"confidence": [0.8, 0.9]}, eaf_pages)
+    assert [kwargs["file_name"] for _, kwargs in eaf_page_jobs(eaf_pages)] == [
+        kwargs["file_name"] for _, kwargs in jobs[2:]
+    ]
+    assert list(jobs[3][1]["eaf_summary"]["feature_id"]) == [
+        f"f{i}" for i in range(19, 11, -1)
+    ]
+    assert [
+        (name, kwargs["file_name"], kwargs["title"]) for name, kwargs in jobs[2:]
+    ] == [
+        ("plot_EAF_page", "eaf_viewer/EAF_plot_top.png", "Top 5 features by EAF"),
+        (
+            "plot_EAF_page",
+            "eaf_viewer/EAF_plot_page_0001.png",
+            "EAF page 1: features 1-8",
+        ),
+        (
+            "plot_EAF_page",
+            "eaf_viewer/EAF_plot_page_0002.png",
+            "EAF page 2: features 9-16",
+        ),
+    ]
+
+
+def test_render_plots_parallel(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Plots rendered in worker processes match those rendered serially."""
+    # use the worker pool however small the qsip object is
+    monkeypatch.setattr("kb_qsip.utils.helpers.PLOT_POOL_MIN_BYTES", 0)
+    qsip_object = data(qsip2).fetch("example_qsip_object")["example_qsip_object"]
+    params = {"confidence": 0.9, "resample_success": 0.8, "groups": "Moisture"}
+    qsip_object = run_resampling(
+        run_feature_filter(qsip_object, params), {"resamples": 10}
+    )
+    qsip_object = run_EAF_calculations(qsip_object, params)
+
+    called = []
+    rendered = {}
+    for n_workers in [1, 3]:
+        output_directory = tmp_path / str(n_workers)
+        output_directory.mkdir()
+        rendered[n_workers] = render_plots(
+            qsip_object,
+            str(output_directory),
+            params,
+            n_workers=n_workers,
+            while_rendering=lambda: called.append(True),
+        )
+        assert sorted(os.listdir(output_directory)) == [
+            "EAF_plot.png",
+            "filter_results.png",
+            "source_wads.png",
+        ]
+        # no temporary copy of the qsip object is left behind
+        assert sorted(os.listdir(tmp_path)) == [str(n) for n in rendered]
+
+    assert called == [True, True]
+    for n_workers in rendered:
+        assert [report["name"] for report, _ in rendered[n_workers]] == [
+            "source_wads.png",
+            "filter_results.png",
+            "EAF_plot.png",
+        ]
+        assert all(elapsed > 0 for _, elapsed in rendered[n_workers])
+
+
+def test_render_plots_small_object(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Small qsip objects are drawn in this process, without a copy of the object."""
+    qsip_object = data(qsip2).fetch("example_qsip_object")["example_qsip_object"]
+    params = {"confidence": 0.9, "resample_success": 0.8, "groups": "Moisture"}
+    qsip_object = run_EAF_calculations(
+        run_resampling(run_feature_filter(qsip_object, params), {"resamples": 10}),
+        params,
+    )
+
+    def no_pool(*_args: object, **_kwargs: object) -> None:
+        pytest.fail("the worker pool should not be used")
+
+    monkeypatch.setattr("kb_qsip.utils.helpers.PLOT_POOL_MIN_BYTES", 1024**4)
+    monkeypatch.setattr("kb_qsip.utils.helpers.ProcessPoolExecutor", no_pool)
+    output_directory = tmp_path / "output"
+    output_directory.mkdir()
+    rendered = render_plots(qsip_object, str(output_directory), params, n_workers=3)
+    assert len(rendered) == len(plot_jobs(params))
+    assert sorted(os.listdir(tmp_path)) == ["output"]
+
+
+def test_render_plots_copy_removed(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The temporary copy of the qsip object is removed if it cannot be written."""
+    qsip_object = data(qsip2).fetch("example_qsip_object")["example_qsip_object"]
+    params = {"confidence": 0.9, "resample_success": 0.8, "groups": "Moisture"}
+
+    class FailingBase:
+        """Stand-in for the R base package whose saveRDS fails part way."""
+
+        @staticmethod
+        def saveRDS(_value: object, file: str) -> None:  # noqa: N802
+            with open(file, "w") as fh:
+                fh.write("partial")
+            err_msg = "disk full"
+            raise RuntimeError(err_msg)
+
+    monkeypatch.setattr("kb_qsip.utils.helpers.PLOT_POOL_MIN_BYTES", 0)
+    monkeypatch.setattr("kb_qsip.utils.helpers.baseR", FailingBase)
+    output_directory = tmp_path / "output"
+    output_directory.mkdir()
+    with pytest.raises(RuntimeError, match="disk full"):
+        render_plots(qsip_object, str(output_directory), params, n_workers=3)
+    assert sorted(os.listdir(tmp_path)) == ["output"]
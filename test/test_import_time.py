@@ -0,0 +1,50 @@
+"""Check that the server entry points can be imported without starting R."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# upper limit on the cumulative import time of the module, in microseconds
+MAX_IMPORT_TIME_US = 500_000
+# modules that must not be imported until a job is run
+HEAVY_MODULES = ["rpy2", "pandas", "numpy", "kb_qsip.utils.qsip_util"]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Import a module in a fresh interpreter with `-X importtime`.
+
+    :param module: name of the module to import
+    :type module: str
+    :return: cumulative import time in microseconds, indexed by module name
+    :rtype: dict[str, int]
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],  # noqa: S603
+        capture_output=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["kb_qsip.kb_qsipImpl"])
+def test_import_time(module: str) -> None:
+    """The impl module imports quickly, without loading rpy2, pandas or numpy."""
+    times = import_times(module)
+    loaded = [
+        name
+        for name in times
+        for heavy in HEAVY_MODULES
+        if name == heavy or name.startswith(f"{heavy}.")
+    ]
+    assert loaded == []
+    assert times[module] < MAX_IMPORT_TIME_US
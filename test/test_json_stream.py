@@ -0,0 +1,145 @@
+"""Tests for incremental decoding of workspace responses."""
+
+import io
+import json
+from typing import Any
+
+import numpy as np
+import pytest
+from combinatrix.json_stream import MatrixValuesBuilder, parse_get_objects2
+
+
+def make_response(*objects: dict[str, Any]) -> dict[str, Any]:
+    """Wrap workspace objects in a get_objects2 JSON-RPC response."""
+    return {"version": "1.1", "result": [{"data": list(objects)}]}
+
+
+def make_matrix_object(matrix: dict[str, Any]) -> dict[str, Any]:
+    """Create a matrix workspace object."""
+    return {
+        "infostruct": {
+            "wsid": 1,
+            "objid": 2,
+            "version": 3,
+            "type": "KBaseMatrices.AmpliconMatrix-1.0",
+        },
+        "data": {"scale": "raw", "data": matrix},
+    }
+
+
+def parse(response: dict[str, Any]) -> dict[str, Any]:
+    """Serialise a response and parse it with the streaming parser."""
+    return parse_get_objects2(io.BytesIO(json.dumps(response).encode()))
+
+
+SAMPLESET = {
+    "infostruct": {
+        "wsid": 1,
+        "objid": 1,
+        "version": 1,
+        "type": "KBaseSets.SampleSet-2.0",
+    },
+    "data": {"samples": [{"id": "abc", "version": 1, "name": "s1"}], "description": ""},
+}
+
+MATRIX = {
+    "col_ids": ["A", "B", "C"],
+    "row_ids": ["X", "Y"],
+    "values": [[1, 2.5, None], [0, 4, 5]],
+}
+
+
+def test_parse_get_objects2() -> None:
+    """Matrix values are decoded into arrays; everything else is unchanged."""
+    response = make_response(SAMPLESET, make_matrix_object(MATRIX))
+    output = parse(response)
+
+    values = output["result"][0]["data"][1]["data"]["data"]["values"]
+    assert isinstance(values, np.ndarray)
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, [[1, 2.5, np.nan], [0, 4, 5]])
+
+    # apart from the values, the output matches the plain JSON decoder
+    output["result"][0]["data"][1]["data"]["data"]["values"] = MATRIX["values"]
+    assert output == response
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param(
+            {"matrix": {"values": [[1, 2], [3, 4]], "col_ids": ["A", "B"]}},
+            id="values_before_ids",
+        ),
+        pytest.param(
+            {
+                "matrix": {
+                    "row_ids": ["X"],
+                    "col_ids": ["A", "B"],
+                    "values": [[1, 2], [3, 4]],
+                }
+            },
+            id="more_rows_than_ids",
+        ),
+        pytest.param(
+            {
+                "matrix": {
+                    "row_ids": ["X", "Y", "Z"],
+                    "col_ids": ["A"],
+                    "values": [[1, 2], [3, 4]],
+                }
+            },
+            id="row_length_mismatch",
+        ),
+    ],
+)
+def test_parse_get_objects2_unexpected_shape(param: dict[str, Any]) -> None:
+    """Matrices that do not match their IDs still decode to arrays of the actual shape."""
+    output = parse(make_response(make_matrix_object(param["matrix"])))
+    values = output["result"][0]["data"][0]["data"]["data"]["values"]
+    assert isinstance(values, np.ndarray)
+    np.testing.assert_array_equal(values, [[1, 2], [3, 4]])
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        pytest.param([], id="empty"),
+        pytest.param([[1, 2], [3]], id="ragged"),
+    ],
+)
+def test_parse_get_objects2_lists(values: list[Any]) -> None:
+    """Values that cannot be an array are left as lists for the converter to report on."""
+    matrix = {"row_ids": ["X", "Y"], "col_ids": ["A", "B"], "values": values}
+    output = parse(make_response(make_matrix_object(matrix)))
+    assert output["result"][0]["data"][0]["data"]["data"]["values"] == values
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        pytest.param([["1", "2"]], id="strings"),
+        pytest.param([1, 2], id="one_dimensional"),
+        pytest.param([[[1], [2]]], id="three_dimensional"),
+    ],
+)
+def test_parse_get_objects2_fail(values: list[Any]) -> None:
+    """Matrix values must be a 2D array of numbers."""
+    matrix = {"row_ids": ["X"], "col_ids": ["A", "B"], "values": values}
+    with pytest.raises(
+        ValueError,
+        match="'data.data.values' must be a two-dimensional array of numbers",
+    ):
+        parse(make_response(make_matrix_object(matrix)))
+
+
+def test_matrix_values_builder_preallocates() -> None:
+    """The array is allocated once and filled in place when the shape is known."""
+    builder = MatrixValuesBuilder(2, 2)
+    array = builder.array
+    for row in [[1, 2], [3, None]]:
+        builder.row.extend(row)
+        builder.add_row()
+    values = builder.build()
+    assert values is array
+    np.testing.assert_array_equal(values, [[1, 2], [3, np.nan]])
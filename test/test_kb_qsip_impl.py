@@ -1,7 +1,9 @@
 """Main impl file tests."""
 
+import sys
 from typing import Any
 
+import pytest
 from kb_qsip.kb_qsipImpl import kb_qsip
 
 PARAMS = {
@@ -40,3 +42,13 @@ def test_run_kb_qsip(config: dict[str, Any], context: dict[str, Any]) -> None:
     qsip_app = kb_qsip(config)
     output = qsip_app.run_kb_qsip(context, PARAMS)
     assert output == {}
+
+
+def test_run_kb_qsip_invalid_params(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Invalid params fail the job before R is started."""
+    monkeypatch.setenv("SDK_CALLBACK_URL", "http://localhost")
+    monkeypatch.delitem(sys.modules, "kb_qsip.utils.qsip_util", raising=False)
+    qsip_app = kb_qsip({})
+    with pytest.raises(ValueError, match="Invalid resamples 'lots'"):
+        qsip_app.run_kb_qsip({}, {**PARAMS, "resamples": "lots"})
+    assert "kb_qsip.utils.qsip_util" not in sys.modules
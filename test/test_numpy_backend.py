@@ -0,0 +1,797 @@
+"""Tests for the NumPy implementation of the qSIP2 calculations."""
+
+from test.conftest import PARAMS_BASE
+from types import ModuleType
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+from combinatrix.constants import COLS, DL, LONG, WIDE
+from combinatrix.converter import convert_matrix_columnar
+from kb_qsip.utils.app_params import CONFIDENCE_COLUMN
+from kb_qsip.utils.numpy_backend import (
+    DEFAULT_FILTER_THRESHOLDS,
+    ISOTOPE_CONSTANTS,
+    LABELED,
+    SUMMARY_COLUMNS,
+    UNLABELED,
+    SparseMatrix,
+    calculate_eaf,
+    calculate_wads,
+    check_filter_params,
+    count_fractions,
+    filter_features,
+    map_samples_to_sources,
+    prefilter_features,
+    resample_wads,
+    run_eaf_pipeline,
+    run_from_converted,
+    source_isotopes,
+    sparse_from_columns,
+    summarize_eaf,
+)
+
+PARAMS = {
+    "M_isotope": "isotope",
+    "S_source_mat_id": "source",
+    "S_gradient_pos_density": "density",
+    "S_gradient_pos_amt": "amt",
+    "S_gradient_pos_rel_amt": "amt",
+    "calculate_gradient_pos_rel_amt": 1,
+    "F_type": "counts",
+    "resamples": 100,
+    "confidence": 0.9,
+}
+
+SOURCE_DF = pd.DataFrame(
+    {
+        "name": ["S1", "S2", "S3", "S4"],
+        "isotope": ["16O", "16O", "18O", "18O"],
+    }
+)
+
+# three fractions per source
+SAMPLE_DF = pd.DataFrame(
+    {
+        "name": [f"{src}.{i}" for src in SOURCE_DF["name"] for i in range(1, 4)],
+        "source": [src for src in SOURCE_DF["name"] for _ in range(3)],
+        "density": [1.70, 1.72, 1.74] * 2 + [1.71, 1.73, 1.75] * 2,
+        "amt": [1.0, 2.0, 1.0] * 4,
+    }
+)
+
+FEATURE_IDS = ["ASV_1", "ASV_2", "ASV_3"]
+VALUES = np.array(
+    [
+        # ASV_1: present everywhere
+        [10, 20, 10] * 4,
+        # ASV_2: only in the unlabeled sources
+        [5, 5, 5] * 2 + [0, 0, 0] * 2,
+        # ASV_3: in one fraction of S1 and S3
+        [1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0],
+    ]
+)
+
+
+@pytest.fixture(name="mapping")
+def mapping_fixture() -> dict[str, Any]:
+    """Map the samples to the sources for the test dataset."""
+    return map_samples_to_sources(SOURCE_DF, SAMPLE_DF, list(SAMPLE_DF["name"]), PARAMS)
+
+
+def test_map_samples_to_sources(mapping: dict[str, Any]) -> None:
+    """Check that the sample metadata is lined up with the matrix columns."""
+    assert list(mapping["source_ids"]) == ["S1", "S2", "S3", "S4"]
+    assert list(mapping["source_isotopes"]) == ["16O", "16O", "18O", "18O"]
+    assert list(mapping["sample_source"]) == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3]
+    np.testing.assert_allclose(mapping["rel_amt"], [0.25, 0.5, 0.25] * 4)
+
+    # the matrix columns do not have to be in the same order as the sample data
+    reordered = map_samples_to_sources(
+        SOURCE_DF,
+        SAMPLE_DF,
+        ["S4.3", "S1.1"],
+        {**PARAMS, "calculate_gradient_pos_rel_amt": 0},
+    )
+    assert list(reordered["sample_source"]) == [3, 0]
+    np.testing.assert_allclose(reordered["density"], [1.75, 1.70])
+    np.testing.assert_allclose(reordered["rel_amt"], [1.0, 1.0])
+
+    # as in make_sample_object, the relative amounts are calculated from the
+    # S_gradient_pos_rel_amt column, not from S_gradient_pos_amt
+    calculated = map_samples_to_sources(
+        SOURCE_DF,
+        SAMPLE_DF,
+        list(SAMPLE_DF["name"]),
+        {**PARAMS, "S_gradient_pos_amt": "density"},
+    )
+    np.testing.assert_allclose(calculated["rel_amt"], mapping["rel_amt"])
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param(
+            {
+                "sample_ids": ["S1.1", "S9.9"],
+                "sources": SOURCE_DF,
+                "err_msg": "Feature data samples not found in the sample data: S9.9",
+            },
+            id="missing_sample",
+        ),
+        pytest.param(
+            {
+                "sample_ids": ["S1.1", "S4.1"],
+                "sources": SOURCE_DF.iloc[:3],
+                "err_msg": "Sample data sources not found in the source data: S4",
+            },
+            id="missing_source",
+        ),
+    ],
+)
+def test_map_samples_to_sources_fail(param: dict[str, Any]) -> None:
+    """Samples and sources must all be present in the metadata."""
+    with pytest.raises(ValueError, match=param["err_msg"]):
+        map_samples_to_sources(param["sources"], SAMPLE_DF, param["sample_ids"], PARAMS)
+
+
+def test_source_isotopes() -> None:
+    """Sources labeled 'natural abundance' have the unlabeled isotope."""
+    assert list(source_isotopes(SOURCE_DF, PARAMS)) == ["16O", "16O", "18O", "18O"]
+    misip = SOURCE_DF.assign(
+        isotope="13C",
+        isotopolog_label=["natural abundance"] * 2 + ["isotopically labeled"] * 2,
+    )
+    assert list(source_isotopes(misip, PARAMS)) == ["12C", "12C", "13C", "13C"]
+
+
+@pytest.mark.parametrize(
+    ("params", "sample_df", "err_msg"),
+    [
+        (
+            {"labeled_isotope": "15N"},
+            SAMPLE_DF,
+            "No sources with the unlabeled isotope '14N' in the source data",
+        ),
+        (
+            {"min_labeled_fractions": 4},
+            SAMPLE_DF,
+            "min_labeled_sources is 1, but only 0 of the 2 labeled",
+        ),
+        (
+            {"M_isotope": "label"},
+            SAMPLE_DF,
+            "Isotope column 'label' not found in the source data",
+        ),
+        (
+            {},
+            SAMPLE_DF.drop(columns="source"),
+            "Source ID column 'source' not found in the sample data",
+        ),
+    ],
+)
+def test_check_filter_params_fail(
+    params: dict[str, Any], sample_df: pd.DataFrame, err_msg: str
+) -> None:
+    """The isotopes and thresholds are checked against the source and sample data."""
+    check_filter_params(SOURCE_DF, SAMPLE_DF, PARAMS)
+    with pytest.raises(ValueError, match=err_msg):
+        check_filter_params(SOURCE_DF, sample_df, {**PARAMS, **params})
+
+
+def test_run_eaf_pipeline_infeasible_filter() -> None:
+    """The pipeline fails if no feature could pass the filter."""
+    with pytest.raises(ValueError, match="min_unlabeled_sources is 3"):
+        run_eaf_pipeline(
+            VALUES,
+            FEATURE_IDS,
+            list(SAMPLE_DF["name"]),
+            SOURCE_DF,
+            SAMPLE_DF,
+            {**PARAMS, "min_unlabeled_sources": 3},
+        )
+
+
+def test_calculate_wads(mapping: dict[str, Any]) -> None:
+    """Check the WAD calculation against a manual calculation."""
+    wads, n_fractions = calculate_wads(
+        VALUES, mapping["sample_source"], mapping["density"], mapping["rel_amt"], 4
+    )
+    assert wads.shape == (3, 4)
+    np.testing.assert_array_equal(
+        n_fractions, [[3, 3, 3, 3], [3, 3, 0, 0], [1, 0, 1, 0]]
+    )
+
+    # S1, ASV_1: relative abundances 10/16, 20/25, 10/15, weighted by relative amounts
+    tube_rel_abundance = np.array([10 / 16 * 0.25, 20 / 25 * 0.5, 10 / 15 * 0.25])
+    expected = (
+        np.sum(tube_rel_abundance * [1.70, 1.72, 1.74]) / tube_rel_abundance.sum()
+    )
+    assert wads[0, 0] == pytest.approx(expected)
+    # features absent from a source have no WAD
+    assert np.isnan(wads[1, 2:]).all()
+    # ASV_3 is only in one fraction of S1 and S3
+    assert wads[2, 0] == pytest.approx(1.70)
+    assert wads[2, 2] == pytest.approx(1.75)
+
+
+def test_calculate_wads_relative(mapping: dict[str, Any]) -> None:
+    """Relative abundance data is not renormalised."""
+    relative = VALUES / VALUES.sum(axis=0)
+    wads_counts, _ = calculate_wads(
+        VALUES, mapping["sample_source"], mapping["density"], mapping["rel_amt"], 4
+    )
+    wads_relative, _ = calculate_wads(
+        relative,
+        mapping["sample_source"],
+        mapping["density"],
+        mapping["rel_amt"],
+        4,
+        "relative",
+    )
+    np.testing.assert_allclose(wads_counts, wads_relative)
+
+
+def to_sparse(values: np.ndarray) -> SparseMatrix:
+    """Store the non-zero cells of a matrix in COO form."""
+    rows, cols = np.nonzero(values)
+    return SparseMatrix(rows, cols, values[rows, cols].astype(float), values.shape)
+
+
+@pytest.mark.parametrize("feature_type", ["counts", "relative"])
+def test_calculate_wads_sparse(mapping: dict[str, Any], feature_type: str) -> None:
+    """A sparse matrix gives the same WADs as the dense one."""
+    args = (mapping["sample_source"], mapping["density"], mapping["rel_amt"], 4)
+    wads, n_fractions = calculate_wads(VALUES, *args, feature_type)
+    sparse_wads, sparse_n_fractions = calculate_wads(
+        to_sparse(VALUES), *args, feature_type
+    )
+    np.testing.assert_allclose(sparse_wads, wads)
+    np.testing.assert_array_equal(sparse_n_fractions, n_fractions)
+
+
+def test_run_from_converted_sparse() -> None:
+    """Long-layout matrix data without zero cells gives the same summary."""
+    sample_ids = list(SAMPLE_DF["name"])
+    matrix = {
+        "data": {
+            "data": {
+                "row_ids": FEATURE_IDS,
+                "col_ids": sample_ids,
+                "values": VALUES.tolist(),
+            }
+        }
+    }
+    converted = {
+        "1/1/1": {DL: SOURCE_DF.to_dict("records")},
+        "2/2/2": {DL: SAMPLE_DF.to_dict("records")},
+        "3/3/3": convert_matrix_columnar(matrix, drop_zeros=True),
+    }
+    params = {
+        **PARAMS,
+        "source_data": "1/1/1",
+        "sample_data": "2/2/2",
+        "feature_data": "3/3/3",
+    }
+    sparse, feature_ids, column_ids = sparse_from_columns(converted["3/3/3"][COLS])
+    assert sparse.shape == VALUES.shape
+    assert len(sparse.values) == np.count_nonzero(VALUES)
+    assert (feature_ids, column_ids) == (FEATURE_IDS, sample_ids)
+
+    pd.testing.assert_frame_equal(
+        run_from_converted(converted, params),
+        run_eaf_pipeline(VALUES, FEATURE_IDS, sample_ids, SOURCE_DF, SAMPLE_DF, PARAMS),
+    )
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param({"thresholds": None, "keep": [True, False, True]}, id="defaults"),
+        pytest.param(
+            {"thresholds": {"min_unlabeled_sources": 2}, "keep": [True, False, False]},
+            id="two_unlabeled_sources",
+        ),
+        pytest.param(
+            {"thresholds": {"min_labeled_fractions": 2}, "keep": [True, False, False]},
+            id="two_labeled_fractions",
+        ),
+        pytest.param(
+            {"thresholds": {"min_labeled_sources": 0}, "keep": [True, True, True]},
+            id="no_labeled_sources",
+        ),
+    ],
+)
+def test_filter_features(mapping: dict[str, Any], param: dict[str, Any]) -> None:
+    """Check that features are filtered on the number of sources and fractions."""
+    wads, n_fractions = calculate_wads(
+        VALUES, mapping["sample_source"], mapping["density"], mapping["rel_amt"], 4
+    )
+    unlabeled = np.array([True, True, False, False])
+    keep, filtered_wads = filter_features(
+        wads, n_fractions, unlabeled, ~unlabeled, param["thresholds"]
+    )
+    assert list(keep) == param["keep"]
+    min_fractions = {
+        **DEFAULT_FILTER_THRESHOLDS,
+        **(param["thresholds"] or {}),
+    }
+    expected_nan = np.isnan(wads)
+    expected_nan[:, unlabeled] |= (
+        n_fractions[:, unlabeled] < min_fractions["min_unlabeled_fractions"]
+    )
+    expected_nan[:, ~unlabeled] |= (
+        n_fractions[:, ~unlabeled] < min_fractions["min_labeled_fractions"]
+    )
+    np.testing.assert_array_equal(np.isnan(filtered_wads), expected_nan)
+
+
+def test_filter_features_fractions() -> None:
+    """Sources where a feature is in too few fractions are removed."""
+    wads = np.array([[1.7, 1.71, 1.72, 1.73]])
+    n_fractions = np.array([[3, 1, 3, 3]])
+    unlabeled = np.array([True, True, False, False])
+    keep, filtered_wads = filter_features(
+        wads, n_fractions, unlabeled, ~unlabeled, {"min_unlabeled_fractions": 2}
+    )
+    assert list(keep) == [True]
+    np.testing.assert_array_equal(filtered_wads, [[1.7, np.nan, 1.72, 1.73]])
+
+
+def test_count_fractions(mapping: dict[str, Any]) -> None:
+    """The fractions with non-zero abundances are counted for each source."""
+    _, n_fractions = calculate_wads(
+        VALUES, mapping["sample_source"], mapping["density"], mapping["rel_amt"], 4
+    )
+    np.testing.assert_array_equal(
+        count_fractions(VALUES, mapping["sample_source"], 4), n_fractions
+    )
+    np.testing.assert_array_equal(
+        count_fractions(to_sparse(VALUES), mapping["sample_source"], 4), n_fractions
+    )
+
+
+def make_feature_data(layout: str) -> dict[str, Any]:
+    """Convert the test feature matrix, without zero cells in the long layout."""
+    matrix = {
+        "data": {
+            "data": {
+                "row_ids": FEATURE_IDS,
+                "col_ids": list(SAMPLE_DF["name"]),
+                "values": VALUES.tolist(),
+            }
+        }
+    }
+    options = {"drop_zeros": True} if layout == LONG else {}
+    return convert_matrix_columnar(matrix, layout=layout, **options)[COLS]
+
+
+@pytest.mark.parametrize("layout", [LONG, WIDE])
+@pytest.mark.parametrize(
+    ("thresholds", "kept"),
+    [
+        ({}, ["ASV_1", "ASV_3"]),
+        ({"min_labeled_fractions": 2}, ["ASV_1"]),
+    ],
+)
+def test_prefilter_features(
+    layout: str, thresholds: dict[str, int], kept: list[str]
+) -> None:
+    """Only features that can pass the filter are kept, as relative abundances."""
+    params = {**PARAMS, **thresholds}
+    filtered = prefilter_features(
+        make_feature_data(layout), SOURCE_DF, SAMPLE_DF, params
+    )
+    if layout == LONG:
+        values, feature_ids, sample_ids = sparse_from_columns(filtered)
+    else:
+        feature_ids = list(filtered.pop("row_id"))
+        sample_ids = list(filtered)
+        values = np.column_stack(list(filtered.values()))
+    assert feature_ids == kept
+    assert sample_ids == list(SAMPLE_DF["name"])
+
+    # the WADs, and so the EAFs, are unchanged
+    summary = run_eaf_pipeline(
+        values,
+        feature_ids,
+        sample_ids,
+        SOURCE_DF,
+        SAMPLE_DF,
+        {**params, "F_type": "relative"},
+    )
+    pd.testing.assert_frame_equal(
+        summary,
+        run_eaf_pipeline(VALUES, FEATURE_IDS, sample_ids, SOURCE_DF, SAMPLE_DF, params),
+    )
+
+
+def test_resample_wads() -> None:
+    """Check the resampled WADs are drawn from the valid WADs of each feature."""
+    wads = np.array(
+        [
+            [1.70, 1.72, np.nan],
+            [1.71, np.nan, np.nan],
+            [np.nan, np.nan, np.nan],
+        ]
+    )
+    rng = np.random.default_rng(14)
+    resampled = resample_wads(wads, 500, rng)
+    assert resampled.shape == (3, 500)
+    # means of two draws from {1.70, 1.72}
+    assert set(np.round(resampled[0], 6)) == {1.70, 1.71, 1.72}
+    np.testing.assert_allclose(resampled[1], 1.71)
+    assert np.isnan(resampled[2]).all()
+
+    # reproducible with the same seed
+    np.testing.assert_array_equal(
+        resampled, resample_wads(wads, 500, np.random.default_rng(14))
+    )
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 64, 1000])
+def test_resample_wads_block_size(block_size: int) -> None:
+    """The results do not depend on the number of features resampled at once."""
+    rng = np.random.default_rng(1)
+    wads = rng.normal(1.7, 0.01, size=(100, 6))
+    missing = 0.3
+    wads[rng.random(wads.shape) < missing] = np.nan
+
+    expected = resample_wads(wads, 50, np.random.default_rng(14), block_size=100)
+    np.testing.assert_array_equal(
+        resample_wads(wads, 50, np.random.default_rng(14), block_size=block_size),
+        expected,
+    )
+    # the mean of the resampled means is close to the mean of the valid WADs
+    with np.errstate(invalid="ignore"):
+        np.testing.assert_allclose(
+            np.nanmean(expected, axis=1), np.nanmean(wads, axis=1), atol=0.005
+        )
+
+
+def test_resample_wads_fail() -> None:
+    """The block size must be positive."""
+    with pytest.raises(ValueError, match="Invalid resampling block size 0"):
+        resample_wads(np.ones((2, 2)), 10, np.random.default_rng(14), block_size=0)
+
+
+@pytest.mark.parametrize("isotope", list(ISOTOPE_CONSTANTS))
+def test_calculate_eaf(isotope: str) -> None:
+    """Check the EAF values at the ends of the scale."""
+    unlabeled_wad = np.array([1.70, 1.72])
+    # no difference in WAD: no enrichment
+    np.testing.assert_allclose(calculate_eaf(unlabeled_wad, unlabeled_wad, isotope), 0)
+
+    # fully labeled DNA
+    constants = ISOTOPE_CONSTANTS[isotope]
+    gc_content = (unlabeled_wad - 1.646057) / 0.083506
+    mw = 0.496 * gc_content + 307.691
+    mw_max = mw + constants["slope"] * gc_content + constants["intercept"]
+    labeled_wad = unlabeled_wad * mw_max / mw
+    np.testing.assert_allclose(
+        calculate_eaf(unlabeled_wad, labeled_wad, isotope),
+        1 - constants["natural_abundance"],
+    )
+
+
+def test_calculate_eaf_fail() -> None:
+    """The labeled isotope must be known."""
+    with pytest.raises(ValueError, match="Unknown isotope '2H'"):
+        calculate_eaf(np.array([1.7]), np.array([1.71]), "2H")
+
+
+def test_summarize_eaf() -> None:
+    """Check the EAF summary statistics."""
+    resampled = np.array([np.linspace(0, 1, 101), np.full(101, np.nan)])
+    summary = summarize_eaf(
+        np.array(["ASV_1", "ASV_2"]),
+        np.array([0.5, 0.1]),
+        resampled,
+        {UNLABELED: np.array([101, 0]), LABELED: np.array([101, 0])},
+        0.9,
+    )
+    assert list(summary.columns) == SUMMARY_COLUMNS
+    assert summary.loc[0, "mean_resampled_EAF"] == pytest.approx(0.5)
+    assert summary.loc[0, "lower"] == pytest.approx(0.05)
+    assert summary.loc[0, "upper"] == pytest.approx(0.95)
+    assert summary.loc[1, ["mean_resampled_EAF", "lower", "upper"]].isna().all()
+    assert list(summary["labeled_resamples"]) == [101, 0]
+
+
+def test_summarize_eaf_batch() -> None:
+    """Summaries for several confidence levels are combined into one long table."""
+    args = (
+        np.array(["ASV_1", "ASV_2"]),
+        np.array([0.5, 0.1]),
+        np.array([np.linspace(0, 1, 101), np.full(101, np.nan)]),
+        {UNLABELED: np.array([101, 0]), LABELED: np.array([101, 0])},
+    )
+    levels = [0.8, 0.9, 0.95]
+    summary = summarize_eaf(*args, levels)
+    assert list(summary.columns) == [
+        SUMMARY_COLUMNS[0],
+        CONFIDENCE_COLUMN,
+        *SUMMARY_COLUMNS[1:],
+    ]
+    assert list(summary[CONFIDENCE_COLUMN]) == [0.8, 0.8, 0.9, 0.9, 0.95, 0.95]
+    for level in levels:
+        pd.testing.assert_frame_equal(
+            summary[summary[CONFIDENCE_COLUMN] == level]
+            .drop(columns=CONFIDENCE_COLUMN)
+            .reset_index(drop=True),
+            summarize_eaf(*args, level),
+        )
+    assert summary.loc[4, "lower"] == pytest.approx(0.025)
+
+
+def test_run_eaf_pipeline() -> None:
+    """Run the whole calculation on the test dataset."""
+    summary = run_eaf_pipeline(
+        VALUES, FEATURE_IDS, list(SAMPLE_DF["name"]), SOURCE_DF, SAMPLE_DF, PARAMS
+    )
+    assert list(summary.columns) == SUMMARY_COLUMNS
+    # ASV_2 is not in any labeled sources
+    assert list(summary["feature_id"]) == ["ASV_1", "ASV_3"]
+    assert list(summary["labeled_resamples"]) == [100, 100]
+    assert summary["observed_EAF"].notna().all()
+
+    # results are reproducible
+    pd.testing.assert_frame_equal(
+        summary,
+        run_eaf_pipeline(
+            VALUES, FEATURE_IDS, list(SAMPLE_DF["name"]), SOURCE_DF, SAMPLE_DF, PARAMS
+        ),
+    )
+
+
+def test_run_eaf_pipeline_resamples() -> None:
+    """The per-resample EAF values match the summary."""
+    summary, resampled = run_eaf_pipeline(
+        VALUES,
+        FEATURE_IDS,
+        list(SAMPLE_DF["name"]),
+        SOURCE_DF,
+        SAMPLE_DF,
+        PARAMS,
+        return_resamples=True,
+    )
+    assert list(resampled.columns) == ["feature_id", "observed_EAF", "resample", "EAF"]
+    assert len(resampled) == 2 * PARAMS["resamples"]
+    grouped = resampled.groupby("feature_id", observed=True)
+    assert list(grouped["resample"].max()) == [100, 100]
+    np.testing.assert_allclose(grouped["EAF"].mean(), summary["mean_resampled_EAF"])
+    np.testing.assert_allclose(grouped["observed_EAF"].first(), summary["observed_EAF"])
+
+
+def example_qsip_object(
+    helpers: ModuleType,
+    r_dfs: dict[str, object],
+    feature_data: object,
+    params: dict[str, Any] = PARAMS_BASE,
+) -> object:
+    """Make a qsip object from the qSIP2 example source and sample data and the given feature data.
+
+    The relative DNA amounts are set up from the params as in `make_sample_object`.
+    """
+    sample_df = r_dfs["sample"]
+    rel_amt = params["S_gradient_pos_rel_amt"]
+    if params["calculate_gradient_pos_rel_amt"] == 1:
+        sample_df = helpers.qsip2.add_gradient_pos_rel_amt(
+            sample_df, source_mat_id="source", amt=rel_amt
+        )
+        rel_amt = "gradient_pos_rel_amt"
+    return helpers.qsip2.qsip_data(
+        helpers.qsip2.qsip_source_data(
+            r_dfs["source"],
+            isotope="Isotope",
+            source_mat_id="source",
+            isotopolog="isotopolog",
+        ),
+        helpers.qsip2.qsip_sample_data(
+            sample_df,
+            sample_id="sample",
+            source_mat_id="source",
+            gradient_position="Fraction",
+            gradient_pos_density="density_g_ml",
+            gradient_pos_amt=params["S_gradient_pos_amt"],
+            gradient_pos_rel_amt=rel_amt,
+        ),
+        feature_data,
+    )
+
+
+@pytest.mark.parametrize(
+    "extra_params",
+    [
+        pytest.param({}, id="default"),
+        # the relative amounts are calculated from S_gradient_pos_rel_amt, whatever
+        # the S_gradient_pos_amt column is
+        pytest.param(
+            {"calculate_gradient_pos_rel_amt": 1, "S_gradient_pos_amt": "Fraction"},
+            id="calculate_rel_amt",
+        ),
+    ],
+)
+def test_parity_with_qsip2(extra_params: dict[str, Any]) -> None:
+    """Compare the NumPy results with those from qSIP2 on the qSIP2 example data."""
+    pytest.importorskip("rpy2")
+    from kb_qsip.utils import helpers
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.packages import data
+
+    qsip2_data = data(helpers.qsip2)
+    r_dfs = {
+        src: qsip2_data.fetch(f"example_{src}_df")[f"example_{src}_df"]
+        for src in helpers.PARAM_NAMES
+    }
+    params = {**PARAMS_BASE, "resamples": 1000, **extra_params}
+
+    # qSIP2 pipeline
+    qsip_object = example_qsip_object(
+        helpers,
+        r_dfs,
+        helpers.qsip2.qsip_feature_data(
+            r_dfs["feature"], feature_id="ASV", type="counts"
+        ),
+        params,
+    )
+    qsip_object = helpers.run_feature_filter(qsip_object, params)
+    qsip_object = helpers.run_resampling(qsip_object, params)
+    qsip_object = helpers.run_EAF_calculations(qsip_object, params)
+    expected = helpers.summarize_EAF_values(qsip_object, params)
+
+    # NumPy pipeline
+    with (robjects.default_converter + pandas2ri.converter).context():
+        dfs = {
+            src: robjects.conversion.get_conversion().rpy2py(r_df)
+            for src, r_df in r_dfs.items()
+        }
+    feature_df = dfs["feature"].set_index("ASV")
+    summary = run_eaf_pipeline(
+        feature_df.to_numpy(),
+        feature_df.index.to_numpy(),
+        list(feature_df.columns),
+        dfs["source"],
+        dfs["sample"],
+        params,
+        source_id_col="source",
+        sample_id_col="sample",
+    )
+
+    expected = expected.set_index("feature_id").sort_index()
+    summary = summary.set_index("feature_id").sort_index()
+    assert list(summary.index) == list(expected.index)
+    np.testing.assert_allclose(
+        summary["observed_EAF"], expected["observed_EAF"], rtol=1e-6
+    )
+    # the resampled values use a different random number generator
+    np.testing.assert_allclose(
+        summary["mean_resampled_EAF"], expected["mean_resampled_EAF"], atol=0.05
+    )
+
+
+@pytest.mark.parametrize(
+    "thresholds",
+    [
+        {},
+        {"min_unlabeled_sources": 4, "min_labeled_sources": 3},
+        {"min_labeled_fractions": 5},
+    ],
+)
+def test_prefilter_parity_with_qsip2(thresholds: dict[str, int]) -> None:
+    """The pre-filter keeps the features kept by qsip2::run_feature_filter."""
+    pytest.importorskip("rpy2")
+    from kb_qsip.utils import helpers
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.packages import data
+
+    qsip_object = data(helpers.qsip2).fetch("example_qsip_object")[
+        "example_qsip_object"
+    ]
+    params = {**PARAMS_BASE, **thresholds}
+    filtered_feature_ids = robjects.r(
+        """
+        function(qsip_data_object) {
+            filtered <- if (isS4(qsip_data_object)) qsip_data_object@filtered_feature_data
+                else S7::prop(qsip_data_object, "filtered_feature_data")
+            sort(unique(as.character(filtered$feature_id)))
+        }
+        """
+    )
+    expected = list(
+        filtered_feature_ids(helpers.run_feature_filter(qsip_object, params))
+    )
+
+    qsip2_data = data(helpers.qsip2)
+    with (robjects.default_converter + pandas2ri.converter).context():
+        dfs = {
+            src: robjects.conversion.get_conversion().rpy2py(
+                qsip2_data.fetch(f"example_{src}_df")[f"example_{src}_df"]
+            )
+            for src in helpers.PARAM_NAMES
+        }
+    feature_columns = {
+        "row_id": dfs["feature"]["ASV"].to_numpy(dtype=object),
+        **{
+            col: dfs["feature"][col].to_numpy(dtype=np.float64)
+            for col in dfs["feature"].columns
+            if col != "ASV"
+        },
+    }
+    filtered = prefilter_features(
+        feature_columns,
+        dfs["source"].rename(columns={"source": "name"}),
+        dfs["sample"].rename(columns={"sample": "name"}),
+        params,
+    )
+    assert sorted(filtered["row_id"]) == expected
+
+
+def test_prefilter_summary_with_qsip2() -> None:
+    """qSIP2 gives the same EAF summary with and without the pre-filter."""
+    pytest.importorskip("rpy2")
+    from kb_qsip.utils import helpers
+    from kb_qsip.utils.r_convert import columns_to_r_dataframe
+    from rpy2 import robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.packages import data
+
+    qsip2_data = data(helpers.qsip2)
+    r_dfs = {
+        src: qsip2_data.fetch(f"example_{src}_df")[f"example_{src}_df"]
+        for src in helpers.PARAM_NAMES
+    }
+    with (robjects.default_converter + pandas2ri.converter).context():
+        dfs = {
+            src: robjects.conversion.get_conversion().rpy2py(r_df)
+            for src, r_df in r_dfs.items()
+        }
+    feature_columns = {
+        "row_id": dfs["feature"]["ASV"].to_numpy(dtype=object),
+        **{
+            col: dfs["feature"][col].to_numpy(dtype=np.float64)
+            for col in dfs["feature"].columns
+            if col != "ASV"
+        },
+    }
+    # a threshold that drops some of the features
+    params = {**PARAMS_BASE, "resamples": 100, "min_labeled_fractions": 5}
+    filtered = prefilter_features(
+        feature_columns,
+        dfs["source"].rename(columns={"source": "name"}),
+        dfs["sample"].rename(columns={"sample": "name"}),
+        params,
+    )
+    assert len(filtered["row_id"]) < len(feature_columns["row_id"])
+
+    summaries = []
+    # the pre-filtered abundances are relative, as set up by QsipUtil.run
+    for columns, feature_type in [(feature_columns, None), (filtered, "relative")]:
+        qsip_object = example_qsip_object(
+            helpers,
+            r_dfs,
+            helpers.make_feature_object(
+                columns_to_r_dataframe(columns), params, feature_type
+            ),
+        )
+        qsip_object = helpers.run_feature_filter(qsip_object, params)
+        qsip_object = helpers.run_resampling(qsip_object, params)
+        qsip_object = helpers.run_EAF_calculations(qsip_object, params)
+        summaries.append(
+            helpers.summarize_EAF_values(qsip_object, params)
+            .set_index("feature_id")
+            .sort_index()
+        )
+
+    expected, summary = summaries
+    assert list(summary.index) == list(expected.index)
+    np.testing.assert_allclose(
+        summary["observed_EAF"], expected["observed_EAF"], rtol=1e-6
+    )
+    # the random draws of each feature depend on the features before it
+    np.testing.assert_allclose(
+        summary["mean_resampled_EAF"], expected["mean_resampled_EAF"], atol=0.05
+    )
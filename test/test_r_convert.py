@@ -0,0 +1,136 @@
+"""Tests for converting Python data into R objects."""
+
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pytest
+from kb_qsip.utils.r_convert import (
+    columns_to_r_dataframe,
+    numeric_to_r_matrix,
+    pandas_to_r_dataframe,
+    to_r_vector,
+)
+from rpy2 import robjects
+
+r_class = robjects.r["class"]
+r_is_na = robjects.r["is.na"]
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param(
+            {"input": np.array([1, 2, 3]), "class": "integer", "output": [1, 2, 3]},
+            id="int64",
+        ),
+        pytest.param(
+            {
+                "input": np.array([1, 2**40]),
+                "class": "numeric",
+                "output": [1, 2**40],
+            },
+            id="int64_too_big",
+        ),
+        pytest.param(
+            {"input": np.array([0.5, 1.5]), "class": "numeric", "output": [0.5, 1.5]},
+            id="float64",
+        ),
+        pytest.param(
+            {
+                "input": np.array([[1.0, 2.0], [3.0, 4.0]])[:, 1],
+                "class": "numeric",
+                "output": [2.0, 4.0],
+            },
+            id="non_contiguous",
+        ),
+        pytest.param(
+            {
+                "input": np.array([True, False]),
+                "class": "logical",
+                "output": [True, False],
+            },
+            id="bool",
+        ),
+        pytest.param(
+            {"input": ["a", "b"], "class": "character", "output": ["a", "b"]},
+            id="strings",
+        ),
+        pytest.param(
+            {"input": [1, 2.5], "class": "numeric", "output": [1, 2.5]},
+            id="mixed_numbers",
+        ),
+        pytest.param(
+            {"input": [1, "two"], "class": "character", "output": ["1", "two"]},
+            id="mixed_types",
+        ),
+    ],
+)
+def test_to_r_vector(param: dict[str, Any]) -> None:
+    """Check that columns are converted into the appropriate R vector type."""
+    r_vector = to_r_vector(param["input"])
+    assert list(r_class(r_vector)) == [param["class"]]
+    assert list(r_vector) == param["output"]
+
+
+@pytest.mark.parametrize(
+    "param",
+    [
+        pytest.param({"input": ["a", None], "class": "character"}, id="strings"),
+        pytest.param({"input": [1, None], "class": "numeric"}, id="integers"),
+        pytest.param({"input": [1.5, None], "class": "numeric"}, id="floats"),
+        pytest.param({"input": [True, None], "class": "logical"}, id="bools"),
+    ],
+)
+def test_to_r_vector_missing_values(param: dict[str, Any]) -> None:
+    """Missing values are converted to NA."""
+    r_vector = to_r_vector(param["input"])
+    assert list(r_class(r_vector)) == [param["class"]]
+    assert list(r_is_na(r_vector)) == [False, True]
+
+
+def test_to_r_vector_categorical() -> None:
+    """Categorical data is converted into a factor."""
+    factor = to_r_vector(pd.Categorical(["b", "a", None, "b"], categories=["b", "a"]))
+    assert list(r_class(factor)) == ["factor"]
+    assert list(factor.levels) == ["b", "a"]
+    assert list(robjects.r["as.character"](factor))[:2] == ["b", "a"]
+    assert list(r_is_na(factor)) == [False, False, True, False]
+
+
+def test_columns_to_r_dataframe() -> None:
+    """Check that column names are preserved and the data is correct."""
+    columns = {
+        "row_id": np.array(["X", "Y"], dtype=object),
+        "16O.16C.5": np.array([1, 3]),
+        "16O.16C.6": np.array([2.5, 4.5]),
+    }
+    r_df = columns_to_r_dataframe(columns)
+    assert list(r_class(r_df)) == ["data.frame"]
+    assert list(r_df.colnames) == list(columns)
+    assert list(r_df.rownames) == ["1", "2"]
+    assert list(r_df.rx2("row_id")) == ["X", "Y"]
+    assert list(r_df.rx2("16O.16C.5")) == [1, 3]
+    assert list(r_df.rx2("16O.16C.6")) == [2.5, 4.5]
+
+    # identical to the pandas2ri conversion
+    pandas_r_df = pandas_to_r_dataframe(pd.DataFrame(columns))
+    assert robjects.r["isTRUE"](robjects.r["all.equal"](r_df, pandas_r_df))[0]
+
+
+def test_columns_to_r_dataframe_fail() -> None:
+    """Columns must all be the same length."""
+    with pytest.raises(ValueError, match="All columns must be the same length"):
+        columns_to_r_dataframe({"a": [1, 2], "b": [1]})
+
+
+def test_numeric_to_r_matrix() -> None:
+    """Check that a 2D array is converted into an R matrix in the correct order."""
+    values = np.array([[1.5, 2.5, 3.5], [4.5, 5.5, 6.5]])
+    r_matrix = numeric_to_r_matrix(values, ["X", "Y"], ["A", "B", "C"])
+    assert list(r_class(r_matrix)) == ["matrix", "array"]
+    assert tuple(r_matrix.dim) == (2, 3)
+    assert list(r_matrix.rownames) == ["X", "Y"]
+    assert list(r_matrix.colnames) == ["A", "B", "C"]
+    assert r_matrix.rx("Y", "A")[0] == values[1, 0]
+    assert r_matrix.rx("X", "C")[0] == values[0, 2]
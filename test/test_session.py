@@ -0,0 +1,160 @@
+"""Tests for the shared HTTP session."""
+
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+
+import pytest
+import requests
+from combinatrix.constants import HTTP_CONNECT_RETRIES, HTTP_POOL_SIZE
+from combinatrix.session import (
+    RequestMetrics,
+    SessionClient,
+    get_session,
+    make_session,
+    metrics,
+)
+from installed_clients.baseclient import BaseClient, ServerError
+
+
+class JSONRPCHandler(BaseHTTPRequestHandler):
+    """Answer every POST with a JSON-RPC result, keeping the connection open.
+
+    Calls to a method called "fail" get a JSON-RPC error.
+    """
+
+    protocol_version = "HTTP/1.1"
+    client_ports: ClassVar[list[int]] = []
+
+    def do_POST(self: "JSONRPCHandler") -> None:  # noqa: N802
+        """Respond to a POST request."""
+        self.client_ports.append(self.client_address[1])
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if request.get("method", "").endswith(".fail"):
+            status = 500
+            body = b'{"version": "1.1", "error": {"name": "JSONRPCError", "code": -32500, "message": "failed"}}'
+        else:
+            status = 200
+            body = b'{"version": "1.1", "result": [{"ok": 1}]}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self: "JSONRPCHandler", *args: object) -> None:
+        """Silence the request logging."""
+
+
+@pytest.fixture(name="server_url")
+def server_url_fixture() -> Iterator[str]:
+    """Run a local JSON-RPC server."""
+    JSONRPCHandler.client_ports = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JSONRPCHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/services/ws"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("with_session", [True, False])
+def test_session_client(server_url: str, with_session: bool) -> None:  # noqa: FBT001
+    """SDK clients using a session reuse the same connection for every call."""
+    client = (
+        SessionClient(server_url, make_session(), token="fake_token")  # noqa: S106
+        if with_session
+        else BaseClient(server_url, token="fake_token")  # noqa: S106
+    )
+    for _ in range(5):
+        assert client.call_method("Workspace.ver", []) == {"ok": 1}
+
+    n_connections = len(set(JSONRPCHandler.client_ports))
+    assert n_connections == (1 if with_session else 5)
+
+
+def test_session_client_error(server_url: str) -> None:
+    """JSON-RPC errors are raised as ServerErrors, as by the SDK clients."""
+    client = SessionClient(server_url, make_session(), token="fake_token")  # noqa: S106
+    with pytest.raises(ServerError, match="failed"):
+        client.call_method("Workspace.fail", [])
+
+
+def test_make_session() -> None:
+    """Check the connection pool and retry settings."""
+    pool_size, connect_retries, retry_backoff = 4, 2, 0.1
+    session = make_session(
+        pool_size=pool_size,
+        connect_retries=connect_retries,
+        retry_backoff=retry_backoff,
+    )
+    adapter = session.get_adapter("https://appdev.kbase.us/services/ws")
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == pool_size
+    assert adapter.max_retries.connect == connect_retries
+    assert adapter.max_retries.read == 0
+    assert adapter.max_retries.backoff_factor == retry_backoff
+    # POST requests are retried too
+    assert adapter.max_retries.allowed_methods is None
+
+
+def test_get_session() -> None:
+    """Sessions are shared between callers with the same settings."""
+    session = get_session({})
+    assert get_session() is session
+    assert get_session({"http-pool-size": str(HTTP_POOL_SIZE)}) is session
+    pool_size = 3
+    other = get_session({"http-pool-size": str(pool_size), "http-connect-retries": "0"})
+    assert other is not session
+    adapter = other.get_adapter("https://appdev.kbase.us")
+    assert adapter.poolmanager.connection_pool_kw["maxsize"] == pool_size
+    assert adapter.max_retries.connect == 0
+    assert (
+        session.get_adapter("https://appdev.kbase.us").max_retries.connect
+        == HTTP_CONNECT_RETRIES
+    )
+
+
+def test_get_session_metrics(server_url: str) -> None:
+    """Requests made with the shared session are timed."""
+    metrics.reset()
+    session = get_session()
+    n_calls = 3
+    for _ in range(n_calls):
+        session.post(server_url + "?query=1", data="{}")
+    summary = metrics.summary()
+    assert list(summary) == [server_url]
+    assert summary[server_url]["calls"] == n_calls
+
+
+def test_request_metrics() -> None:
+    """Check the latency summary."""
+    request_metrics = RequestMetrics()
+    request_metrics.record("https://kbase.us/services/ws", 0.5)
+    request_metrics.record("https://kbase.us/services/ws", 1.5)
+    request_metrics.record("https://kbase.us/services/sampleservice?x=y", 0.25)
+    assert request_metrics.summary() == {
+        "https://kbase.us/services/ws": {
+            "calls": 2,
+            "total": 2.0,
+            "mean": 1.0,
+            "max": 1.5,
+        },
+        "https://kbase.us/services/sampleservice": {
+            "calls": 1,
+            "total": 0.25,
+            "mean": 0.25,
+            "max": 0.25,
+        },
+    }
+    request_metrics.reset()
+    assert request_metrics.summary() == {}
+
+
+def test_session_connect_error() -> None:
+    """Connection errors are raised once the retries are used up."""
+    session = make_session(connect_retries=1, retry_backoff=0)
+    with pytest.raises(requests.ConnectionError):
+        # nothing listens on port 9 (discard) locally
+        session.post("http://127.0.0.1:9/services/ws", data="{}", timeout=5)
@@ -0,0 +1,82 @@
+"""Tests for the warm start worker processes."""
+
+import os
+import threading
+from typing import Any
+
+import pytest
+from kb_qsip.utils import warm_start
+
+STATE = {"jobs": 0}
+
+
+def record_job(value: int) -> dict[str, int]:
+    """Modify the module state and return the worker's pid and state."""
+    STATE["jobs"] += 1
+    return {"pid": os.getpid(), "jobs": STATE["jobs"], "value": value}
+
+
+def fail(message: str) -> None:
+    """Raise an error."""
+    raise ValueError(message)
+
+
+def return_unpicklable() -> threading.Lock:
+    """Return something that cannot be sent back to the parent."""
+    return threading.Lock()
+
+
+def crash() -> None:
+    """Exit without returning a result."""
+    os._exit(3)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("true", True),
+        (" True ", True),
+        ("false", False),
+        ("", False),
+        (None, False),
+    ],
+)
+def test_is_enabled(value: str | None, *, expected: bool) -> None:
+    """Check that warm start mode is only enabled if explicitly set to true."""
+    config: dict[str, Any] = {}
+    if value is not None:
+        config[warm_start.WARM_START_KEY] = value
+    assert warm_start.is_enabled(config) is expected
+
+
+def test_run_in_worker() -> None:
+    """Jobs run in a separate process and do not change the state of the parent."""
+    value = 5
+    for _ in range(2):
+        result = warm_start.run_in_worker(record_job, value=value)
+        assert result["pid"] != os.getpid()
+        assert result["value"] == value
+        # each worker starts from the parent's state
+        assert result["jobs"] == 1
+    assert STATE["jobs"] == 0
+
+
+def test_run_in_worker_error() -> None:
+    """Exceptions raised in the worker are re-raised with the worker traceback attached."""
+    with pytest.raises(ValueError, match="something went wrong") as exc_info:
+        warm_start.run_in_worker(fail, "something went wrong")
+    cause = exc_info.value.__cause__
+    assert isinstance(cause, warm_start.WorkerTracebackError)
+    assert "in fail" in str(cause)
+
+
+def test_run_in_worker_unpicklable_result() -> None:
+    """Results that cannot be returned to the parent raise an error."""
+    with pytest.raises(RuntimeError, match="return value of return_unpicklable"):
+        warm_start.run_in_worker(return_unpicklable)
+
+
+def test_run_in_worker_crash() -> None:
+    """Workers that exit without returning a result raise an error."""
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        warm_start.run_in_worker(crash)